@@ -1,14 +1,17 @@
-"""Authentication module: JWT + bcrypt password hashing."""
+"""Authentication module: JWT + scrypt password hashing."""
 import os
-from datetime import datetime, timedelta, timezone
+import threading
+import time
+from collections import OrderedDict
 from typing import Optional
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import hashlib
 import hmac
-import json
 import base64
+import binascii
+import orjson
 
 security = HTTPBearer(auto_error=False)
 
@@ -16,16 +19,63 @@ JWT_SECRET = os.getenv("JWT_SECRET", "fundval-live-jwt-secret-change-in-producti
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRE_HOURS = 72
 
+_JWT_SECRET_BYTES = JWT_SECRET.encode()
+# HMAC with the key schedule (ipad/opad blocks) already absorbed; copied per signature
+_hmac_primer = hmac.new(_JWT_SECRET_BYTES, b"", hashlib.sha256)
+
+# Verified-token cache: blake2b-128(token) -> (payload, cached_at).
+# Only successful verifications are cached; exp is re-checked on every hit.
+_TOKEN_CACHE_MAXSIZE = 10000
+_TOKEN_CACHE_TTL = 30
+_token_cache: "OrderedDict[bytes, tuple]" = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+# Failed-login limiter: (client ip, username) -> (failures, window_start).
+# Once a key hits the limit, login is refused without running scrypt until the window ends.
+LOGIN_MAX_FAILURES = 10
+LOGIN_FAILURE_WINDOW = 300
+_LOGIN_TRACK_MAXSIZE = 10000
+_login_failures: "OrderedDict[tuple, tuple]" = OrderedDict()
+_login_failures_lock = threading.Lock()
+
+
+# scrypt parameters: N=2^14, r=8, p=1 (~16MB, memory-hard).
+# SCRYPT_N only affects new hashes (the test conftest lowers it); verification reads N from the stored hash.
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+_SCRYPT_PREFIX = "scrypt$"
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r * p, dklen=32)
+
 
 def hash_password(password: str) -> str:
-    """Hash password with salt using SHA-256 (no extra deps)."""
+    """Hash password with a random salt using scrypt.
+
+    Format: scrypt$N$r$p$<b64 salt>$<b64 hash>"""
     salt = os.urandom(16)
-    pw_hash = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, 100000)
-    return base64.b64encode(salt + pw_hash).decode()
+    pw_hash = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return "$".join([
+        "scrypt", str(SCRYPT_N), str(SCRYPT_R), str(SCRYPT_P),
+        base64.b64encode(salt).decode(), base64.b64encode(pw_hash).decode(),
+    ])
 
 
 def verify_password(password: str, stored_hash: str) -> bool:
-    """Verify password against stored hash."""
+    """Verify password against stored hash (scrypt, or legacy PBKDF2)."""
+    if stored_hash.startswith(_SCRYPT_PREFIX):
+        try:
+            _, n, r, p, salt_b64, hash_b64 = stored_hash.split("$")
+            salt = base64.b64decode(salt_b64)
+            stored_pw_hash = base64.b64decode(hash_b64)
+            pw_hash = _scrypt(password, salt, int(n), int(r), int(p))
+        except (ValueError, TypeError):
+            return False
+        return hmac.compare_digest(pw_hash, stored_pw_hash)
+
+    # Legacy format: base64(16-byte salt + pbkdf2_sha256 100k)
     decoded = base64.b64decode(stored_hash.encode())
     salt = decoded[:16]
     stored_pw_hash = decoded[16:]
@@ -33,44 +83,135 @@ def verify_password(password: str, stored_hash: str) -> bool:
     return hmac.compare_digest(pw_hash, stored_pw_hash)
 
 
+def password_needs_rehash(stored_hash: str) -> bool:
+    """True if the stored hash is not scrypt with the current parameters."""
+    return not stored_hash.startswith(f"{_SCRYPT_PREFIX}{SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+
+
+_dummy_hash: Optional[str] = None
+
+
+def verify_dummy_password(password: str) -> bool:
+    """Spend one scrypt on a throwaway hash so unknown usernames cost the same as wrong passwords."""
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(os.urandom(16).hex())
+    verify_password(password, _dummy_hash)
+    return False
+
+
+def login_blocked(key: tuple) -> bool:
+    with _login_failures_lock:
+        entry = _login_failures.get(key)
+        if entry is None:
+            return False
+        failures, started = entry
+        if time.monotonic() - started > LOGIN_FAILURE_WINDOW:
+            del _login_failures[key]
+            return False
+        return failures >= LOGIN_MAX_FAILURES
+
+
+def record_login_failure(key: tuple):
+    now = time.monotonic()
+    with _login_failures_lock:
+        failures, started = _login_failures.get(key, (0, now))
+        if now - started > LOGIN_FAILURE_WINDOW:
+            failures, started = 0, now
+        _login_failures[key] = (failures + 1, started)
+        _login_failures.move_to_end(key)
+        while len(_login_failures) > _LOGIN_TRACK_MAXSIZE:
+            _login_failures.popitem(last=False)
+
+
+def clear_login_failures(key: tuple):
+    with _login_failures_lock:
+        _login_failures.pop(key, None)
+
+
+_B64URL_ENCODE = bytes.maketrans(b"+/", b"-_")
+_B64URL_DECODE = bytes.maketrans(b"-_", b"+/")
+
+
 def _b64url_encode(data: bytes) -> str:
-    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+    return binascii.b2a_base64(data, newline=False).translate(_B64URL_ENCODE).rstrip(b"=").decode()
 
 
 def _b64url_decode(s: str) -> bytes:
-    s += "=" * (4 - len(s) % 4)
-    return base64.urlsafe_b64decode(s)
+    # a2b_base64 tolerates surplus padding, so a fixed "==" covers every length
+    return binascii.a2b_base64(s.encode().translate(_B64URL_DECODE) + b"==")
+
+
+def _sign(signing_input: bytes) -> bytes:
+    # Faster than the one-shot hmac.digest(), which redoes the key schedule per call
+    h = _hmac_primer.copy()
+    h.update(signing_input)
+    return h.digest()
 
 
 def create_access_token(user_id: int, username: str, role: str) -> str:
     """Create a JWT token."""
-    header = _b64url_encode(json.dumps({"alg": "HS256", "typ": "JWT"}).encode())
+    header = _b64url_encode(orjson.dumps({"alg": "HS256", "typ": "JWT"}))
     payload_data = {
         "sub": user_id,
         "username": username,
         "role": role,
-        "exp": int((datetime.now(timezone.utc) + timedelta(hours=JWT_EXPIRE_HOURS)).timestamp()),
+        "exp": int(time.time()) + JWT_EXPIRE_HOURS * 3600,
     }
-    payload = _b64url_encode(json.dumps(payload_data).encode())
-    signature = hmac.new(JWT_SECRET.encode(), f"{header}.{payload}".encode(), hashlib.sha256).digest()
-    sig = _b64url_encode(signature)
-    return f"{header}.{payload}.{sig}"
+    signing_input = f"{header}.{_b64url_encode(orjson.dumps(payload_data))}"
+    signature = _sign(signing_input.encode())
+    return f"{signing_input}.{_b64url_encode(signature)}"
+
+
+def _token_cache_get(key: bytes) -> Optional[dict]:
+    with _token_cache_lock:
+        entry = _token_cache.get(key)
+        if entry is None:
+            return None
+        payload_data, cached_at = entry
+        if time.monotonic() - cached_at > _TOKEN_CACHE_TTL:
+            del _token_cache[key]
+            return None
+        _token_cache.move_to_end(key)
+        return payload_data
+
+
+def _token_cache_put(key: bytes, payload_data: dict):
+    with _token_cache_lock:
+        _token_cache[key] = (payload_data, time.monotonic())
+        _token_cache.move_to_end(key)
+        while len(_token_cache) > _TOKEN_CACHE_MAXSIZE:
+            _token_cache.popitem(last=False)
+
+
+def _token_cache_key(token: str) -> bytes:
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
 
 
 def decode_token(token: str) -> Optional[dict]:
     """Decode and verify a JWT token."""
     try:
-        parts = token.split(".")
-        if len(parts) != 3:
+        cache_key = _token_cache_key(token)
+        cached = _token_cache_get(cache_key)
+        if cached is not None:
+            if cached.get("exp", 0) < time.time():
+                return None
+            return dict(cached)
+
+        if token.count(".") != 2:
             return None
-        header, payload, sig = parts
-        expected_sig = hmac.new(JWT_SECRET.encode(), f"{header}.{payload}".encode(), hashlib.sha256).digest()
-        if not hmac.compare_digest(_b64url_decode(sig), expected_sig):
+        # header.payload is exactly the signing input; compare signatures in
+        # their canonical b64url form so non-canonical encodings are rejected
+        sig_idx = token.rindex(".")
+        signing_input = token[:sig_idx]
+        expected_sig = _sign(signing_input.encode())
+        if not hmac.compare_digest(token[sig_idx + 1:], _b64url_encode(expected_sig)):
             return None
-        payload_data = json.loads(_b64url_decode(payload))
-        if payload_data.get("exp", 0) < datetime.now(timezone.utc).timestamp():
+        payload_data = orjson.loads(_b64url_decode(signing_input[signing_input.index(".") + 1:]))
+        if payload_data.get("exp", 0) < time.time():
             return None
-        return payload_data
+        _token_cache_put(cache_key, payload_data)
+        return dict(payload_data)
     except Exception:
         return None
 
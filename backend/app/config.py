@@ -1,5 +1,6 @@
 import os
 import sys
+import time
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -15,35 +16,78 @@ if not getattr(sys, 'frozen', False):
     load_dotenv(BASE_DIR.parent / ".env")
 
 
+# Config 从数据库读取的键；固定 SQL 文本，只取需要的行
+_CONFIG_KEYS = (
+    "OPENAI_API_KEY", "OPENAI_API_BASE", "AI_MODEL_NAME",
+    "SMTP_HOST", "SMTP_PORT", "SMTP_USER", "SMTP_PASSWORD", "EMAIL_FROM",
+)
+_SETTINGS_QUERY = "SELECT `key`, value, encrypted FROM settings WHERE `key` IN ({})".format(
+    ", ".join(f"'{k}'" for k in _CONFIG_KEYS)
+)
+
+# 数据库配置缓存：一次查询 + 解密，TTL 内复用
+_SETTINGS_CACHE_TTL = 60
+_settings_cache = None
+_settings_cache_ts = 0.0
+
+
+def _invalidate_settings_cache():
+    global _settings_cache
+    _settings_cache = None
+
+
 def _load_settings_from_db():
-    """从数据库读取配置，解密加密字段"""
+    """从数据库读取配置，解密加密字段（结果缓存 _SETTINGS_CACHE_TTL 秒）"""
+    global _settings_cache, _settings_cache_ts
+    if _settings_cache is not None and time.monotonic() - _settings_cache_ts < _SETTINGS_CACHE_TTL:
+        return _settings_cache
     try:
         from .db import get_db_connection, release_db_connection, dict_cursor
-        from .crypto import decrypt_value
+        from .crypto import get_fernet, decrypt_with
 
         conn = get_db_connection()
         cur = dict_cursor(conn)
-        cur.execute("SELECT `key`, value, encrypted FROM settings")
+        cur.execute(_SETTINGS_QUERY)
         rows = cur.fetchall()
         release_db_connection(conn)
 
+        fernet = None
         settings = {}
         for row in rows:
             key, value, encrypted = row["key"], row["value"], row["encrypted"]
             if encrypted and value:
-                value = decrypt_value(value)
+                if fernet is None:
+                    fernet = get_fernet()
+                value = decrypt_with(fernet, value)
             settings[key] = value
-        return settings
     except Exception:
         return {}
-
-
-def _get_setting(key: str, default: str = "") -> str:
+    _settings_cache = settings
+    _settings_cache_ts = time.monotonic()
+    return settings
+
+
+def _merge_settings_cache(updates: dict):
+    """把刚写入的明文配置合并进仍在 TTL 内的缓存；缓存缺失或过期时返回 None。"""
+    global _settings_cache, _settings_cache_ts
+    if _settings_cache is None or time.monotonic() - _settings_cache_ts >= _SETTINGS_CACHE_TTL:
+        return None
+    merged = dict(_settings_cache)
+    for key, value in updates.items():
+        if key in _CONFIG_KEYS:
+            merged[key] = None if value is None else str(value)
+    _settings_cache = merged
+    _settings_cache_ts = time.monotonic()
+    return merged
+
+
+def _get_setting(key: str, default: str = "", db_settings: dict = None) -> str:
     """获取配置，优先级：环境变量 > 数据库 > 默认值"""
     env_val = os.getenv(key)
     if env_val:
         return env_val
-    db_settings = _load_settings_from_db()
+    if db_settings is None:
+        db_settings = _load_settings_from_db()
     if key in db_settings and db_settings[key]:
         return db_settings[key]
     return default
@@ -90,11 +134,25 @@ class Config:
     @classmethod
     def reload(cls):
         """重新加载配置（在设置更新后调用）"""
-        cls.OPENAI_API_KEY = _get_setting("OPENAI_API_KEY", "")
-        cls.OPENAI_API_BASE = _get_setting("OPENAI_API_BASE", "https://api.openai.com/v1")
-        cls.AI_MODEL_NAME = _get_setting("AI_MODEL_NAME", "gpt-3.5-turbo")
-        cls.SMTP_HOST = _get_setting("SMTP_HOST", "smtp.gmail.com")
-        cls.SMTP_PORT = int(_get_setting("SMTP_PORT", "587"))
-        cls.SMTP_USER = _get_setting("SMTP_USER", "")
-        cls.SMTP_PASSWORD = _get_setting("SMTP_PASSWORD", "")
-        cls.EMAIL_FROM = _get_setting("EMAIL_FROM", "noreply@fundval.live")
+        _invalidate_settings_cache()
+        cls._apply(_load_settings_from_db())
+
+    @classmethod
+    def update_in_place(cls, updates: dict):
+        """设置保存后调用：updates 为刚写入的明文值，缓存有效时就地合并，否则完整重载"""
+        db = _merge_settings_cache(updates)
+        if db is None:
+            cls.reload()
+            return
+        cls._apply(db)
+
+    @classmethod
+    def _apply(cls, db: dict):
+        cls.OPENAI_API_KEY = _get_setting("OPENAI_API_KEY", "", db)
+        cls.OPENAI_API_BASE = _get_setting("OPENAI_API_BASE", "https://api.openai.com/v1", db)
+        cls.AI_MODEL_NAME = _get_setting("AI_MODEL_NAME", "gpt-3.5-turbo", db)
+        cls.SMTP_HOST = _get_setting("SMTP_HOST", "smtp.gmail.com", db)
+        cls.SMTP_PORT = int(_get_setting("SMTP_PORT", "587", db))
+        cls.SMTP_USER = _get_setting("SMTP_USER", "", db)
+        cls.SMTP_PASSWORD = _get_setting("SMTP_PASSWORD", "", db)
+        cls.EMAIL_FROM = _get_setting("EMAIL_FROM", "noreply@fundval.live", db)
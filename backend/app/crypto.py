@@ -1,9 +1,12 @@
 import os
 import sys
+import time
 import base64
-import hashlib
+from functools import lru_cache
 from pathlib import Path
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
 def _get_key_file_path():
     """动态获取密钥文件路径，避免循环依赖"""
@@ -14,38 +17,68 @@ def _get_key_file_path():
 
     return base_dir / "data" / ".encryption_key"
 
+_KEY_PATH = _get_key_file_path()
+
+@lru_cache(maxsize=1)
 def _get_or_create_key():
-    """获取或创建主加密密钥"""
-    key_file = _get_key_file_path()
+    """获取或创建主加密密钥（进程内缓存，轮换密钥后需调用 clear_key_cache）"""
+    key_file = _KEY_PATH
 
-    if key_file.exists():
+    try:
         with open(key_file, "rb") as f:
             return f.read()
-    else:
-        key = Fernet.generate_key()
-        key_file.parent.mkdir(parents=True, exist_ok=True)
-        with open(key_file, "wb") as f:
-            f.write(key)
-        os.chmod(key_file, 0o600)
-        return key
+    except FileNotFoundError:
+        pass
 
+    # 多个 worker 同时冷启动时，O_EXCL 保证只有一个进程写入密钥，其余读取已有文件
+    key = Fernet.generate_key()
+    key_file.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # 另一个进程刚创建文件，可能尚未写完，短暂等待内容落盘
+        for _ in range(50):
+            with open(key_file, "rb") as f:
+                existing = f.read()
+            if existing:
+                return existing
+            time.sleep(0.01)
+        raise RuntimeError(f"Encryption key file is empty: {key_file}")
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    return key
+
+@lru_cache(maxsize=1024)
 def _derive_user_key(user_id: int) -> bytes:
     """从主密钥派生用户级别的加密密钥（HKDF-like derivation）。
     每个用户拥有独立的派生密钥，主密钥泄露后仍需知道 user_id 才能解密。"""
     master_key = _get_or_create_key()
     # 使用 PBKDF2 从 master_key + user_id 派生 32 字节密钥
     salt = f"fundval-user-{user_id}".encode()
-    derived = hashlib.pbkdf2_hmac("sha256", master_key, salt, 100000)
+    # 与此前 hashlib.pbkdf2_hmac 同算法、同迭代次数，派生结果逐字节一致，既有密文仍可解密
+    kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=100000)
+    derived = kdf.derive(master_key)
     # Fernet 需要 url-safe base64 编码的 32 字节密钥
     return base64.urlsafe_b64encode(derived)
 
+@lru_cache(maxsize=1024)
+def get_fernet(user_id: int = None) -> Fernet:
+    """获取（缓存的）Fernet 实例：user_id 为 None 时使用全局主密钥。"""
+    key = _derive_user_key(user_id) if user_id is not None else _get_or_create_key()
+    return Fernet(key)
+
+def clear_key_cache():
+    """清空主密钥、派生密钥和 Fernet 实例缓存（密钥文件轮换后调用）"""
+    get_fernet.cache_clear()
+    _derive_user_key.cache_clear()
+    _get_or_create_key.cache_clear()
+
 def encrypt_value(plaintext: str, user_id: int = None) -> str:
     """加密字符串。如果提供 user_id，使用用户派生密钥；否则使用全局主密钥。"""
     if not plaintext:
         return ""
     try:
-        key = _derive_user_key(user_id) if user_id is not None else _get_or_create_key()
-        f = Fernet(key)
+        f = get_fernet(user_id)
         encrypted = f.encrypt(plaintext.encode())
         return encrypted.decode()
     except Exception as e:
@@ -57,10 +90,18 @@ def decrypt_value(ciphertext: str, user_id: int = None) -> str:
     if not ciphertext:
         return ""
     try:
-        key = _derive_user_key(user_id) if user_id is not None else _get_or_create_key()
-        f = Fernet(key)
-        decrypted = f.decrypt(ciphertext.encode())
-        return decrypted.decode()
+        f = get_fernet(user_id)
+    except Exception as e:
+        print(f"Decryption error: {e}")
+        return ""
+    return decrypt_with(f, ciphertext)
+
+def decrypt_with(f: Fernet, ciphertext: str) -> str:
+    """使用已获取的 Fernet 实例解密，批量解密时在循环外调用 get_fernet 一次。"""
+    if not ciphertext:
+        return ""
+    try:
+        return f.decrypt(ciphertext.encode()).decode()
     except Exception as e:
         print(f"Decryption error: {e}")
         return ""
@@ -5,20 +5,29 @@ from fastapi.responses import FileResponse
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import JSONResponse
 from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import os
 import sys
 import json
 import logging
 from logging.handlers import RotatingFileHandler
 
+import anyio.to_thread
+
 from .routers import funds, ai, account, settings, data, auth, admin
 from .db import init_db
 from .config import Config
 from .services.scheduler import start_scheduler
+from .services.fund import open_valuation_client, close_valuation_client
 
 # Request size limit (10MB)
 MAX_REQUEST_SIZE = 10 * 1024 * 1024
 
+# 阻塞式数据库 / 行情请求的工作线程数。同步路由跑在 AnyIO 线程池（默认 40），
+# asyncio.to_thread 跑在事件循环默认执行器（默认 min(32, CPU+4)），两者统一定容
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "64"))
+
 # 配置日志系统
 def setup_logging():
     """配置日志：控制台 INFO，文件 WARNING+"""
@@ -107,12 +116,17 @@ APP_VERSION = get_version()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="worker")
+    )
+    anyio.to_thread.current_default_thread_limiter().total_tokens = WORKER_THREADS
     init_db()
     Config._ensure_loaded()
     start_scheduler()
+    await open_valuation_client()
     yield
     # Shutdown
-    pass
+    await close_valuation_client()
 
 app = FastAPI(title="Fund Intraday Valuation API", lifespan=lifespan)
 
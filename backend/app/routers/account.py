@@ -1,58 +1,74 @@
+import asyncio
 from fastapi import APIRouter, HTTPException, Body, Query, Depends
-from pydantic import BaseModel
+from fastapi.responses import Response
+import orjson
+from pydantic import BaseModel, ConfigDict
 from typing import Dict, Any, Optional, List
+from datetime import datetime
 
 from ..services.account import get_all_positions, upsert_position, remove_position
-from ..services.trade import add_position_trade, reduce_position_trade, list_transactions
-from ..db import get_db_connection, release_db_connection, dict_cursor
+from ..services.trade import add_position_trade, reduce_position_trade, list_transactions, MAX_TRANSACTIONS_LIMIT
+from ..services.fund import get_fund_history
+from ..db import get_db, get_conn, dict_cursor, tuple_cursor
 from ..auth import get_current_user
 
 router = APIRouter()
 
 class AccountModel(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     name: str
     description: Optional[str] = ""
 
 class PositionModel(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     code: str
     cost: float
     shares: float
 
 class AddTradeModel(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     amount: float
-    trade_time: Optional[str] = None
+    trade_time: Optional[datetime] = None
 
 class ReduceTradeModel(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     shares: float
-    trade_time: Optional[str] = None
+    trade_time: Optional[datetime] = None
+
+
+def _naive(ts: Optional[datetime]) -> Optional[datetime]:
+    """交易时间按用户填写的墙上时间处理，丢弃时区信息。"""
+    return ts.replace(tzinfo=None) if ts and ts.tzinfo else ts
 
 
 def _verify_account_ownership(account_id: int, user_id: int):
-    """Verify that the account belongs to the user."""
-    conn = get_db_connection()
-    cur = dict_cursor(conn)
-    cur.execute("SELECT id FROM accounts WHERE id = %s AND user_id = %s", (account_id, user_id))
-    row = cur.fetchone()
-    release_db_connection(conn)
+    """Verify that the account belongs to the user.
+
+    Hot paths fold the ownership check into their own statement and only fall
+    back to this when that statement matched nothing."""
+    with get_db() as conn:
+        cur = tuple_cursor(conn)
+        cur.execute("SELECT 1 FROM accounts WHERE id = %s AND user_id = %s", (account_id, user_id))
+        row = cur.fetchone()
     if not row:
         raise HTTPException(status_code=403, detail="无权访问该账户")
 
 
 @router.get("/accounts")
-def list_accounts(user: dict = Depends(get_current_user)):
-    conn = get_db_connection()
+def list_accounts(user: dict = Depends(get_current_user), conn=Depends(get_conn)):
     cur = dict_cursor(conn)
     try:
         cur.execute("SELECT * FROM accounts WHERE user_id = %s ORDER BY id", (user["id"],))
-        return {"accounts": cur.fetchall()}
+        return Response(orjson.dumps({"accounts": cur.fetchall()}), media_type="application/json")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        release_db_connection(conn)
 
 @router.post("/accounts")
-def create_account(data: AccountModel, user: dict = Depends(get_current_user)):
-    conn = get_db_connection()
+def create_account(data: AccountModel, user: dict = Depends(get_current_user), conn=Depends(get_conn)):
     cur = dict_cursor(conn)
     try:
         cur.execute(
@@ -67,45 +83,52 @@ def create_account(data: AccountModel, user: dict = Depends(get_current_user)):
         if "unique" in str(e).lower():
             raise HTTPException(status_code=400, detail="账户名称已存在")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        release_db_connection(conn)
 
 @router.put("/accounts/{account_id}")
-def update_account(account_id: int, data: AccountModel, user: dict = Depends(get_current_user)):
-    _verify_account_ownership(account_id, user["id"])
-    conn = get_db_connection()
+def update_account(account_id: int, data: AccountModel, user: dict = Depends(get_current_user), conn=Depends(get_conn)):
     cur = dict_cursor(conn)
     try:
         cur.execute(
             "UPDATE accounts SET name = %s, description = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s AND user_id = %s",
             (data.name, data.description, account_id, user["id"])
         )
+        if cur.rowcount == 0:
+            raise HTTPException(status_code=403, detail="无权访问该账户")
         conn.commit()
         return {"status": "ok"}
+    except HTTPException:
+        raise
     except Exception as e:
         conn.rollback()
         if "unique" in str(e).lower():
             raise HTTPException(status_code=400, detail="账户名称已存在")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        release_db_connection(conn)
 
 @router.delete("/accounts/{account_id}")
-def delete_account(account_id: int, user: dict = Depends(get_current_user)):
-    _verify_account_ownership(account_id, user["id"])
-    conn = get_db_connection()
+def delete_account(account_id: int, user: dict = Depends(get_current_user), conn=Depends(get_conn)):
     cur = dict_cursor(conn)
     try:
-        # Check if it's the only account
-        cur.execute("SELECT COUNT(*) as cnt FROM accounts WHERE user_id = %s", (user["id"],))
-        if cur.fetchone()["cnt"] <= 1:
-            raise HTTPException(status_code=400, detail="至少保留一个账户")
-
-        cur.execute("SELECT COUNT(*) as cnt FROM positions WHERE account_id = %s", (account_id,))
-        if cur.fetchone()["cnt"] > 0:
-            raise HTTPException(status_code=400, detail="账户下有持仓，无法删除")
-
-        cur.execute("DELETE FROM accounts WHERE id = %s AND user_id = %s", (account_id, user["id"]))
+        # Happy path is a single conditional DELETE; the count sits in a derived
+        # table so MySQL materializes it instead of rejecting the self-reference
+        cur.execute("""
+            DELETE a FROM accounts a
+            JOIN (SELECT COUNT(*) AS n FROM accounts WHERE user_id = %s) c ON c.n > 1
+            WHERE a.id = %s AND a.user_id = %s
+              AND NOT EXISTS (SELECT 1 FROM positions p WHERE p.account_id = a.id)
+        """, (user["id"], account_id, user["id"]))
+        if cur.rowcount == 0:
+            cur.execute("""
+                SELECT (SELECT COUNT(*) FROM accounts WHERE id = %s AND user_id = %s) AS owned,
+                       (SELECT COUNT(*) FROM accounts WHERE user_id = %s) AS n,
+                       (SELECT COUNT(*) FROM positions WHERE account_id = %s) AS p
+            """, (account_id, user["id"], user["id"], account_id))
+            row = cur.fetchone()
+            if not row["owned"]:
+                raise HTTPException(status_code=403, detail="无权访问该账户")
+            if row["n"] <= 1:
+                raise HTTPException(status_code=400, detail="至少保留一个账户")
+            if row["p"] > 0:
+                raise HTTPException(status_code=400, detail="账户下有持仓，无法删除")
         conn.commit()
         return {"status": "ok"}
     except HTTPException:
@@ -113,63 +136,90 @@ def delete_account(account_id: int, user: dict = Depends(get_current_user)):
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        release_db_connection(conn)
 
 @router.get("/account/positions")
-def get_positions(account_id: int = Query(1), user: dict = Depends(get_current_user)):
-    if account_id != 0:
-        _verify_account_ownership(account_id, user["id"])
+async def get_positions(account_id: int = Query(1), user: dict = Depends(get_current_user)):
     try:
-        return get_all_positions(account_id, user_id=user["id"])
+        result = await get_all_positions(account_id, user_id=user["id"])
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if account_id != 0 and not result["positions"]:
+        # Empty result: either an empty account or someone else's
+        await asyncio.to_thread(_verify_account_ownership, account_id, user["id"])
+    return result
 
-@router.post("/account/positions/update-nav")
-def update_positions_nav(account_id: int = Query(1), user: dict = Depends(get_current_user)):
-    import time as _time
-    from datetime import datetime
-    from ..services.fund import get_fund_history
-
-    if account_id != 0:
-        _verify_account_ownership(account_id, user["id"])
-
-    conn = get_db_connection()
-    cur = dict_cursor(conn)
-    try:
+def _list_position_codes(account_id: int, user_id: int) -> List[str]:
+    # 拉取净值耗时较长，查询完即归还连接
+    with get_db() as conn:
+        cur = dict_cursor(conn)
         if account_id == 0:
             cur.execute("""
                 SELECT DISTINCT p.code FROM positions p
                 JOIN accounts a ON p.account_id = a.id
                 WHERE a.user_id = %s AND p.shares > 0
-            """, (user["id"],))
+            """, (user_id,))
         else:
-            cur.execute("SELECT DISTINCT code FROM positions WHERE account_id = %s AND shares > 0", (account_id,))
+            cur.execute("""
+                SELECT DISTINCT p.code FROM positions p
+                JOIN accounts a ON p.account_id = a.id
+                WHERE p.account_id = %s AND a.user_id = %s AND p.shares > 0
+            """, (account_id, user_id))
         codes = [row["code"] for row in cur.fetchall()]
-    finally:
-        release_db_connection(conn)
+    if not codes and account_id != 0:
+        _verify_account_ownership(account_id, user_id)
+    return codes
+
+
+def _latest_nav_dates(codes: List[str]) -> Dict[str, str]:
+    """一次查询取出每只基金本地最新净值日期。"""
+    placeholders = ", ".join(["%s"] * len(codes))
+    with get_db() as conn:
+        cur = tuple_cursor(conn)
+        cur.execute(
+            f"SELECT code, MAX(date) AS latest FROM fund_history WHERE code IN ({placeholders}) GROUP BY code",
+            codes
+        )
+        return dict(cur.fetchall())
 
+
+# 同时拉取净值的基金数上限（数据源限流）
+NAV_FETCH_CONCURRENCY = 5
+
+@router.post("/account/positions/update-nav")
+async def update_positions_nav(account_id: int = Query(1), user: dict = Depends(get_current_user)):
+
+    codes = await asyncio.to_thread(_list_position_codes, account_id, user["id"])
     if not codes:
         return {"ok": True, "message": "无持仓基金", "updated": 0, "pending": 0, "failed": 0}
 
     today = datetime.now().strftime("%Y-%m-%d")
-    updated = 0
+    # 本地已有当日净值的无需再请求数据源
+    latest = await asyncio.to_thread(_latest_nav_dates, codes)
+    stale = [c for c in codes if latest.get(c) != today]
+    sem = asyncio.Semaphore(NAV_FETCH_CONCURRENCY)
+
+    async def fetch(code):
+        async with sem:
+            try:
+                return await asyncio.to_thread(get_fund_history, code, limit=5)
+            finally:
+                await asyncio.sleep(0.3)
+
+    results = await asyncio.gather(*(fetch(c) for c in stale), return_exceptions=True)
+
+    updated = len(codes) - len(stale)
     pending = 0
     failed = []
-
-    for code in codes:
-        try:
-            history = get_fund_history(code, limit=5)
-            if history:
-                if history[-1]["date"] == today:
-                    updated += 1
-                else:
-                    pending += 1
+    for code, history in zip(stale, results):
+        if isinstance(history, Exception):
+            failed.append({"code": code, "error": str(history)})
+        elif history:
+            if history[-1]["date"] == today:
+                updated += 1
             else:
-                failed.append({"code": code, "error": "无历史数据"})
-            _time.sleep(0.3)
-        except Exception as e:
-            failed.append({"code": code, "error": str(e)})
+                pending += 1
+        else:
+            failed.append({"code": code, "error": "无历史数据"})
 
     msg_parts = []
     if updated > 0: msg_parts.append(f"{updated} 个已更新当日净值")
@@ -185,35 +235,30 @@ def update_positions_nav(account_id: int = Query(1), user: dict = Depends(get_cu
 
 @router.post("/account/positions")
 def update_position(data: PositionModel, account_id: int = Query(1), user: dict = Depends(get_current_user)):
-    _verify_account_ownership(account_id, user["id"])
     try:
-        upsert_position(account_id, data.code, data.cost, data.shares)
-        return {"status": "ok"}
+        hit = upsert_position(account_id, data.code, data.cost, data.shares, user_id=user["id"])
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if not hit:
+        raise HTTPException(status_code=403, detail="无权访问该账户")
+    return {"status": "ok"}
 
 @router.delete("/account/positions/{code}")
 def delete_position(code: str, account_id: int = Query(1), user: dict = Depends(get_current_user)):
-    _verify_account_ownership(account_id, user["id"])
     try:
-        remove_position(account_id, code)
-        return {"status": "ok"}
+        deleted = remove_position(account_id, code, user_id=user["id"])
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if not deleted:
+        # Nothing deleted: missing position is fine, foreign account is not
+        _verify_account_ownership(account_id, user["id"])
+    return {"status": "ok"}
 
 @router.post("/account/positions/{code}/add")
 def add_trade(code: str, data: AddTradeModel, account_id: int = Query(1), user: dict = Depends(get_current_user)):
     _verify_account_ownership(account_id, user["id"])
-    from datetime import datetime
-    trade_ts = None
-    if data.trade_time:
-        try:
-            trade_ts = datetime.fromisoformat(data.trade_time.replace("Z", "+00:00"))
-            if trade_ts.tzinfo:
-                trade_ts = trade_ts.replace(tzinfo=None)
-        except: pass
     try:
-        result = add_position_trade(account_id, code, data.amount, trade_ts)
+        result = add_position_trade(account_id, code, data.amount, _naive(data.trade_time))
         if not result.get("ok"):
             raise HTTPException(status_code=400, detail=result.get("message", "加仓失败"))
         return result
@@ -225,16 +270,8 @@ def add_trade(code: str, data: AddTradeModel, account_id: int = Query(1), user:
 @router.post("/account/positions/{code}/reduce")
 def reduce_trade(code: str, data: ReduceTradeModel, account_id: int = Query(1), user: dict = Depends(get_current_user)):
     _verify_account_ownership(account_id, user["id"])
-    from datetime import datetime
-    trade_ts = None
-    if data.trade_time:
-        try:
-            trade_ts = datetime.fromisoformat(data.trade_time.replace("Z", "+00:00"))
-            if trade_ts.tzinfo:
-                trade_ts = trade_ts.replace(tzinfo=None)
-        except: pass
     try:
-        result = reduce_position_trade(account_id, code, data.shares, trade_ts)
+        result = reduce_position_trade(account_id, code, data.shares, _naive(data.trade_time))
         if not result.get("ok"):
             raise HTTPException(status_code=400, detail=result.get("message", "减仓失败"))
         return result
@@ -245,10 +282,11 @@ def reduce_trade(code: str, data: ReduceTradeModel, account_id: int = Query(1),
 
 @router.get("/account/transactions")
 def get_transactions(account_id: int = Query(1), code: Optional[str] = Query(None),
-                     limit: int = Query(100, le=500), user: dict = Depends(get_current_user)):
-    if account_id:
-        _verify_account_ownership(account_id, user["id"])
+                     limit: int = Query(100, le=MAX_TRANSACTIONS_LIMIT), user: dict = Depends(get_current_user)):
     try:
-        return {"transactions": list_transactions(account_id, code, limit)}
+        transactions = list_transactions(account_id, code, limit, user_id=user["id"])
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if account_id and not transactions:
+        _verify_account_ownership(account_id, user["id"])
+    return Response(orjson.dumps({"transactions": transactions}), media_type="application/json")
@@ -1,6 +1,8 @@
 """Admin router: user management (admin only)."""
 from fastapi import APIRouter, HTTPException, Depends
-from pydantic import BaseModel
+from fastapi.responses import Response
+import orjson
+from pydantic import BaseModel, ConfigDict
 from typing import Optional
 
 from ..db import get_db_connection, release_db_connection, dict_cursor
@@ -10,6 +12,8 @@ router = APIRouter()
 
 
 class CreateUserRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     username: str
     password: str
     role: str = "user"
@@ -17,6 +21,8 @@ class CreateUserRequest(BaseModel):
 
 
 class UpdateUserRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     is_active: Optional[bool] = None
     role: Optional[str] = None
     password: Optional[str] = None
@@ -29,7 +35,7 @@ def list_users(admin: dict = Depends(require_admin)):
     try:
         cur = dict_cursor(conn)
         cur.execute("SELECT id, username, role, note, is_active, created_at FROM users ORDER BY id")
-        return {"users": cur.fetchall()}
+        return Response(orjson.dumps({"users": cur.fetchall()}), media_type="application/json")
     finally:
         release_db_connection(conn)
 
@@ -67,15 +73,27 @@ def update_user(user_id: int, req: UpdateUserRequest, admin: dict = Depends(requ
     conn = get_db_connection()
     try:
         cur = dict_cursor(conn)
+        # 所有变更字段合并为一条 UPDATE
+        sets, params = [], []
         if req.is_active is not None:
-            cur.execute("UPDATE users SET is_active = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s", (req.is_active, user_id))
+            sets.append("is_active = %s")
+            params.append(req.is_active)
         if req.role is not None:
-            cur.execute("UPDATE users SET role = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s", (req.role, user_id))
+            sets.append("role = %s")
+            params.append(req.role)
         if req.password:
-            cur.execute("UPDATE users SET password_hash = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s", (hash_password(req.password), user_id))
+            sets.append("password_hash = %s")
+            params.append(hash_password(req.password))
         if req.note is not None:
-            cur.execute("UPDATE users SET note = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s", (req.note, user_id))
-        conn.commit()
+            sets.append("note = %s")
+            params.append(req.note)
+        if sets:
+            params.append(user_id)
+            cur.execute(
+                f"UPDATE users SET {', '.join(sets)}, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
+                params
+            )
+            conn.commit()
         return {"status": "ok"}
     except Exception as e:
         conn.rollback()
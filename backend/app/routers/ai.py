@@ -1,6 +1,8 @@
 from fastapi import APIRouter, Body, HTTPException, Depends
+from fastapi.responses import Response
+import orjson
 from typing import Dict, Any
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ConfigDict
 from ..services.ai import ai_service
 from ..db import get_db_connection, release_db_connection, dict_cursor
 from ..auth import get_current_user
@@ -8,6 +10,8 @@ from ..auth import get_current_user
 router = APIRouter()
 
 class PromptModel(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     name: str = Field(..., min_length=1, max_length=100)
     system_prompt: str = Field(..., min_length=1, max_length=10000)
     user_prompt: str = Field(..., min_length=1, max_length=10000)
@@ -27,7 +31,7 @@ def get_prompts(user: dict = Depends(get_current_user)):
             FROM ai_prompts WHERE user_id = %s OR user_id IS NULL
             ORDER BY is_default DESC, id ASC
         """, (user["user_id"],))
-        return {"prompts": cur.fetchall()}
+        return Response(orjson.dumps({"prompts": cur.fetchall()}), media_type="application/json")
     finally:
         release_db_connection(conn)
 
@@ -37,7 +41,8 @@ def create_prompt(data: PromptModel, user: dict = Depends(get_current_user)):
     try:
         cur = dict_cursor(conn)
         if data.is_default:
-            cur.execute("UPDATE ai_prompts SET is_default = FALSE WHERE user_id = %s", (user["user_id"],))
+            # 通过 default_owner 唯一索引只命中旧默认模板这一行
+            cur.execute("UPDATE ai_prompts SET is_default = FALSE WHERE default_owner = %s", (user["user_id"],))
         cur.execute("""
             INSERT INTO ai_prompts (name, system_prompt, user_prompt, is_default, user_id)
             VALUES (%s, %s, %s, %s, %s)
@@ -57,7 +62,7 @@ def update_prompt(prompt_id: int, data: PromptModel, user: dict = Depends(get_cu
     try:
         cur = dict_cursor(conn)
         if data.is_default:
-            cur.execute("UPDATE ai_prompts SET is_default = FALSE WHERE user_id = %s AND id != %s", (user["user_id"], prompt_id))
+            cur.execute("UPDATE ai_prompts SET is_default = FALSE WHERE default_owner = %s AND id != %s", (user["user_id"], prompt_id))
         cur.execute("""
             UPDATE ai_prompts SET name = %s, system_prompt = %s, user_prompt = %s, is_default = %s, updated_at = CURRENT_TIMESTAMP
             WHERE id = %s AND (user_id = %s OR user_id IS NULL)
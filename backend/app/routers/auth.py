@@ -1,29 +1,52 @@
 """Auth router: login + current user info."""
-from fastapi import APIRouter, HTTPException, Depends
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Depends, Request
+from pydantic import BaseModel, ConfigDict
 
 from ..db import get_db_connection, release_db_connection, dict_cursor
-from ..auth import verify_password, create_access_token, get_current_user
+from ..auth import (
+    verify_password, verify_dummy_password, password_needs_rehash, hash_password,
+    create_access_token, get_current_user, login_blocked, record_login_failure, clear_login_failures,
+)
 
 router = APIRouter()
 
 
 class LoginRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     username: str
     password: str
 
 
+class ChangePasswordRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    old_password: str = ""
+    new_password: str = ""
+
+
 @router.post("/auth/login")
-def login(req: LoginRequest):
+def login(req: LoginRequest, request: Request):
+    limit_key = (request.client.host if request.client else "", req.username)
+    if login_blocked(limit_key):
+        raise HTTPException(status_code=429, detail="登录失败次数过多，请稍后再试")
     conn = get_db_connection()
     try:
         cur = dict_cursor(conn)
         cur.execute("SELECT id, username, password_hash, role, is_active FROM users WHERE username = %s", (req.username,))
         user = cur.fetchone()
+        if not user:
+            verify_dummy_password(req.password)
         if not user or not verify_password(req.password, user["password_hash"]):
+            record_login_failure(limit_key)
             raise HTTPException(status_code=401, detail="用户名或密码错误")
+        clear_login_failures(limit_key)
         if not user["is_active"]:
             raise HTTPException(status_code=403, detail="账号已被禁用")
+        if password_needs_rehash(user["password_hash"]):
+            # Transparently migrate legacy PBKDF2 hashes to scrypt
+            cur.execute("UPDATE users SET password_hash = %s WHERE id = %s", (hash_password(req.password), user["id"]))
+            conn.commit()
         token = create_access_token(user["id"], user["username"], user["role"])
         return {"token": token, "user": {"id": user["id"], "username": user["username"], "role": user["role"]}}
     finally:
@@ -36,9 +59,9 @@ def get_me(user: dict = Depends(get_current_user)):
 
 
 @router.post("/auth/change-password")
-def change_password(data: dict, user: dict = Depends(get_current_user)):
-    old_pw = data.get("old_password", "")
-    new_pw = data.get("new_password", "")
+def change_password(data: ChangePasswordRequest, user: dict = Depends(get_current_user)):
+    old_pw = data.old_password
+    new_pw = data.new_password
     if not new_pw or len(new_pw) < 4:
         raise HTTPException(status_code=400, detail="新密码至少4位")
     conn = get_db_connection()
@@ -48,7 +71,6 @@ def change_password(data: dict, user: dict = Depends(get_current_user)):
         row = cur.fetchone()
         if not row or not verify_password(old_pw, row["password_hash"]):
             raise HTTPException(status_code=400, detail="原密码错误")
-        from ..auth import hash_password
         cur.execute("UPDATE users SET password_hash = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
                      (hash_password(new_pw), user["id"]))
         conn.commit()
@@ -1,10 +1,9 @@
 from fastapi import APIRouter, HTTPException, Body, Depends
 from fastapi.responses import StreamingResponse
 from typing import List, Optional
-from pydantic import BaseModel
-import json
-import io
+from pydantic import BaseModel, ConfigDict
 import datetime
+import orjson
 
 from ..services.data_io import export_data, import_data
 from ..auth import get_current_user
@@ -14,27 +13,37 @@ router = APIRouter()
 VALID_MODULES = ["accounts", "positions", "transactions", "ai_prompts", "subscriptions", "settings"]
 
 
+def _iter_export_json(data: dict):
+    """按模块分块序列化导出数据；datetime 由 orjson 原生处理，其余未知类型转为字符串。"""
+    head = {k: v for k, v in data.items() if k != "modules"}
+    yield orjson.dumps(head, default=str)[:-1] + b',"modules":{'
+    for i, (module, rows) in enumerate(data["modules"].items()):
+        yield (b"," if i else b"") + orjson.dumps(module) + b":" + orjson.dumps(rows, default=str)
+    yield b"}}"
+
+
 class ImportRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     data: dict
     modules: List[str]
     mode: str = "merge"
 
 
 @router.get("/data/export")
-def export_data_endpoint(modules: Optional[str] = None, user: dict = Depends(get_current_user)):
+def export_data_endpoint(modules: Optional[str] = None, compact: bool = False, user: dict = Depends(get_current_user)):
     try:
         module_list = [m.strip() for m in modules.split(",")] if modules else VALID_MODULES
         invalid = [m for m in module_list if m not in VALID_MODULES]
         if invalid:
             raise HTTPException(status_code=400, detail=f"Invalid modules: {', '.join(invalid)}")
 
-        data = export_data(module_list, user_id=user["user_id"])
+        data = export_data(module_list, user_id=user["user_id"], compact=compact)
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"fundval_export_{timestamp}.json"
-        json_bytes = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
 
         return StreamingResponse(
-            io.BytesIO(json_bytes),
+            _iter_export_json(data),
             media_type="application/json",
             headers={"Content-Disposition": f"attachment; filename={filename}"}
         )
@@ -2,15 +2,16 @@ import logging
 import re
 from fastapi import APIRouter, HTTPException, Body, Depends
 from ..db import get_db_connection, release_db_connection, dict_cursor
-from ..crypto import encrypt_value, decrypt_value
+from ..crypto import encrypt_value, get_fernet, decrypt_with
 from ..config import Config
 from ..auth import get_current_user, require_admin
+from ..services.email import clear_user_settings_cache
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
-ENCRYPTED_FIELDS = {"OPENAI_API_KEY", "SMTP_PASSWORD"}
-USER_CONFIGURABLE_KEYS = {"OPENAI_API_KEY", "OPENAI_API_BASE", "AI_MODEL_NAME", "SMTP_HOST", "SMTP_PORT", "SMTP_USER", "SMTP_PASSWORD", "EMAIL_FROM"}
+ENCRYPTED_FIELDS = frozenset({"OPENAI_API_KEY", "SMTP_PASSWORD"})
+USER_CONFIGURABLE_KEYS = frozenset({"OPENAI_API_KEY", "OPENAI_API_BASE", "AI_MODEL_NAME", "SMTP_HOST", "SMTP_PORT", "SMTP_USER", "SMTP_PASSWORD", "EMAIL_FROM"})
 
 
 def get_user_effective_settings(user_id: int) -> dict:
@@ -22,11 +23,14 @@ def get_user_effective_settings(user_id: int) -> dict:
         # Load user-level settings (decrypted with per-user key)
         cur.execute("SELECT `key`, value FROM user_preferences WHERE user_id = %s AND `key` LIKE 'setting_%%'", (user_id,))
         user_settings = {}
+        fernet = None
         for row in cur.fetchall():
             real_key = row["key"][len("setting_"):]
             value = row["value"]
             if real_key in ENCRYPTED_FIELDS and value:
-                value = decrypt_value(value, user_id=user_id)
+                if fernet is None:
+                    fernet = get_fernet(user_id)
+                value = decrypt_with(fernet, value)
             user_settings[real_key] = value
 
         # If user has API key configured, use all their settings
@@ -67,17 +71,19 @@ def get_user_effective_settings(user_id: int) -> dict:
     finally:
         release_db_connection(conn)
 
+_EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+_URL_RE = re.compile(r'^https?://[^\s]+$')
+
 def validate_email(email: str) -> bool:
-    return re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', email) is not None
+    return _EMAIL_RE.match(email) is not None
 
 def validate_url(url: str) -> bool:
-    return re.match(r'^https?://[^\s]+$', url) is not None
+    return _URL_RE.match(url) is not None
 
 def validate_port(port: str) -> bool:
-    try:
-        return 1 <= int(port) <= 65535
-    except:
-        return False
+    # 只接受 ASCII 数字：isdigit 单独判断会放过 "²" 这类 int() 无法解析的字符
+    port = str(port).strip()
+    return port.isascii() and port.isdigit() and 1 <= int(port) <= 65535
 
 # ── Global settings (admin only) ──
 
@@ -127,20 +133,28 @@ def update_settings(data: dict = Body(...), admin: dict = Depends(require_admin)
         if errors:
             raise HTTPException(status_code=400, detail={"errors": errors})
 
-        cur = dict_cursor(conn)
+        rows = []
+        written = {}
         for key, value in settings.items():
             if value == "***":
                 continue
+            written[key] = value
             encrypted = key in ENCRYPTED_FIELDS
             if encrypted and value:
                 value = encrypt_value(value)
-            cur.execute("""
-                INSERT INTO settings (`key`, value, encrypted, updated_at)
-                VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
-                ON DUPLICATE KEY UPDATE value = VALUES(value), encrypted = VALUES(encrypted), updated_at = CURRENT_TIMESTAMP
-            """, (key, value, encrypted))
+            rows.append((key, value, encrypted))
+        # VALUES 中只含占位符，PyMySQL 才会把 executemany 改写成一条多行 INSERT；
+        # 新行的 updated_at 由列默认值填充
+        cur = dict_cursor(conn)
+        cur.executemany("""
+            INSERT INTO settings (`key`, value, encrypted)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE value = VALUES(value), encrypted = VALUES(encrypted), updated_at = CURRENT_TIMESTAMP
+        """, rows)
         conn.commit()
-        Config.reload()
+        Config.update_in_place(written)
+        # 用户设置缓存里合并了全局值作回退
+        clear_user_settings_cache()
         return {"message": "设置已保存"}
     except HTTPException:
         raise
@@ -160,11 +174,14 @@ def get_user_settings(user: dict = Depends(get_current_user)):
         cur = dict_cursor(conn)
         cur.execute("SELECT `key`, value FROM user_preferences WHERE user_id = %s AND `key` LIKE 'setting_%%'", (user["user_id"],))
         settings = {}
+        fernet = None
         for row in cur.fetchall():
             real_key = row["key"][len("setting_"):]
             value = row["value"]
             if real_key in ENCRYPTED_FIELDS and value:
-                value = decrypt_value(value, user_id=user["user_id"])
+                if fernet is None:
+                    fernet = get_fernet(user["user_id"])
+                value = decrypt_with(fernet, value)
                 settings[real_key] = "***" if value else ""
             else:
                 settings[real_key] = value
@@ -180,7 +197,7 @@ def update_user_settings(data: dict = Body(...), user: dict = Depends(get_curren
     conn = get_db_connection()
     try:
         settings = data.get("settings", {})
-        cur = dict_cursor(conn)
+        rows = []
         for key, value in settings.items():
             if key not in USER_CONFIGURABLE_KEYS:
                 continue
@@ -189,12 +206,15 @@ def update_user_settings(data: dict = Body(...), user: dict = Depends(get_curren
             db_key = f"setting_{key}"
             if key in ENCRYPTED_FIELDS and value:
                 value = encrypt_value(value, user_id=user["user_id"])
-            cur.execute("""
-                INSERT INTO user_preferences (user_id, `key`, value, updated_at)
-                VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
-                ON DUPLICATE KEY UPDATE value = VALUES(value), updated_at = CURRENT_TIMESTAMP
-            """, (user["user_id"], db_key, value))
+            rows.append((user["user_id"], db_key, value))
+        cur = dict_cursor(conn)
+        cur.executemany("""
+            INSERT INTO user_preferences (user_id, `key`, value)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE value = VALUES(value), updated_at = CURRENT_TIMESTAMP
+        """, rows)
         conn.commit()
+        clear_user_settings_cache(user["user_id"])
         return {"message": "个人设置已保存"}
     except Exception as e:
         conn.rollback()
@@ -210,7 +230,12 @@ def get_preferences(user: dict = Depends(get_current_user)):
     conn = get_db_connection()
     try:
         cur = dict_cursor(conn)
-        cur.execute("SELECT `key`, value FROM user_preferences WHERE user_id = %s", (user["user_id"],))
+        # 只取界面偏好三项；主键 (user_id, `key`) 直接覆盖该查询
+        cur.execute(
+            "SELECT `key`, value FROM user_preferences "
+            "WHERE user_id = %s AND `key` IN ('watchlist', 'current_account', 'sort_option')",
+            (user["user_id"],)
+        )
         prefs = {row["key"]: row["value"] for row in cur.fetchall()}
         return {
             "watchlist": prefs.get("watchlist", "[]"),
@@ -229,13 +254,13 @@ def update_preferences(data: dict = Body(...), user: dict = Depends(get_current_
     try:
         cur = dict_cursor(conn)
         mapping = {"watchlist": "watchlist", "currentAccount": "current_account", "sortOption": "sort_option"}
-        for frontend_key, db_key in mapping.items():
-            if frontend_key in data:
-                cur.execute("""
-                    INSERT INTO user_preferences (user_id, `key`, value, updated_at)
-                    VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
-                    ON DUPLICATE KEY UPDATE value = VALUES(value), updated_at = CURRENT_TIMESTAMP
-                """, (user["user_id"], db_key, str(data[frontend_key])))
+        rows = [(user["user_id"], db_key, str(data[frontend_key]))
+                for frontend_key, db_key in mapping.items() if frontend_key in data]
+        cur.executemany("""
+            INSERT INTO user_preferences (user_id, `key`, value)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE value = VALUES(value), updated_at = CURRENT_TIMESTAMP
+        """, rows)
         conn.commit()
         return {"message": "偏好已保存"}
     except Exception as e:
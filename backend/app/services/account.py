@@ -1,165 +1,182 @@
 from typing import List, Dict, Any
+import asyncio
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from operator import itemgetter
 
-from ..db import get_db_connection, release_db_connection, dict_cursor
-from .fund import get_combined_valuation, get_fund_type
+import numpy as np
 
-logger = logging.getLogger(__name__)
+from ..db import get_db, get_db_connection, release_db_connection, dict_cursor, tuple_cursor
+from .fund import get_combined_valuation_async, get_valuation_client, new_valuation_client, classify_fund_type
 
-def get_all_positions(account_id: int = 1, user_id: int = None) -> Dict[str, Any]:
-    """
-    Fetch all positions for a specific account, get real-time valuations in parallel,
-    and compute portfolio statistics.
+logger = logging.getLogger(__name__)
 
-    Special case: account_id = 0 returns aggregated data from all accounts for the user.
-    """
-    conn = get_db_connection()
+def _load_positions(conn, account_id: int, user_id: int = None):
+    """读取持仓行，并一次性预取这些基金的名称/类型和本地最新净值日期。"""
     cur = dict_cursor(conn)
 
     if account_id == 0:
+        # 汇总视图：同一基金跨账户合并，成本按份额加权平均
         if user_id:
             cur.execute("""
-                SELECT p.* FROM positions p
+                SELECT p.code, SUM(p.shares) AS shares, SUM(p.shares * p.cost) / SUM(p.shares) AS cost
+                FROM positions p
                 JOIN accounts a ON p.account_id = a.id
                 WHERE a.user_id = %s AND p.shares > 0
+                GROUP BY p.code
             """, (user_id,))
         else:
-            cur.execute("SELECT * FROM positions WHERE shares > 0")
+            cur.execute("""
+                SELECT code, SUM(shares) AS shares, SUM(shares * cost) / SUM(shares) AS cost
+                FROM positions
+                WHERE shares > 0
+                GROUP BY code
+            """)
+    elif user_id:
+        # 归属校验并入查询：非本人账户与空账户同样返回空结果
+        cur.execute("""
+            SELECT p.* FROM positions p
+            JOIN accounts a ON p.account_id = a.id
+            WHERE p.account_id = %s AND a.user_id = %s AND p.shares > 0
+        """, (account_id, user_id))
     else:
         cur.execute("SELECT * FROM positions WHERE account_id = %s AND shares > 0", (account_id,))
 
     rows = cur.fetchall()
-    release_db_connection(conn)
+    codes = [row["code"] for row in rows]
+    if not codes:
+        return rows, {}, {}
+
+    placeholders = ", ".join(["%s"] * len(codes))
+    cur.execute(f"SELECT code, name, type FROM funds WHERE code IN ({placeholders})", codes)
+    funds_meta = {r["code"]: r for r in cur.fetchall()}
+    pairs = tuple_cursor(conn)
+    pairs.execute(
+        f"SELECT code, MAX(date) AS latest FROM fund_history WHERE code IN ({placeholders}) GROUP BY code",
+        codes
+    )
+    latest_nav_dates = dict(pairs.fetchall())
+    return rows, funds_meta, latest_nav_dates
+
 
+def _load_positions_leased(account_id: int, user_id: int = None):
+    # 一次租用连接完成全部查询；估值走网络，不占用连接
+    with get_db() as conn:
+        return _load_positions(conn, account_id, user_id)
+
+
+async def _fetch_valuations(codes: List[str]) -> list:
+    if not codes:
+        return []
+    client = get_valuation_client()
+    if client is not None:
+        return await asyncio.gather(*(get_combined_valuation_async(client, c) for c in codes), return_exceptions=True)
+    async with new_valuation_client() as client:
+        return await asyncio.gather(*(get_combined_valuation_async(client, c) for c in codes), return_exceptions=True)
+
+
+async def get_all_positions(account_id: int = 1, user_id: int = None) -> Dict[str, Any]:
+    """
+    Fetch all positions for a specific account, get real-time valuations concurrently,
+    and compute portfolio statistics.
+
+    Special case: account_id = 0 returns aggregated data from all accounts for the user.
+    """
+    rows, funds_meta, latest_nav_dates = await asyncio.to_thread(_load_positions_leased, account_id, user_id)
+
+    position_map = {row["code"]: row for row in rows}
+
+    today_str = datetime.now().strftime("%Y-%m-%d")
+    results = await _fetch_valuations(list(position_map))
+
+    # 第一遍：逐只整理标量输入（名称、类型、净值、估值），出错的持仓单独成行
     positions = []
-    total_market_value = 0.0
-    total_cost = 0.0
-    total_day_income = 0.0
+    valued = []
+    for code, result in zip(position_map, results):
+        row = position_map[code]
 
-    # For account_id = 0, merge positions with same code
-    if account_id == 0:
-        code_positions = {}
-        for row in rows:
-            code = row["code"]
-            if code not in code_positions:
-                code_positions[code] = {"cost": 0.0, "shares": 0.0, "total_cost_basis": 0.0}
-            shares = float(row["shares"])
-            cost = float(row["cost"])
-            code_positions[code]["shares"] += shares
-            code_positions[code]["total_cost_basis"] += shares * cost
-
-        position_map = {}
-        for code, data in code_positions.items():
-            if data["shares"] > 0:
-                weighted_avg_cost = data["total_cost_basis"] / data["shares"]
-                position_map[code] = {"code": code, "cost": weighted_avg_cost, "shares": data["shares"]}
-    else:
-        position_map = {row["code"]: row for row in rows}
-
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_code = {
-            executor.submit(get_combined_valuation, code): code
-            for code in position_map.keys()
-        }
-
-        for future in as_completed(future_to_code):
-            code = future_to_code[future]
-            row = position_map[code]
-
-            try:
-                data = future.result() or {}
-                name = data.get("name")
-                fund_type = None
-
-                if not name:
-                    conn_temp = get_db_connection()
-                    cur_temp = dict_cursor(conn_temp)
-                    cur_temp.execute("SELECT name, type FROM funds WHERE code = %s", (code,))
-                    db_row = cur_temp.fetchone()
-                    release_db_connection(conn_temp)
-                    if db_row:
-                        name = db_row["name"]
-                        fund_type = db_row["type"]
-                    else:
-                        name = code
-
-                if not fund_type:
-                    fund_type = get_fund_type(code, name)
-
-                from datetime import datetime
-                today_str = datetime.now().strftime("%Y-%m-%d")
-                conn_temp = get_db_connection()
-                cur_temp = dict_cursor(conn_temp)
-                cur_temp.execute(
-                    "SELECT date FROM fund_history WHERE code = %s ORDER BY date DESC LIMIT 1", (code,)
-                )
-                latest_nav_row = cur_temp.fetchone()
-                release_db_connection(conn_temp)
-                nav_updated_today = latest_nav_row and latest_nav_row["date"] == today_str
-
-                nav = float(data.get("nav", 0.0))
-                estimate = float(data.get("estimate", 0.0))
-                current_price = estimate if estimate > 0 else nav
-
-                cost = float(row["cost"])
-                shares = float(row["shares"])
-
-                nav_market_value = nav * shares
-                cost_basis = cost * shares
-
-                est_rate = data.get("est_rate", data.get("estRate", 0.0))
-
-                is_est_valid = False
-                if estimate > 0 and nav > 0:
-                    if abs(est_rate) < 10.0 or "ETF" in (name or "") or "联接" in (name or ""):
-                        is_est_valid = True
-
-                accumulated_income = nav_market_value - cost_basis
-                accumulated_return_rate = (accumulated_income / cost_basis * 100) if cost_basis > 0 else 0.0
-
-                if is_est_valid:
-                    day_income = (estimate - nav) * shares
-                    est_market_value = estimate * shares
-                else:
-                    day_income = 0.0
-                    est_market_value = nav_market_value
-
-                total_income = accumulated_income + day_income
-                total_return_rate = (total_income / cost_basis * 100) if cost_basis > 0 else 0.0
-
-                positions.append({
-                    "code": code, "name": name, "type": fund_type,
-                    "cost": cost, "shares": shares,
-                    "nav": nav, "nav_date": data.get("navDate", "--"),
-                    "nav_updated_today": nav_updated_today,
-                    "estimate": estimate, "est_rate": est_rate, "is_est_valid": is_est_valid,
-                    "cost_basis": round(cost_basis, 2),
-                    "nav_market_value": round(nav_market_value, 2),
-                    "est_market_value": round(est_market_value, 2),
-                    "accumulated_income": round(accumulated_income, 2),
-                    "accumulated_return_rate": round(accumulated_return_rate, 2),
-                    "day_income": round(day_income, 2),
-                    "total_income": round(total_income, 2),
-                    "total_return_rate": round(total_return_rate, 2),
-                    "update_time": data.get("time", "--")
-                })
-
-                total_market_value += est_market_value
-                total_day_income += day_income
-                total_cost += cost_basis
-
-            except Exception as e:
-                logger.error(f"Error processing position {code}: {e}")
-                positions.append({
-                    "code": code, "name": "Error",
-                    "cost": float(row["cost"]), "shares": float(row["shares"]),
-                    "nav": 0.0, "estimate": 0.0, "est_market_value": 0.0,
-                    "day_income": 0.0, "total_income": 0.0, "total_return_rate": 0.0,
-                    "accumulated_income": 0.0, "est_rate": 0.0, "is_est_valid": False,
-                    "update_time": "--"
-                })
+        try:
+            if isinstance(result, BaseException):
+                raise result
+            data = result or {}
+            name = data.get("name")
+            meta = funds_meta.get(code)
+
+            if not name:
+                name = meta["name"] if meta else code
+
+            # 类型已随 funds 预取，缺失时才按名称推断
+            fund_type = (meta and meta["type"]) or classify_fund_type(name or "")
+            est_rate = data.get("est_rate", data.get("estRate", 0.0))
+            # ETF/联接基金跟踪指数，大幅估值也视为有效
+            label = name or ""
+            valued.append((code, row, data, name, fund_type, float(data.get("nav", 0.0)),
+                           float(data.get("estimate", 0.0)), est_rate, abs(est_rate),
+                           "ETF" in label or "联接" in label))
+        except Exception as e:
+            logger.error(f"Error processing position {code}: {e}")
+            positions.append({
+                "code": code, "name": "Error",
+                "cost": row["cost"], "shares": row["shares"],
+                "nav": 0.0, "estimate": 0.0, "est_market_value": 0.0,
+                "day_income": 0.0, "total_income": 0.0, "total_return_rate": 0.0,
+                "accumulated_income": 0.0, "est_rate": 0.0, "is_est_valid": False,
+                "update_time": "--"
+            })
+
+    # 第二遍：按列整体计算收益指标。REAL 列（MySQL 下即 DOUBLE），驱动直接返回 float
+    cost = np.array([v[1]["cost"] for v in valued], dtype=float)
+    shares = np.array([v[1]["shares"] for v in valued], dtype=float)
+    nav = np.array([v[5] for v in valued], dtype=float)
+    estimate = np.array([v[6] for v in valued], dtype=float)
+    abs_rate = np.array([v[8] for v in valued], dtype=float)
+    tracks_index = np.array([v[9] for v in valued], dtype=bool)
+
+    is_est_valid = (estimate > 0) & (nav > 0) & ((abs_rate < 10.0) | tracks_index)
+    nav_market_value = nav * shares
+    cost_basis = cost * shares
+    accumulated_income = nav_market_value - cost_basis
+    est_market_value = np.where(is_est_valid, estimate * shares, nav_market_value)
+    day_income = np.where(is_est_valid, (estimate - nav) * shares, 0.0)
+    total_income = accumulated_income + day_income
+    has_basis = cost_basis > 0
+    safe_basis = np.where(has_basis, cost_basis, 1.0)
+    accumulated_return_rate = np.where(has_basis, accumulated_income / safe_basis * 100, 0.0)
+    total_return_rate = np.where(has_basis, total_income / safe_basis * 100, 0.0)
 
+    # 取整逐个用 Python round()：np.round 先乘 10**d 再舍入，半分位上与 round() 结果不同
+    columns = zip(
+        is_est_valid.tolist(),
+        cost_basis.tolist(),
+        nav_market_value.tolist(),
+        est_market_value.tolist(),
+        accumulated_income.tolist(),
+        accumulated_return_rate.tolist(),
+        day_income.tolist(),
+        total_income.tolist(),
+        total_return_rate.tolist(),
+    )
+    for (code, row, data, name, fund_type, nav_i, estimate_i, est_rate, _, _), col in zip(valued, columns):
+        positions.append({
+            "code": code, "name": name, "type": fund_type,
+            "cost": row["cost"], "shares": row["shares"],
+            "nav": nav_i, "nav_date": data.get("navDate", "--"),
+            "nav_updated_today": latest_nav_dates.get(code) == today_str,
+            "estimate": estimate_i, "est_rate": est_rate, "is_est_valid": col[0],
+            "cost_basis": round(col[1], 2),
+            "nav_market_value": round(col[2], 2),
+            "est_market_value": round(col[3], 2),
+            "accumulated_income": round(col[4], 2),
+            "accumulated_return_rate": round(col[5], 2),
+            "day_income": round(col[6], 2),
+            "total_income": round(col[7], 2),
+            "total_return_rate": round(col[8], 2),
+            "update_time": data.get("time", "--")
+        })
+
+    total_market_value = float(est_market_value.sum())
+    total_day_income = float(day_income.sum())
+    total_cost = float(cost_basis.sum())
     total_income = total_market_value - total_cost
     total_return_rate = (total_income / total_cost * 100) if total_cost > 0 else 0.0
 
@@ -171,26 +188,88 @@ def get_all_positions(account_id: int = 1, user_id: int = None) -> Dict[str, Any
             "total_income": round(total_income, 2),
             "total_return_rate": round(total_return_rate, 2)
         },
-        "positions": sorted(positions, key=lambda x: x.get("est_market_value", 0), reverse=True)
+        "positions": sorted(positions, key=itemgetter("est_market_value"), reverse=True)
     }
 
-def upsert_position(account_id: int, code: str, cost: float, shares: float):
+def _upsert_position(cur, account_id: int, code: str, cost: float, shares: float, user_id: int = None) -> bool:
+    if user_id is None:
+        cur.execute("""
+            INSERT INTO positions (account_id, code, cost, shares)
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                cost = VALUES(cost),
+                shares = VALUES(shares),
+                updated_at = CURRENT_TIMESTAMP
+        """, (account_id, code, cost, shares))
+    else:
+        cur.execute("""
+            INSERT INTO positions (account_id, code, cost, shares)
+            SELECT id, %s, %s, %s FROM accounts WHERE id = %s AND user_id = %s
+            ON DUPLICATE KEY UPDATE
+                cost = VALUES(cost),
+                shares = VALUES(shares),
+                updated_at = CURRENT_TIMESTAMP
+        """, (code, cost, shares, account_id, user_id))
+    return cur.rowcount > 0
+
+def upsert_position(account_id: int, code: str, cost: float, shares: float, user_id: int = None, cur=None) -> bool:
+    """写入持仓。传入 user_id 时仅当账户属于该用户才写入，返回是否命中。
+    传入 cur 时在调用方的事务里执行，由调用方提交。"""
+    if cur is not None:
+        return _upsert_position(cur, account_id, code, cost, shares, user_id)
     conn = get_db_connection()
-    cur = dict_cursor(conn)
-    cur.execute("""
+    try:
+        hit = _upsert_position(dict_cursor(conn), account_id, code, cost, shares, user_id)
+        conn.commit()
+    finally:
+        release_db_connection(conn)
+    return hit
+
+def bulk_upsert_positions(cur, rows: List[tuple]):
+    """在调用方事务里一次写入多条持仓，rows 为 (account_id, code, cost, shares)。
+    VALUES 只含占位符，PyMySQL 会把 executemany 改写成一条多行 INSERT。"""
+    if not rows:
+        return
+    cur.executemany("""
         INSERT INTO positions (account_id, code, cost, shares)
         VALUES (%s, %s, %s, %s)
         ON DUPLICATE KEY UPDATE
             cost = VALUES(cost),
             shares = VALUES(shares),
             updated_at = CURRENT_TIMESTAMP
-    """, (account_id, code, cost, shares))
-    conn.commit()
-    release_db_connection(conn)
+    """, rows)
 
-def remove_position(account_id: int, code: str):
+def bulk_remove_positions(cur, keys: List[tuple]) -> int:
+    """在调用方事务里一次删除多条持仓，keys 为 (account_id, code)。"""
+    if not keys:
+        return 0
+    placeholders = ", ".join(["(%s, %s)"] * len(keys))
+    cur.execute(
+        f"DELETE FROM positions WHERE (account_id, code) IN ({placeholders})",
+        [v for key in keys for v in key],
+    )
+    return cur.rowcount
+
+def _remove_position(cur, account_id: int, code: str, user_id: int = None) -> int:
+    if user_id is None:
+        cur.execute("DELETE FROM positions WHERE account_id = %s AND code = %s", (account_id, code))
+    else:
+        cur.execute("""
+            DELETE p FROM positions p
+            JOIN accounts a ON p.account_id = a.id
+            WHERE p.account_id = %s AND p.code = %s AND a.user_id = %s
+        """, (account_id, code, user_id))
+    return cur.rowcount
+
+def remove_position(account_id: int, code: str, user_id: int = None, cur=None) -> int:
+    """删除持仓，返回删除行数。传入 user_id 时只删除该用户账户下的持仓。
+    传入 cur 时在调用方的事务里执行，由调用方提交。"""
+    if cur is not None:
+        return _remove_position(cur, account_id, code, user_id)
     conn = get_db_connection()
-    cur = dict_cursor(conn)
-    cur.execute("DELETE FROM positions WHERE account_id = %s AND code = %s", (account_id, code))
-    conn.commit()
-    release_db_connection(conn)
+    try:
+        deleted = _remove_position(dict_cursor(conn), account_id, code, user_id)
+        conn.commit()
+    finally:
+        release_db_connection(conn)
+    return deleted
@@ -1,5 +1,6 @@
 import os
 import re
+import asyncio
 import datetime
 import numpy as np
 import pandas as pd
@@ -101,7 +102,8 @@ class AIService:
         }
 
     async def analyze_fund(self, fund_info: Dict[str, Any], prompt_id: Optional[int] = None, user_id: Optional[int] = None) -> Dict[str, Any]:
-        llm = self._init_llm(user_id=user_id)
+        # Sync DB / HTTP work runs in worker threads so it never blocks the event loop
+        llm = await asyncio.to_thread(self._init_llm, user_id=user_id)
 
         if not llm:
             return {
@@ -114,7 +116,7 @@ class AIService:
         fund_id = fund_info.get("id")
         fund_name = fund_info.get("name", "未知基金")
 
-        history = get_fund_history(fund_id, limit=250)
+        history = await asyncio.to_thread(get_fund_history, fund_id, limit=250)
         indicators = self._calculate_indicators(history[:30] if len(history) >= 30 else history)
         technical_indicators = _calculate_technical_indicators(history)
 
@@ -164,7 +166,7 @@ class AIService:
             "history_summary": history_summary
         }
 
-        prompt_template = self._get_prompt_template(prompt_id, user_id=user_id)
+        prompt_template = await asyncio.to_thread(self._get_prompt_template, prompt_id, user_id=user_id)
         chain = prompt_template | llm | StrOutputParser()
 
         try:
@@ -1,7 +1,7 @@
 import datetime
 import logging
 from typing import List, Dict, Any, Optional
-from ..db import get_db_connection, release_db_connection, dict_cursor
+from ..db import get_db_connection, release_db_connection, dict_cursor, stream_cursor
 
 logger = logging.getLogger(__name__)
 
@@ -9,7 +9,8 @@ IMPORT_ORDER = ["settings", "ai_prompts", "accounts", "positions", "transactions
 SENSITIVE_MASK = "***"
 
 
-def export_data(modules: List[str], user_id: int = None) -> Dict[str, Any]:
+def export_data(modules: List[str], user_id: int = None, compact: bool = False) -> Dict[str, Any]:
+    """compact=True 时列表模块按列名 + 行数组输出，省去每行重复的键名；导入两种格式都接受。"""
     if not modules:
         raise ValueError("No modules selected for export")
 
@@ -20,26 +21,32 @@ def export_data(modules: List[str], user_id: int = None) -> Dict[str, Any]:
         "modules": {}
     }
 
+    exported, metadata = result["modules"], result["metadata"]
     for module in modules:
-        if module == "settings":
-            result["modules"]["settings"] = _export_settings()
-        elif module == "ai_prompts":
-            result["modules"]["ai_prompts"] = _export_ai_prompts(user_id)
-        elif module == "accounts":
-            result["modules"]["accounts"] = _export_accounts(user_id)
-        elif module == "positions":
-            result["modules"]["positions"] = _export_positions(user_id)
-        elif module == "transactions":
-            result["modules"]["transactions"] = _export_transactions(user_id)
-        elif module == "subscriptions":
-            result["modules"]["subscriptions"] = _export_subscriptions(user_id)
-
-        if module in result["modules"]:
-            result["metadata"][f"total_{module}"] = len(result["modules"][module])
+        exporter = _EXPORTERS.get(module)
+        if exporter is None:
+            continue
+        payload = exporter(user_id)
+        metadata[f"total_{module}"] = len(payload)
+        exported[module] = _to_columns(payload) if compact and not isinstance(payload, dict) else payload
 
     return result
 
 
+def _to_columns(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    columns = list(rows[0]) if rows else []
+    return {"columns": columns, "rows": [list(r.values()) for r in rows]}
+
+
+def _from_columns(module_data):
+    """把紧凑格式 {"columns": [...], "rows": [[...]]} 还原为逐行字典，其他格式原样返回。"""
+    if isinstance(module_data, dict) and isinstance(module_data.get("columns"), list) \
+            and isinstance(module_data.get("rows"), list):
+        columns = module_data["columns"]
+        return [dict(zip(columns, row)) for row in module_data["rows"]]
+    return module_data
+
+
 def import_data(data: Dict[str, Any], modules: List[str], mode: str, user_id: int = None) -> Dict[str, Any]:
     if not modules:
         raise ValueError("No modules selected for import")
@@ -51,35 +58,35 @@ def import_data(data: Dict[str, Any], modules: List[str], mode: str, user_id: in
     conn = get_db_connection()
     cur = dict_cursor(conn)
     try:
+        # 整个导入放在一个显式事务里，末尾只提交一次；唯一键/外键检查保持开启，
+        # 重复与越权数据仍由数据库拦截
+        conn.begin()
         ordered_modules = [m for m in IMPORT_ORDER if m in modules]
+        # 持仓与交易的账户归属校验共用一次查询（账户模块已先导入）
+        owned = None
         for module in ordered_modules:
             if module not in data.get("modules", {}):
                 continue
             module_data = data["modules"][module]
+            if module != "settings":
+                module_data = _from_columns(module_data)
             if not module_data:
                 continue
 
-            if module == "settings":
-                module_result = _import_settings(cur, module_data, mode)
-            elif module == "ai_prompts":
-                module_result = _import_ai_prompts(cur, module_data, mode, user_id)
-            elif module == "accounts":
-                module_result = _import_accounts(cur, module_data, mode, user_id)
-            elif module == "positions":
-                module_result = _import_positions(cur, module_data, mode, user_id)
-            elif module == "transactions":
-                module_result = _import_transactions(cur, module_data, mode, user_id)
-            elif module == "subscriptions":
-                module_result = _import_subscriptions(cur, module_data, mode, user_id)
-            else:
+            importer = _IMPORTERS.get(module)
+            if importer is None:
                 continue
+            if module in _ACCOUNT_SCOPED_IMPORTS:
+                if owned is None:
+                    owned = _owned_account_ids(cur, user_id)
+                module_result = importer(cur, module_data, mode, user_id, owned)
+            else:
+                module_result = importer(cur, module_data, mode, user_id)
 
             result["details"][module] = module_result
             result["total_records"] += module_result.get("total", 0)
-            result["imported"] += module_result.get("imported", 0)
-            result["skipped"] += module_result.get("skipped", 0)
-            result["failed"] += module_result.get("failed", 0)
-            result["deleted"] += module_result.get("deleted", 0)
+            for counter in ("imported", "skipped", "failed", "deleted"):
+                result[counter] += module_result.get(counter, 0)
 
         conn.commit()
     except Exception as e:
@@ -115,7 +122,7 @@ def _export_ai_prompts(user_id: int = None) -> List[Dict[str, Any]]:
             SELECT name, system_prompt, user_prompt, is_default, created_at, updated_at
             FROM ai_prompts WHERE user_id IS NULL OR user_id = %s ORDER BY id
         """, (user_id,))
-        return [dict(r) for r in cur.fetchall()]
+        return cur.fetchall()
     finally:
         release_db_connection(conn)
 
@@ -125,45 +132,43 @@ def _export_accounts(user_id: int = None) -> List[Dict[str, Any]]:
     cur = dict_cursor(conn)
     try:
         cur.execute("SELECT id, name, description, created_at, updated_at FROM accounts WHERE user_id = %s ORDER BY id", (user_id,))
-        return [dict(r) for r in cur.fetchall()]
+        return cur.fetchall()
     finally:
         release_db_connection(conn)
 
 
 def _export_positions(user_id: int = None) -> List[Dict[str, Any]]:
     conn = get_db_connection()
-    cur = dict_cursor(conn)
+    # 行数随用户数据增长，逐行读取，避免驱动先缓冲整个结果集
+    cur = stream_cursor(conn)
     try:
         cur.execute("""
             SELECT p.account_id, p.code, p.cost, p.shares, p.updated_at
             FROM positions p JOIN accounts a ON p.account_id = a.id
             WHERE a.user_id = %s ORDER BY p.account_id, p.code
         """, (user_id,))
-        return [dict(r) for r in cur.fetchall()]
+        return list(cur)
     finally:
+        cur.close()
         release_db_connection(conn)
 
 
 def _export_transactions(user_id: int = None) -> List[Dict[str, Any]]:
     conn = get_db_connection()
-    cur = dict_cursor(conn)
+    cur = stream_cursor(conn)
     try:
         cur.execute("""
             SELECT t.id, t.account_id, t.code, t.op_type, t.amount_cny, t.shares_redeemed,
-                   t.confirm_date, t.confirm_nav, t.shares_added, t.cost_after, t.created_at, t.applied_at
+                   t.confirm_date, t.confirm_nav, t.shares_added, t.cost_after,
+                   DATE_FORMAT(t.created_at, '%%Y-%%m-%%d %%H:%%i:%%s') AS created_at,
+                   DATE_FORMAT(t.applied_at, '%%Y-%%m-%%d %%H:%%i:%%s') AS applied_at
             FROM transactions t JOIN accounts a ON t.account_id = a.id
             WHERE a.user_id = %s ORDER BY t.id
         """, (user_id,))
-        rows = cur.fetchall()
-        result = []
-        for r in rows:
-            d = dict(r)
-            for k in ("created_at", "applied_at"):
-                if d[k]:
-                    d[k] = str(d[k])
-            result.append(d)
-        return result
+        # 时间戳由数据库格式化为字符串，行可直接输出
+        return list(cur)
     finally:
+        cur.close()
         release_db_connection(conn)
 
 
@@ -176,28 +181,73 @@ def _export_subscriptions(user_id: int = None) -> List[Dict[str, Any]]:
                    enable_volatility, last_notified_at, last_digest_at, created_at
             FROM subscriptions WHERE user_id = %s ORDER BY id
         """, (user_id,))
-        return [dict(r) for r in cur.fetchall()]
+        return cur.fetchall()
     finally:
         release_db_connection(conn)
 
 
+_EXPORTERS = {
+    "settings": lambda user_id: _export_settings(),
+    "ai_prompts": _export_ai_prompts,
+    "accounts": _export_accounts,
+    "positions": _export_positions,
+    "transactions": _export_transactions,
+    "subscriptions": _export_subscriptions,
+}
+
+
 # Import functions
 
+# 每批写入的行数，避免单条多行 INSERT 超出 max_allowed_packet
+IMPORT_BATCH_SIZE = 500
+
+
+def _insert_rows(cur, sql: str, rows: List[tuple], result: Dict[str, Any], describe=None):
+    """按批 executemany 写入；某批失败时逐行重试，保证按行统计失败数。"""
+    for i in range(0, len(rows), IMPORT_BATCH_SIZE):
+        batch = rows[i:i + IMPORT_BATCH_SIZE]
+        cur.execute("SAVEPOINT import_batch")
+        try:
+            cur.executemany(sql, batch)
+            result["imported"] += len(batch)
+            continue
+        except Exception:
+            # 超过 max_stmt_length 时 PyMySQL 会把一批拆成多条 INSERT，失败前的几条已写入；
+            # 回到批次起点再逐行重试，避免重复写入
+            cur.execute("ROLLBACK TO SAVEPOINT import_batch")
+        for row in batch:
+            try:
+                cur.execute(sql, row)
+                result["imported"] += 1
+            except Exception as e:
+                result["failed"] += 1
+                result["errors"].append(describe(row, e) if describe else str(e))
+
+
+def _owned_account_ids(cur, user_id: int = None) -> set:
+    cur.execute("SELECT id FROM accounts WHERE user_id = %s", (user_id,))
+    return {r["id"] for r in cur.fetchall()}
+
+
+def _as_account_id(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
 def _import_settings(cur, data: Dict[str, str], mode: str) -> Dict[str, Any]:
     result = {"total": len(data), "imported": 0, "skipped": 0, "failed": 0, "deleted": 0, "errors": []}
+    rows = []
     for key, value in data.items():
         if value == SENSITIVE_MASK:
             result["skipped"] += 1
             continue
-        try:
-            cur.execute("""
-                INSERT INTO settings (`key`, value) VALUES (%s, %s)
-                ON DUPLICATE KEY UPDATE value = VALUES(value), updated_at = CURRENT_TIMESTAMP
-            """, (key, value))
-            result["imported"] += 1
-        except Exception as e:
-            result["failed"] += 1
-            result["errors"].append(f"Failed to import setting {key}: {str(e)}")
+        rows.append((key, value))
+    _insert_rows(cur, """
+        INSERT INTO settings (`key`, value) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE value = VALUES(value), updated_at = CURRENT_TIMESTAMP
+    """, rows, result, describe=lambda row, e: f"Failed to import setting {row[0]}: {str(e)}")
     return result
 
 
@@ -207,25 +257,49 @@ def _import_ai_prompts(cur, data: List[Dict[str, Any]], mode: str, user_id: int
         cur.execute("DELETE FROM ai_prompts WHERE user_id = %s", (user_id,))
         result["deleted"] = cur.rowcount
 
+    existing = set()
+    if mode == "merge":
+        cur.execute("SELECT name FROM ai_prompts WHERE user_id = %s OR user_id IS NULL", (user_id,))
+        existing = {r["name"] for r in cur.fetchall()}
+
+    rows = []
     for prompt in data:
         try:
             name = prompt.get("name")
-            if not name:
+            if not name or name in existing:
                 result["skipped"] += 1
                 continue
             if mode == "merge":
-                cur.execute("SELECT id FROM ai_prompts WHERE (user_id = %s OR user_id IS NULL) AND name = %s", (user_id, name))
-                if cur.fetchone():
-                    result["skipped"] += 1
-                    continue
-            cur.execute("""
-                INSERT INTO ai_prompts (user_id, name, system_prompt, user_prompt, is_default)
-                VALUES (%s, %s, %s, %s, %s)
-            """, (user_id, name, prompt.get("system_prompt", ""), prompt.get("user_prompt", ""), prompt.get("is_default", False)))
+                existing.add(name)
+            rows.append([user_id, name, prompt.get("system_prompt", ""), prompt.get("user_prompt", ""),
+                         bool(prompt.get("is_default", False))])
+        except Exception as e:
+            result["failed"] += 1
+            result["errors"].append(str(e))
+
+    # 每个用户只能有一个默认模板：导入的最后一个默认模板取代现有的。
+    # 该行单独写入，成功后才撤下旧默认，写入失败时用户仍保留原默认模板
+    defaults = [row for row in rows if row[4]]
+    for row in defaults[:-1]:
+        row[4] = False
+    default_row = defaults[-1] if defaults else None
+    sql = """
+        INSERT INTO ai_prompts (user_id, name, system_prompt, user_prompt, is_default)
+        VALUES (%s, %s, %s, %s, %s)
+    """
+    _insert_rows(cur, sql, [tuple(row) for row in rows if row is not default_row], result)
+    if default_row:
+        try:
+            # default_owner 唯一索引不容两个默认并存：先按非默认写入，再切换
+            cur.execute(sql, tuple(default_row[:4]) + (False,))
+            prompt_id = cur.lastrowid
             result["imported"] += 1
         except Exception as e:
             result["failed"] += 1
             result["errors"].append(str(e))
+        else:
+            cur.execute("UPDATE ai_prompts SET is_default = FALSE WHERE default_owner = %s", (user_id,))
+            cur.execute("UPDATE ai_prompts SET is_default = TRUE WHERE id = %s", (prompt_id,))
     return result
 
 
@@ -235,85 +309,91 @@ def _import_accounts(cur, data: List[Dict[str, Any]], mode: str, user_id: int =
         cur.execute("DELETE FROM accounts WHERE user_id = %s", (user_id,))
         result["deleted"] = cur.rowcount
 
+    existing = set()
+    if mode == "merge":
+        cur.execute("SELECT name FROM accounts WHERE user_id = %s", (user_id,))
+        existing = {r["name"] for r in cur.fetchall()}
+
+    rows = []
     for account in data:
         try:
             name = account.get("name")
-            if not name:
+            if not name or name in existing:
                 result["skipped"] += 1
                 continue
             if mode == "merge":
-                cur.execute("SELECT id FROM accounts WHERE user_id = %s AND name = %s", (user_id, name))
-                if cur.fetchone():
-                    result["skipped"] += 1
-                    continue
-            cur.execute("INSERT INTO accounts (user_id, name, description) VALUES (%s, %s, %s)",
-                        (user_id, name, account.get("description", "")))
-            result["imported"] += 1
+                existing.add(name)
+            rows.append((user_id, name, account.get("description", "")))
         except Exception as e:
             result["failed"] += 1
             result["errors"].append(str(e))
+    _insert_rows(cur, "INSERT INTO accounts (user_id, name, description) VALUES (%s, %s, %s)", rows, result)
     return result
 
 
-def _import_positions(cur, data: List[Dict[str, Any]], mode: str, user_id: int = None) -> Dict[str, Any]:
+def _import_positions(cur, data: List[Dict[str, Any]], mode: str, user_id: int = None, owned: set = None) -> Dict[str, Any]:
     result = {"total": len(data), "imported": 0, "skipped": 0, "failed": 0, "deleted": 0, "errors": []}
     if mode == "replace":
         cur.execute("DELETE FROM positions WHERE account_id IN (SELECT id FROM accounts WHERE user_id = %s)", (user_id,))
         result["deleted"] = cur.rowcount
 
+    if owned is None:
+        owned = _owned_account_ids(cur, user_id)
+    existing = set()
+    if mode == "merge":
+        cur.execute("""
+            SELECT p.account_id, p.code FROM positions p
+            JOIN accounts a ON p.account_id = a.id WHERE a.user_id = %s
+        """, (user_id,))
+        existing = {(r["account_id"], r["code"]) for r in cur.fetchall()}
+
+    rows = []
     for position in data:
         try:
-            account_id = position.get("account_id")
+            account_id = _as_account_id(position.get("account_id"))
             code = position.get("code")
-            if not account_id or not code:
-                result["skipped"] += 1
-                continue
-            cur.execute("SELECT id FROM accounts WHERE id = %s AND user_id = %s", (account_id, user_id))
-            if not cur.fetchone():
+            if not account_id or not code or account_id not in owned or (account_id, code) in existing:
                 result["skipped"] += 1
                 continue
             if mode == "merge":
-                cur.execute("SELECT 1 FROM positions WHERE account_id = %s AND code = %s", (account_id, code))
-                if cur.fetchone():
-                    result["skipped"] += 1
-                    continue
-            cur.execute("INSERT INTO positions (account_id, code, cost, shares) VALUES (%s, %s, %s, %s)",
-                        (account_id, code, position.get("cost", 0.0), position.get("shares", 0.0)))
-            result["imported"] += 1
+                existing.add((account_id, code))
+            rows.append((account_id, code, position.get("cost", 0.0), position.get("shares", 0.0)))
         except Exception as e:
             result["failed"] += 1
             result["errors"].append(str(e))
+    # 按主键 (account_id, code) 排序后写入：顺序追加聚簇索引，行锁按固定次序获取
+    rows.sort(key=lambda r: (r[0], str(r[1])))
+    _insert_rows(cur, "INSERT INTO positions (account_id, code, cost, shares) VALUES (%s, %s, %s, %s)", rows, result)
     return result
 
 
-def _import_transactions(cur, data: List[Dict[str, Any]], mode: str, user_id: int = None) -> Dict[str, Any]:
+def _import_transactions(cur, data: List[Dict[str, Any]], mode: str, user_id: int = None, owned: set = None) -> Dict[str, Any]:
     result = {"total": len(data), "imported": 0, "skipped": 0, "failed": 0, "deleted": 0, "errors": []}
     if mode == "replace":
         cur.execute("DELETE FROM transactions WHERE account_id IN (SELECT id FROM accounts WHERE user_id = %s)", (user_id,))
         result["deleted"] = cur.rowcount
 
+    if owned is None:
+        owned = _owned_account_ids(cur, user_id)
+    rows = []
     for t in data:
         try:
-            account_id = t.get("account_id")
+            account_id = _as_account_id(t.get("account_id"))
             code = t.get("code")
-            if not account_id or not code:
-                result["skipped"] += 1
-                continue
-            cur.execute("SELECT id FROM accounts WHERE id = %s AND user_id = %s", (account_id, user_id))
-            if not cur.fetchone():
+            if not account_id or not code or account_id not in owned:
                 result["skipped"] += 1
                 continue
-            cur.execute("""
-                INSERT INTO transactions (account_id, code, op_type, amount_cny, shares_redeemed,
-                    confirm_date, confirm_nav, shares_added, cost_after, applied_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, (account_id, code, t.get("op_type"), t.get("amount_cny"), t.get("shares_redeemed"),
-                  t.get("confirm_date"), t.get("confirm_nav"), t.get("shares_added"), t.get("cost_after"),
-                  t.get("applied_at")))
-            result["imported"] += 1
+            rows.append((account_id, code, t.get("op_type"), t.get("amount_cny"), t.get("shares_redeemed"),
+                         t.get("confirm_date"), t.get("confirm_nav"), t.get("shares_added"), t.get("cost_after"),
+                         t.get("applied_at")))
         except Exception as e:
             result["failed"] += 1
             result["errors"].append(str(e))
+    _insert_rows(cur, """
+        INSERT INTO transactions (account_id, code, op_type, amount_cny, shares_redeemed,
+            confirm_date, confirm_nav, shares_added, cost_after, applied_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, rows, result)
     return result
 
 
@@ -323,27 +403,42 @@ def _import_subscriptions(cur, data: List[Dict[str, Any]], mode: str, user_id: i
         cur.execute("DELETE FROM subscriptions WHERE user_id = %s", (user_id,))
         result["deleted"] = cur.rowcount
 
+    existing = set()
+    if mode == "merge":
+        cur.execute("SELECT code, email FROM subscriptions WHERE user_id = %s", (user_id,))
+        existing = {(r["code"], r["email"]) for r in cur.fetchall()}
+
+    rows = []
     for sub in data:
         try:
             code = sub.get("code")
             email = sub.get("email")
-            if not code or not email:
+            if not code or not email or (code, email) in existing:
                 result["skipped"] += 1
                 continue
             if mode == "merge":
-                cur.execute("SELECT id FROM subscriptions WHERE user_id = %s AND code = %s AND email = %s", (user_id, code, email))
-                if cur.fetchone():
-                    result["skipped"] += 1
-                    continue
-            cur.execute("""
-                INSERT INTO subscriptions (user_id, code, email, threshold_up, threshold_down,
-                    enable_digest, digest_time, enable_volatility)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """, (user_id, code, email, sub.get("threshold_up"), sub.get("threshold_down"),
-                  sub.get("enable_digest", False), sub.get("digest_time", "14:45"),
-                  sub.get("enable_volatility", True)))
-            result["imported"] += 1
+                existing.add((code, email))
+            rows.append((user_id, code, email, sub.get("threshold_up"), sub.get("threshold_down"),
+                         sub.get("enable_digest", False), sub.get("digest_time", "14:45"),
+                         sub.get("enable_volatility", True)))
         except Exception as e:
             result["failed"] += 1
             result["errors"].append(str(e))
+    _insert_rows(cur, """
+        INSERT INTO subscriptions (user_id, code, email, threshold_up, threshold_down,
+            enable_digest, digest_time, enable_volatility)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """, rows, result)
     return result
+
+
+_IMPORTERS = {
+    "settings": lambda cur, data, mode, user_id: _import_settings(cur, data, mode),
+    "ai_prompts": _import_ai_prompts,
+    "accounts": _import_accounts,
+    "positions": _import_positions,
+    "transactions": _import_transactions,
+    "subscriptions": _import_subscriptions,
+}
+# 这些模块额外接收已归属账户集合
+_ACCOUNT_SCOPED_IMPORTS = {"positions", "transactions"}
@@ -1,4 +1,8 @@
+import atexit
 import smtplib
+import threading
+import time
+from collections import OrderedDict
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import logging
@@ -6,6 +10,103 @@ from ..config import Config
 
 logger = logging.getLogger(__name__)
 
+# 复用已登录的 SMTP 连接，省去每封邮件的 TCP + STARTTLS + AUTH 握手。
+# 按 (host, port, user, password) 分组；空闲过久或发送过多后丢弃重建
+SMTP_POOL_SIZE = 5
+SMTP_MAX_SENDS_PER_CONN = 100
+SMTP_IDLE_TIMEOUT = 60
+_smtp_pool: dict = {}
+_smtp_pool_lock = threading.Lock()
+
+
+def _smtp_connect(host: str, port: int, user: str, password: str) -> smtplib.SMTP:
+    server = smtplib.SMTP(host, port)
+    server.starttls()
+    server.login(user, password)
+    return server
+
+
+def _smtp_close(server):
+    try:
+        server.quit()
+    except Exception:
+        try:
+            server.close()
+        except Exception:
+            pass
+
+
+def _smtp_acquire(key: tuple):
+    """取一个仍在空闲期内的连接；没有则返回 (None, 0)。"""
+    now = time.monotonic()
+    stale = []
+    found = (None, 0)
+    with _smtp_pool_lock:
+        idle = _smtp_pool.get(key, [])
+        while idle:
+            server, sends, last_used = idle.pop()
+            if now - last_used < SMTP_IDLE_TIMEOUT:
+                found = (server, sends)
+                break
+            stale.append(server)
+    for server in stale:
+        _smtp_close(server)
+    return found
+
+
+def _smtp_release(key: tuple, server, sends: int):
+    if sends < SMTP_MAX_SENDS_PER_CONN:
+        with _smtp_pool_lock:
+            idle = _smtp_pool.setdefault(key, [])
+            if len(idle) < SMTP_POOL_SIZE:
+                idle.append((server, sends, time.monotonic()))
+                return
+    _smtp_close(server)
+
+
+def close_smtp_pool():
+    with _smtp_pool_lock:
+        servers = [entry[0] for idle in _smtp_pool.values() for entry in idle]
+        _smtp_pool.clear()
+    for server in servers:
+        _smtp_close(server)
+
+
+atexit.register(close_smtp_pool)
+
+
+# 用户级 SMTP 设置的短时缓存：调度器一轮给同一用户发多封邮件时只查库、解密一次。
+# 保存设置时由 settings 路由调用 clear_user_settings_cache 立即失效
+USER_SETTINGS_TTL = 60
+_USER_SETTINGS_MAXSIZE = 1024
+_user_settings_cache: "OrderedDict[int, tuple]" = OrderedDict()
+_user_settings_lock = threading.Lock()
+
+
+def _load_user_settings(user_id: int) -> dict:
+    now = time.monotonic()
+    with _user_settings_lock:
+        entry = _user_settings_cache.get(user_id)
+        if entry is not None and now - entry[1] < USER_SETTINGS_TTL:
+            return entry[0]
+    from ..routers.settings import get_user_effective_settings
+    settings = get_user_effective_settings(user_id)
+    with _user_settings_lock:
+        _user_settings_cache[user_id] = (settings, now)
+        _user_settings_cache.move_to_end(user_id)
+        while len(_user_settings_cache) > _USER_SETTINGS_MAXSIZE:
+            _user_settings_cache.popitem(last=False)
+    return settings
+
+
+def clear_user_settings_cache(user_id: int = None):
+    """清除某个用户（或全部，全局设置变更时）缓存的 SMTP 设置。"""
+    with _user_settings_lock:
+        if user_id is None:
+            _user_settings_cache.clear()
+        else:
+            _user_settings_cache.pop(user_id, None)
+
 
 def send_email(to_email: str, subject: str, content: str, is_html: bool = False, user_id: int = None):
     """
@@ -20,8 +121,7 @@ def send_email(to_email: str, subject: str, content: str, is_html: bool = False,
 
     if user_id is not None:
         try:
-            from ..routers.settings import get_user_effective_settings
-            settings = get_user_effective_settings(user_id)
+            settings = _load_user_settings(user_id)
             smtp_host = settings.get("SMTP_HOST")
             smtp_port = settings.get("SMTP_PORT")
             smtp_user = settings.get("SMTP_USER")
@@ -56,14 +156,25 @@ def send_email(to_email: str, subject: str, content: str, is_html: bool = False,
     else:
         msg.attach(MIMEText(content, 'plain'))
 
+    key = (smtp_host, int(smtp_port), smtp_user, smtp_password)
+    server = None
     try:
-        server = smtplib.SMTP(smtp_host, int(smtp_port))
-        server.starttls()
-        server.login(smtp_user, smtp_password)
-        server.send_message(msg)
-        server.quit()
+        server, sends = _smtp_acquire(key)
+        if server is not None:
+            try:
+                server.send_message(msg)
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                # 复用的连接已被服务器断开，换新连接重发一次
+                _smtp_close(server)
+                server = None
+        if server is None:
+            server, sends = _smtp_connect(*key), 0
+            server.send_message(msg)
+        _smtp_release(key, server, sends + 1)
         logger.info(f"Email sent to {to_email}")
         return True
     except Exception as e:
+        if server is not None:
+            _smtp_close(server)
         logger.error(f"Failed to send email to {to_email}: {e}")
         return False
@@ -2,32 +2,29 @@ from __future__ import annotations
 
 import time
 import json
+import math
 import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import List, Dict, Any
 
+import numpy as np
 import pandas as pd
 import akshare as ak
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from ..db import get_db_connection, release_db_connection, dict_cursor
+from ..db import get_db_connection, release_db_connection, dict_cursor, tuple_cursor
 from ..config import Config
 
 
-def get_fund_type(code: str, name: str) -> str:
-    conn = None
-    try:
-        conn = get_db_connection()
-        cur = dict_cursor(conn)
-        cur.execute("SELECT type FROM funds WHERE code = %s", (code,))
-        row = cur.fetchone()
-        if row and row["type"]:
-            return row["type"]
-    except Exception as e:
-        print(f"DB query error for {code}: {e}")
-    finally:
-        if conn:
-            release_db_connection(conn)
-
+@lru_cache(maxsize=4096)
+def classify_fund_type(name: str) -> str:
+    """按基金名称关键词推断类型（纯函数，可缓存）。"""
     if "债" in name or "纯债" in name or "固收" in name:
         return "债券"
     if "QDII" in name or "纳斯达克" in name or "标普" in name or "恒生" in name:
@@ -37,53 +34,221 @@ def get_fund_type(code: str, name: str) -> str:
     return "未知"
 
 
-def get_eastmoney_valuation(code: str) -> Dict[str, Any]:
+# 数据源响应解析用的正则，模块加载时编译一次
+_RE_FS_NAME = re.compile(r'fS_name\s*=\s*"(.*?)";')
+_RE_FS_CODE = re.compile(r'fS_code\s*=\s*"(.*?)";')
+# 大块 JS 值（净值走势可达数百 KB）先定位变量头，再找首个 "]; /*" 结尾，
+# 比整体 (\[.+?\]) 惰性匹配逐字符回溯快一个数量级
+_RE_MANAGER_HEAD = re.compile(r'Data_currentFundManager\s*=\s*\[')
+_RE_PERF_HEAD = re.compile(r'Data_performanceEvaluation\s*=\s*\{')
+_RE_HIST_HEAD = re.compile(r'Data_netWorthTrend\s*=\s*\[')
+_RE_ARRAY_TAIL = re.compile(r'\]\s*;\s*/\*')
+_RE_OBJECT_TAIL = re.compile(r'\}\s*;\s*/\*')
+# 四个收益率字段一趟扫描取完，每个字段保留首次出现的值
+_SYL_KEYS = ("syl_1n", "syl_6y", "syl_3y", "syl_1y")
+_RE_SYL = re.compile(r'(syl_1n|syl_6y|syl_3y|syl_1y)\s*=\s*"([^"]*)";')
+
+
+# 同步数据源请求共用一个 Session：按主机保持长连接，省去每次 TCP 握手。
+# 只重试连接失败，读超时不重试，避免单次调用耗时成倍放大
+_SESSION = requests.Session()
+_SESSION.headers.update({"User-Agent": "Mozilla/5.0"})
+_SESSION_ADAPTER = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=32,
+    max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2),
+)
+_SESSION.mount("http://", _SESSION_ADAPTER)
+_SESSION.mount("https://", _SESSION_ADAPTER)
+
+
+# 远程数据短期缓存：同一轮调度里订阅检查、分时采集、详情页常会重复请求同一基金。
+# 只缓存非空结果，取出时返回浅拷贝，调用方修改不会污染缓存
+VALUATION_CACHE_TTL = 30
+PINGZHONG_CACHE_TTL = 3600
+_VALUATION_CACHE_MAXSIZE = 2048
+_PINGZHONG_CACHE_MAXSIZE = 256
+_valuation_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_pingzhong_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_remote_cache_lock = threading.Lock()
+
+
+def _remote_cache_get(cache: OrderedDict, key: str, ttl: float):
+    with _remote_cache_lock:
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        value, cached_at = entry
+        if time.monotonic() - cached_at > ttl:
+            del cache[key]
+            return None
+        cache.move_to_end(key)
+        return dict(value)
+
+
+def _remote_cache_put(cache: OrderedDict, key: str, value: Dict[str, Any], maxsize: int):
+    if not value:
+        return
+    with _remote_cache_lock:
+        cache[key] = (dict(value), time.monotonic())
+        cache.move_to_end(key)
+        while len(cache) > maxsize:
+            cache.popitem(last=False)
+
+
+def clear_remote_caches():
+    with _remote_cache_lock:
+        _valuation_cache.clear()
+        _pingzhong_cache.clear()
+
+
+def _extract_js_value(text: str, head: re.Pattern, tail: re.Pattern):
+    """取出 `var X = [...];/*` 形式的 JS 字面量文本（含括号），找不到时返回 None。"""
+    h = head.search(text)
+    if not h:
+        return None
+    t = tail.search(text, h.end())
+    if not t:
+        return None
+    return text[h.end() - 1:t.start() + 1]
+
+
+def _eastmoney_request(code: str):
     url = f"http://fundgz.1234567.com.cn/js/{code}.js?rt={int(time.time()*1000)}"
-    headers = {"User-Agent": "Mozilla/5.0"}
+    return url, {"User-Agent": "Mozilla/5.0"}
+
+
+_JSONPGZ_PREFIX = "jsonpgz("
+
+
+def _jsonp_payload(text: str):
+    # 响应固定为 jsonpgz({...});，按前缀和最后一个右括号切片，与原贪婪正则等价
+    start = text.find(_JSONPGZ_PREFIX)
+    end = text.rfind(")")
+    if start < 0 or end < start + len(_JSONPGZ_PREFIX):
+        return None
+    return text[start + len(_JSONPGZ_PREFIX):end]
+
+
+def _parse_eastmoney(text: str) -> Dict[str, Any]:
+    payload = _jsonp_payload(text)
+    if payload:
+        data = json.loads(payload)
+        return {
+            "name": data.get("name"),
+            "nav": float(data.get("dwjz", 0.0)),
+            "estimate": float(data.get("gsz", 0.0)),
+            "estRate": float(data.get("gszzl", 0.0)),
+            "time": data.get("gztime")
+        }
+    return {}
+
+
+def _sina_request(code: str):
+    return f"http://hq.sinajs.cn/list=fu_{code}", {"Referer": "http://finance.sina.com.cn"}
+
+
+def _parse_sina(text: str) -> Dict[str, Any]:
+    # 等价于贪婪匹配 ="(.*)"：首个 =" 到最后一个引号之间
+    start = text.find('="') + 2
+    end = text.rfind('"')
+    if start >= 2 and end > start:
+        parts = text[start:end].split(',')
+        if len(parts) >= 8:
+            return {
+                "estimate": float(parts[2]),
+                "nav": float(parts[3]),
+                "estRate": float(parts[6]),
+                "time": f"{parts[7]} {parts[1]}"
+            }
+    return {}
+
+
+def get_eastmoney_valuation(code: str) -> Dict[str, Any]:
+    url, headers = _eastmoney_request(code)
     try:
-        response = requests.get(url, headers=headers, timeout=5)
+        response = _SESSION.get(url, headers=headers, timeout=5)
         if response.status_code == 200:
-            match = re.search(r"jsonpgz\((.*)\)", response.text)
-            if match and match.group(1):
-                data = json.loads(match.group(1))
-                return {
-                    "name": data.get("name"),
-                    "nav": float(data.get("dwjz", 0.0)),
-                    "estimate": float(data.get("gsz", 0.0)),
-                    "estRate": float(data.get("gszzl", 0.0)),
-                    "time": data.get("gztime")
-                }
+            return _parse_eastmoney(response.text)
     except Exception as e:
         print(f"Eastmoney API error for {code}: {e}")
     return {}
 
 
 def get_sina_valuation(code: str) -> Dict[str, Any]:
-    url = f"http://hq.sinajs.cn/list=fu_{code}"
-    headers = {"Referer": "http://finance.sina.com.cn"}
+    url, headers = _sina_request(code)
     try:
-        response = requests.get(url, headers=headers, timeout=5)
-        match = re.search(r'="(.*)"', response.text)
-        if match and match.group(1):
-            parts = match.group(1).split(',')
-            if len(parts) >= 8:
-                return {
-                    "estimate": float(parts[2]),
-                    "nav": float(parts[3]),
-                    "estRate": float(parts[6]),
-                    "time": f"{parts[7]} {parts[1]}"
-                }
+        response = _SESSION.get(url, headers=headers, timeout=5)
+        return _parse_sina(response.text)
     except Exception as e:
         print(f"Sina Valuation API error for {code}: {e}")
     return {}
 
 
 def get_combined_valuation(code: str) -> Dict[str, Any]:
+    cached = _remote_cache_get(_valuation_cache, code, VALUATION_CACHE_TTL)
+    if cached is not None:
+        return cached
     data = get_eastmoney_valuation(code)
     if not data or data.get("estimate") == 0.0:
         sina_data = get_sina_valuation(code)
         if sina_data:
             data.update(sina_data)
+    _remote_cache_put(_valuation_cache, code, data, _VALUATION_CACHE_MAXSIZE)
+    return data
+
+
+# 异步估值：持仓列表并发拉取时共用一个连接池，由应用 lifespan 打开/关闭
+_valuation_client: httpx.AsyncClient | None = None
+
+
+def new_valuation_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        timeout=5,
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+    )
+
+
+def get_valuation_client() -> httpx.AsyncClient | None:
+    return _valuation_client
+
+
+async def open_valuation_client():
+    global _valuation_client
+    if _valuation_client is None:
+        _valuation_client = new_valuation_client()
+
+
+async def close_valuation_client():
+    global _valuation_client
+    if _valuation_client is not None:
+        await _valuation_client.aclose()
+        _valuation_client = None
+
+
+async def get_combined_valuation_async(client: httpx.AsyncClient, code: str) -> Dict[str, Any]:
+    """get_combined_valuation 的异步版本，两个数据源的解析逻辑相同，共用缓存。"""
+    cached = _remote_cache_get(_valuation_cache, code, VALUATION_CACHE_TTL)
+    if cached is not None:
+        return cached
+    data = {}
+    url, headers = _eastmoney_request(code)
+    try:
+        response = await client.get(url, headers=headers)
+        if response.status_code == 200:
+            data = _parse_eastmoney(response.text)
+    except Exception as e:
+        print(f"Eastmoney API error for {code}: {e}")
+    if not data or data.get("estimate") == 0.0:
+        url, headers = _sina_request(code)
+        try:
+            response = await client.get(url, headers=headers)
+            sina_data = _parse_sina(response.text)
+            if sina_data:
+                data.update(sina_data)
+        except Exception as e:
+            print(f"Sina Valuation API error for {code}: {e}")
+    _remote_cache_put(_valuation_cache, code, data, _VALUATION_CACHE_MAXSIZE)
     return data
 
 
@@ -106,43 +271,114 @@ def search_funds(q: str) -> List[Dict[str, Any]]:
         release_db_connection(conn)
 
 
+# 基金大类列表：基金库每日更新一次，短 TTL 缓存即可
+_CATEGORIES_TTL = 300
+_categories_cache: List[str] | None = None
+_categories_cache_ts = 0.0
+
+
+# 基金类型 → 大类；按优先级排列，先命中的分支生效（如“偏股混合”归股票型）
+_CATEGORY_RULES = [
+    ("股票型", ("股票", "偏股")),
+    ("混合型", ("混合",)),
+    ("债券型", ("债",)),
+    ("指数型", ("指数",)),
+    ("QDII", ("QDII",)),
+    ("货币型", ("货币",)),
+    ("FOF", ("FOF",)),
+    ("REITs", ("REITs", "Reits")),
+]
+# 归类与汇总都在 SQL 中完成，数据库最多返回 len(_CATEGORY_RULES) + 1 行
+_CATEGORIES_SQL = """
+    SELECT major, SUM(c) AS count FROM (
+        SELECT CASE {} ELSE '其他' END AS major, COUNT(*) AS c
+        FROM funds
+        WHERE type IS NOT NULL AND type != ''
+        GROUP BY type
+    ) t
+    GROUP BY major ORDER BY count DESC, major
+""".format(" ".join(
+    "WHEN " + " OR ".join(["type LIKE %s"] * len(keywords)) + " THEN %s"
+    for _, keywords in _CATEGORY_RULES
+))
+_CATEGORIES_PARAMS = tuple(
+    p for label, keywords in _CATEGORY_RULES for p in (*(f"%{k}%" for k in keywords), label)
+)
+
+
+def get_fund_categories() -> List[str]:
+    """基金大类，按基金数量降序，数量相同按名称排序。"""
+    global _categories_cache, _categories_cache_ts
+    if _categories_cache is not None and time.monotonic() - _categories_cache_ts < _CATEGORIES_TTL:
+        return _categories_cache
+
+    conn = get_db_connection()
+    try:
+        cur = dict_cursor(conn)
+        cur.execute(_CATEGORIES_SQL, _CATEGORIES_PARAMS)
+        _categories_cache = [row["major"] for row in cur.fetchall()]
+    finally:
+        release_db_connection(conn)
+
+    _categories_cache_ts = time.monotonic()
+    return _categories_cache
+
+
+def clear_fund_categories_cache():
+    global _categories_cache
+    _categories_cache = None
+
+
 def get_eastmoney_pingzhong_data(code: str) -> Dict[str, Any]:
+    # 经理、收益率、净值走势按日更新，缓存一小时
+    cached = _remote_cache_get(_pingzhong_cache, code, PINGZHONG_CACHE_TTL)
+    if cached is not None:
+        return cached
+    data = _fetch_pingzhong_data(code)
+    _remote_cache_put(_pingzhong_cache, code, data, _PINGZHONG_CACHE_MAXSIZE)
+    return data
+
+
+def _fetch_pingzhong_data(code: str) -> Dict[str, Any]:
     url = Config.EASTMONEY_DETAILED_API_URL.format(code=code)
     try:
-        response = requests.get(url, timeout=5)
+        response = _SESSION.get(url, timeout=5)
         if response.status_code == 200:
             text = response.text
             data = {}
-            name_match = re.search(r'fS_name\s*=\s*"(.*?)";', text)
+            name_match = _RE_FS_NAME.search(text)
             if name_match: data["name"] = name_match.group(1)
 
-            code_match = re.search(r'fS_code\s*=\s*"(.*?)";', text)
+            code_match = _RE_FS_CODE.search(text)
             if code_match: data["code"] = code_match.group(1)
 
-            manager_match = re.search(r'Data_currentFundManager\s*=\s*(\[.+?\])\s*;\s*/\*', text)
-            if manager_match:
+            manager_js = _extract_js_value(text, _RE_MANAGER_HEAD, _RE_ARRAY_TAIL)
+            if manager_js:
                 try:
-                    managers = json.loads(manager_match.group(1))
+                    managers = json.loads(manager_js)
                     if managers:
                         data["manager"] = ", ".join([m["name"] for m in managers])
                 except: pass
 
-            for key in ["syl_1n", "syl_6y", "syl_3y", "syl_1y"]:
-                m = re.search(rf'{key}\s*=\s*"(.*?)";', text)
-                if m: data[key] = m.group(1)
+            syl = {}
+            for m in _RE_SYL.finditer(text):
+                syl.setdefault(m.group(1), m.group(2))
+                if len(syl) == len(_SYL_KEYS):
+                    break
+            data.update((key, syl[key]) for key in _SYL_KEYS if key in syl)
 
-            perf_match = re.search(r'Data_performanceEvaluation\s*=\s*(\{.+?\})\s*;\s*/\*', text)
-            if perf_match:
+            perf_js = _extract_js_value(text, _RE_PERF_HEAD, _RE_OBJECT_TAIL)
+            if perf_js:
                 try:
-                    perf = json.loads(perf_match.group(1))
+                    perf = json.loads(perf_js)
                     if perf and "data" in perf and "categories" in perf:
                         data["performance"] = dict(zip(perf["categories"], perf["data"]))
                 except: pass
 
-            history_match = re.search(r'Data_netWorthTrend\s*=\s*(\[.+?\])\s*;\s*/\*', text)
-            if history_match:
+            history_js = _extract_js_value(text, _RE_HIST_HEAD, _RE_ARRAY_TAIL)
+            if history_js:
                 try:
-                    raw_hist = json.loads(history_match.group(1))
+                    raw_hist = json.loads(history_js)
                     data["history"] = [
                         {"date": time.strftime('%Y-%m-%d', time.localtime(item['x']/1000)), "nav": float(item['y'])}
                         for item in raw_hist
@@ -169,6 +405,10 @@ def _get_fund_info_from_db(code: str) -> Dict[str, Any]:
     return {}
 
 
+# 各市场行情行用到的最大字段下标 + 1（美股 gb_ 取 [2]，港股取 [3]/[6]，A 股取 [2]/[3]）
+_SINA_SPOT_SPLITS = {"gb": 3, "hk": 7}
+
+
 def _fetch_stock_spots_sina(codes: List[str]) -> Dict[str, float]:
     if not codes:
         return {}
@@ -203,17 +443,19 @@ def _fetch_stock_spots_sina(codes: List[str]) -> Dict[str, float]:
     headers = {"Referer": "http://finance.sina.com.cn"}
 
     try:
-        response = requests.get(url, headers=headers, timeout=5)
+        response = _SESSION.get(url, headers=headers, timeout=5)
         results = {}
         for line in response.text.strip().split('\n'):
-            if not line or '=' not in line or '"' not in line: continue
-            line_key = line.split('=')[0].split('_str_')[-1]
+            head, sep, quoted = line.partition('="')
+            if not sep: continue
+            line_key = head.rpartition('_str_')[2]
             original_code = code_map.get(line_key)
             if not original_code: continue
 
-            data_part = line.split('"')[1]
+            data_part = quoted.partition('"')[0]
             if not data_part: continue
-            parts = data_part.split(',')
+            # A 股/港股行有三十来个字段，只需前几个：限定切分次数，少建字符串
+            parts = data_part.split(',', _SINA_SPOT_SPLITS.get(line_key[:2], 4))
 
             change = 0.0
             try:
@@ -240,38 +482,49 @@ def _fetch_stock_spots_sina(codes: List[str]) -> Dict[str, float]:
         return {}
 
 
+HISTORY_BATCH_SIZE = 1000
+
+
+def _history_cache_valid(latest_update, latest_nav_date, row_count: int, limit: int) -> bool:
+    try:
+        from datetime import datetime
+        update_time = latest_update if isinstance(latest_update, datetime) else datetime.fromisoformat(str(latest_update))
+        age_hours = (datetime.now() - update_time.replace(tzinfo=None)).total_seconds() / 3600
+        today_str = datetime.now().strftime("%Y-%m-%d")
+        current_hour = datetime.now().hour
+        min_rows = 10 if limit < 9999 else 100
+
+        if current_hour >= 16 and latest_nav_date < today_str:
+            return False
+        return age_hours < 24 and row_count >= min(limit, min_rows)
+    except:
+        return False
+
+
 def get_fund_history(code: str, limit: int = 30) -> List[Dict[str, Any]]:
     conn = get_db_connection()
     cur = dict_cursor(conn)
 
     if limit >= 9999:
-        cur.execute("SELECT date, nav, updated_at FROM fund_history WHERE code = %s ORDER BY date DESC", (code,))
+        # 全量历史可达数千行：先用一行探测新鲜度（行数只数到判定所需的 100），
+        # 缓存过期时就不必把整段历史从库里读出来再丢弃
+        cur.execute("""
+            SELECT h.date, h.updated_at,
+                   (SELECT COUNT(*) FROM (SELECT 1 FROM fund_history WHERE code = %s LIMIT 100) t) AS n
+            FROM fund_history h WHERE h.code = %s ORDER BY h.date DESC LIMIT 1
+        """, (code, code))
+        probe = cur.fetchone()
+        if probe and _history_cache_valid(probe["updated_at"], probe["date"], probe["n"], limit):
+            cur.execute("SELECT date, nav FROM fund_history WHERE code = %s ORDER BY date", (code,))
+            rows = cur.fetchall()
+            release_db_connection(conn)
+            return [{"date": row["date"], "nav": float(row["nav"])} for row in rows]
     else:
         cur.execute("SELECT date, nav, updated_at FROM fund_history WHERE code = %s ORDER BY date DESC LIMIT %s", (code, limit))
-
-    rows = cur.fetchall()
-
-    cache_valid = False
-    if rows:
-        latest_update = rows[0]["updated_at"]
-        latest_nav_date = rows[0]["date"]
-        try:
-            from datetime import datetime
-            update_time = latest_update if isinstance(latest_update, datetime) else datetime.fromisoformat(str(latest_update))
-            age_hours = (datetime.now() - update_time.replace(tzinfo=None)).total_seconds() / 3600
-            today_str = datetime.now().strftime("%Y-%m-%d")
-            current_hour = datetime.now().hour
-            min_rows = 10 if limit < 9999 else 100
-
-            if current_hour >= 16 and latest_nav_date < today_str:
-                cache_valid = False
-            else:
-                cache_valid = age_hours < 24 and len(rows) >= min(limit, min_rows)
-        except: pass
-
-    if cache_valid:
-        release_db_connection(conn)
-        return [{"date": row["date"], "nav": float(row["nav"])} for row in reversed(rows)]
+        rows = cur.fetchall()
+        if rows and _history_cache_valid(rows[0]["updated_at"], rows[0]["date"], len(rows), limit):
+            release_db_connection(conn)
+            return [{"date": row["date"], "nav": float(row["nav"])} for row in reversed(rows)]
 
     try:
         df = ak.fund_open_fund_info_em(symbol=code, indicator="单位净值走势")
@@ -283,18 +536,23 @@ def get_fund_history(code: str, limit: int = 30) -> List[Dict[str, Any]]:
             df = df.sort_values(by="净值日期", ascending=False).head(limit)
         df = df.sort_values(by="净值日期", ascending=True)
 
-        results = []
-        for _, row in df.iterrows():
-            d = row["净值日期"]
-            date_str = d.strftime("%Y-%m-%d") if hasattr(d, "strftime") else str(d)[:10]
-            nav_value = float(row["单位净值"])
-            results.append({"date": date_str, "nav": nav_value})
-
-            cur.execute("""
-                INSERT INTO fund_history (code, date, nav, updated_at)
-                VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+        # 整列转换日期与净值，不逐行构造 Series。date/Timestamp/字符串转成 str 后前 10 位即 YYYY-MM-DD
+        dates = df["净值日期"]
+        if pd.api.types.is_datetime64_any_dtype(dates):
+            date_strs = dates.dt.strftime("%Y-%m-%d").tolist()
+        else:
+            date_strs = dates.astype(str).str[:10].tolist()
+        navs = df["单位净值"].astype(float).tolist()
+        results = [{"date": d, "nav": v} for d, v in zip(date_strs, navs)]
+        rows_to_insert = [(code, d, v) for d, v in zip(date_strs, navs)]
+
+        # 多行 INSERT：updated_at 交给列默认值，VALUES 只留占位符以便 PyMySQL 改写
+        for i in range(0, len(rows_to_insert), HISTORY_BATCH_SIZE):
+            cur.executemany("""
+                INSERT INTO fund_history (code, date, nav)
+                VALUES (%s, %s, %s)
                 ON DUPLICATE KEY UPDATE nav = VALUES(nav), updated_at = CURRENT_TIMESTAMP
-            """, (code, date_str, nav_value))
+            """, rows_to_insert[i:i + HISTORY_BATCH_SIZE])
 
         conn.commit()
         release_db_connection(conn)
@@ -306,11 +564,57 @@ def get_fund_history(code: str, limit: int = 30) -> List[Dict[str, Any]]:
 
 
 def get_nav_on_date(code: str, date_str: str) -> float | None:
+    # 库里已有当日净值时走主键点查；缺失才走 get_fund_history（可能触发远程拉取）
+    conn = get_db_connection()
+    try:
+        cur = tuple_cursor(conn)
+        cur.execute("SELECT nav FROM fund_history WHERE code = %s AND date = %s", (code, date_str[:10]))
+        row = cur.fetchone()
+    finally:
+        release_db_connection(conn)
+    if row:
+        return float(row[0])
+
+    return _navs_from_history(code, {date_str[:10]}).get(date_str[:10])
+
+
+def _navs_from_history(code: str, dates) -> Dict[str, float]:
     history = get_fund_history(code, limit=90)
-    for item in history:
-        if item["date"][:10] == date_str[:10]:
-            return item["nav"]
-    return None
+    return {item["date"][:10]: item["nav"] for item in history if item["date"][:10] in dates}
+
+
+def get_nav_on_dates(pairs) -> Dict[tuple, float]:
+    """批量版 get_nav_on_date：pairs 为 (code, date_str)，返回查到的 {(code, date_str): nav}。
+
+    库内已有的净值一条 IN 查询取回；缺失的按基金分组，每只基金只走一次 get_fund_history。"""
+    pairs = list(dict.fromkeys(pairs))
+    if not pairs:
+        return {}
+    wanted = {(code, date_str[:10]): (code, date_str) for code, date_str in pairs}
+    conn = get_db_connection()
+    try:
+        cur = tuple_cursor(conn)
+        placeholders = ", ".join(["(%s, %s)"] * len(wanted))
+        cur.execute(
+            f"SELECT code, date, nav FROM fund_history WHERE (code, date) IN ({placeholders})",
+            [v for key in wanted for v in key],
+        )
+        found = {(code, date): float(nav) for code, date, nav in cur.fetchall()}
+    finally:
+        release_db_connection(conn)
+
+    missing = {}
+    for key in wanted:
+        if key not in found:
+            missing.setdefault(key[0], set()).add(key[1])
+    for code, dates in missing.items():
+        for date, nav in _navs_from_history(code, dates).items():
+            found[(code, date)] = nav
+
+    return {original: found[key] for key, original in wanted.items() if key in found}
+
+
+_SQRT_TRADING_DAYS = math.sqrt(250)
 
 
 def _calculate_technical_indicators(history: List[Dict[str, Any]]) -> Dict[str, Any]:
@@ -318,18 +622,19 @@ def _calculate_technical_indicators(history: List[Dict[str, Any]]) -> Dict[str,
         return {"sharpe": "--", "volatility": "--", "max_drawdown": "--", "annual_return": "--"}
 
     try:
-        import numpy as np
-        navs = np.array([item['nav'] for item in history])
-        daily_returns = np.diff(navs) / navs[:-1]
+        navs = np.fromiter((item['nav'] for item in history), dtype=float, count=len(history))
+        daily_returns = np.diff(navs)
+        daily_returns /= navs[:-1]
         total_return = (navs[-1] - navs[0]) / navs[0]
         years = len(history) / 250.0
         annual_return = (1 + total_return)**(1/years) - 1 if years > 0 else 0
-        volatility = np.std(daily_returns) * np.sqrt(250)
+        volatility = daily_returns.std() * _SQRT_TRADING_DAYS
         rf = 0.02
         sharpe = (annual_return - rf) / volatility if volatility > 0 else 0
-        rolling_max = np.maximum.accumulate(navs)
-        drawdowns = (navs - rolling_max) / rolling_max
-        max_drawdown = np.min(drawdowns)
+        # 回撤 (nav - peak) / peak 等于 nav / peak - 1，峰值序列原地复用
+        peaks = np.maximum.accumulate(navs)
+        np.divide(navs, peaks, out=peaks)
+        max_drawdown = peaks.min() - 1
 
         return {
             "sharpe": round(float(sharpe), 2),
@@ -342,8 +647,62 @@ def _calculate_technical_indicators(history: List[Dict[str, Any]]) -> Dict[str,
         return {"sharpe": "--", "volatility": "--", "max_drawdown": "--", "annual_return": "--"}
 
 
+def _fetch_holdings(code: str):
+    """前十大集中度 + 最多 20 条去重后的重仓股（附实时涨跌）。"""
+    holdings = []
+    concentration_rate = 0.0
+    try:
+        current_year = str(time.localtime().tm_year)
+        holdings_df = ak.fund_portfolio_hold_em(symbol=code, date=current_year)
+        if holdings_df is None or holdings_df.empty:
+            prev_year = str(time.localtime().tm_year - 1)
+            holdings_df = ak.fund_portfolio_hold_em(symbol=code, date=prev_year)
+
+        if not holdings_df.empty:
+            holdings_df = holdings_df.copy()
+            if "占净值比例" in holdings_df.columns:
+                holdings_df["占净值比例"] = (
+                    holdings_df["占净值比例"].astype(str).str.replace("%", "", regex=False)
+                )
+                holdings_df["占净值比例"] = pd.to_numeric(holdings_df["占净值比例"], errors="coerce").fillna(0.0)
+
+            sorted_holdings = holdings_df.sort_values(by="占净值比例", ascending=False)
+            top10 = sorted_holdings.head(10)
+            concentration_rate = top10["占净值比例"].sum()
+
+            # 已按占比降序：同一股票只取首条（多个报告期重复出现），
+            # 凑满 20 条或占比跌破 0.01 即可停止，不必逐行构造 Series
+            seen_codes = set()
+            codes = sorted_holdings["股票代码"].astype(str).tolist()
+            percents = sorted_holdings["占净值比例"].astype(float).tolist()
+            names = sorted_holdings["股票名称"].tolist() if "股票名称" in sorted_holdings.columns else [None] * len(codes)
+            for stock_code, name_, percent in zip(codes, names, percents):
+                if percent < 0.01:
+                    break
+                if stock_code in seen_codes: continue
+                seen_codes.add(stock_code)
+                holdings.append({"code": stock_code, "name": name_, "percent": percent})
+                if len(holdings) == 20:
+                    break
+
+            # 行情只查实际展示的股票
+            spot_map = _fetch_stock_spots_sina([h["code"] for h in holdings if h["code"]])
+            for h in holdings:
+                h["change"] = spot_map.get(h.pop("code"), 0.0)
+    except: pass
+    return holdings, concentration_rate
+
+
+
 def get_fund_intraday(code: str) -> Dict[str, Any]:
-    em_data = get_combined_valuation(code)
+    # 估值、档案、库内信息、持仓四路互不依赖，并发拉取，总耗时取最慢的一路
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        f_em = executor.submit(get_combined_valuation, code)
+        f_pz = executor.submit(get_eastmoney_pingzhong_data, code)
+        f_db = executor.submit(_get_fund_info_from_db, code)
+        f_holdings = executor.submit(_fetch_holdings, code)
+        em_data, pz_data, db_info = f_em.result(), f_pz.result(), f_db.result()
+        holdings, concentration_rate = f_holdings.result()
 
     name = em_data.get("name")
     nav = float(em_data.get("nav", 0.0))
@@ -351,14 +710,12 @@ def get_fund_intraday(code: str) -> Dict[str, Any]:
     est_rate = float(em_data.get("estRate", 0.0))
     update_time = em_data.get("time", time.strftime("%H:%M:%S"))
 
-    pz_data = get_eastmoney_pingzhong_data(code)
     extra_info = {}
     if pz_data.get("name"): extra_info["full_name"] = pz_data["name"]
     if pz_data.get("manager"): extra_info["manager"] = pz_data["manager"]
     for k in ["syl_1n", "syl_6y", "syl_3y", "syl_1y"]:
         if pz_data.get(k): extra_info[k] = pz_data[k]
 
-    db_info = _get_fund_info_from_db(code)
     if db_info:
         if not extra_info.get("full_name"): extra_info["full_name"] = db_info["name"]
         extra_info["official_type"] = db_info["type"]
@@ -374,45 +731,8 @@ def get_fund_intraday(code: str) -> Dict[str, Any]:
         history_data = get_fund_history(code, limit=250)
         tech_indicators = _calculate_technical_indicators(history_data)
 
-    holdings = []
-    concentration_rate = 0.0
-    try:
-        current_year = str(time.localtime().tm_year)
-        holdings_df = ak.fund_portfolio_hold_em(symbol=code, date=current_year)
-        if holdings_df is None or holdings_df.empty:
-            prev_year = str(time.localtime().tm_year - 1)
-            holdings_df = ak.fund_portfolio_hold_em(symbol=code, date=prev_year)
-
-        if not holdings_df.empty:
-            holdings_df = holdings_df.copy()
-            if "占净值比例" in holdings_df.columns:
-                holdings_df["占净值比例"] = (
-                    holdings_df["占净值比例"].astype(str).str.replace("%", "", regex=False)
-                )
-                holdings_df["占净值比例"] = pd.to_numeric(holdings_df["占净值比例"], errors="coerce").fillna(0.0)
-
-            sorted_holdings = holdings_df.sort_values(by="占净值比例", ascending=False)
-            top10 = sorted_holdings.head(10)
-            concentration_rate = top10["占净值比例"].sum()
-
-            stock_codes = [str(c) for c in holdings_df["股票代码"].tolist() if c]
-            spot_map = _fetch_stock_spots_sina(stock_codes)
-
-            seen_codes = set()
-            for _, row in sorted_holdings.iterrows():
-                stock_code = str(row.get("股票代码"))
-                percent = float(row.get("占净值比例", 0.0))
-                if stock_code in seen_codes or percent < 0.01: continue
-                seen_codes.add(stock_code)
-                holdings.append({
-                    "name": row.get("股票名称"),
-                    "percent": percent,
-                    "change": spot_map.get(stock_code, 0.0),
-                })
-            holdings = holdings[:20]
-    except: pass
-
-    sector = get_fund_type(code, name)
+    # funds 表已随 db_info 取回，类型缺失时才按名称推断
+    sector = (db_info and db_info.get("type")) or classify_fund_type(name)
 
     return {
         "id": str(code), "name": name, "type": sector, "manager": manager,
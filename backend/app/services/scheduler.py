@@ -1,12 +1,14 @@
 import logging
 import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 import akshare as ak
 import pandas as pd
-from ..db import get_db_connection, release_db_connection, dict_cursor
+from ..db import get_db, get_db_connection, release_db_connection, dict_cursor, tuple_cursor
 from ..config import Config
-from ..services.fund import get_combined_valuation
+from ..services.fund import get_combined_valuation, clear_fund_categories_cache
 from ..services.subscription import get_subscriptions_grouped_by_user, update_notification_time, update_digest_time
 from ..services.email import send_email
 from ..services.trade import process_pending_transactions
@@ -16,6 +18,50 @@ logger = logging.getLogger(__name__)
 
 CST = timezone(timedelta(hours=8))
 
+FUND_LIST_BATCH_SIZE = 1000
+# 估值接口并发上限：既压缩总耗时，也避免对数据源请求过密
+VALUATION_FETCH_WORKERS = 8
+# 各用户的订阅互不依赖，发信等待 SMTP 往返时并行处理其他用户
+SUBSCRIPTION_WORKERS = 8
+
+
+# 滑动窗口限速：任意 1 秒内最多估值这么多只基金，未超限时不等待。
+# 与原先逐只 sleep(0.2) 的速率持平；每只基金可能触发多次上游请求，不宜调高
+VALUATION_RATE_LIMIT = 5
+_rate_window = deque()
+_rate_lock = threading.Lock()
+
+
+def _throttle():
+    while True:
+        with _rate_lock:
+            now = time.monotonic()
+            while _rate_window and now - _rate_window[0] >= 1.0:
+                _rate_window.popleft()
+            if len(_rate_window) < VALUATION_RATE_LIMIT:
+                _rate_window.append(now)
+                return
+            wait = 1.0 - (now - _rate_window[0])
+        time.sleep(wait)
+
+
+def _safe_valuation(code):
+    _throttle()
+    try:
+        return get_combined_valuation(code)
+    except Exception as e:
+        logger.error(f"Valuation fetch failed for {code}: {e}")
+        return None
+
+
+def _fetch_valuations(codes) -> dict:
+    """并发拉取一组基金的实时估值，失败的代码对应 None。"""
+    codes = list(codes)
+    if not codes:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(VALUATION_FETCH_WORKERS, len(codes))) as executor:
+        return dict(zip(codes, executor.map(_safe_valuation, codes)))
+
 def fetch_and_update_funds():
     logger.info("Starting fund list update...")
     try:
@@ -25,21 +71,24 @@ def fetch_and_update_funds():
             return
 
         df = df.rename(columns={"基金代码": "code", "基金简称": "name", "基金类型": "type"})
-        data_to_insert = df[["code", "name", "type"]].to_dict(orient="records")
+        data_to_insert = list(zip(df["code"], df["name"], df["type"]))
 
         conn = get_db_connection()
         cur = dict_cursor(conn)
 
-        for row in data_to_insert:
-            cur.execute("""
-                INSERT INTO funds (code, name, type, updated_at)
-                VALUES (%(code)s, %(name)s, %(type)s, CURRENT_TIMESTAMP)
+        # VALUES 中只含占位符，PyMySQL 才会把 executemany 改写成多行 INSERT；
+        # 新行的 updated_at 由列默认值填充。分批以控制单条语句大小
+        for i in range(0, len(data_to_insert), FUND_LIST_BATCH_SIZE):
+            cur.executemany("""
+                INSERT INTO funds (code, name, type)
+                VALUES (%s, %s, %s)
                 ON DUPLICATE KEY UPDATE
                     name = VALUES(name), type = VALUES(type), updated_at = CURRENT_TIMESTAMP
-            """, row)
+            """, data_to_insert[i:i + FUND_LIST_BATCH_SIZE])
 
         conn.commit()
         release_db_connection(conn)
+        clear_fund_categories_cache()
         logger.info(f"Fund list updated. Total funds: {len(data_to_insert)}")
     except Exception as e:
         logger.error(f"Failed to update fund list: {e}")
@@ -52,8 +101,8 @@ def collect_intraday_snapshots():
     if not is_trading_day(today):
         return
 
-    current_time = now_cst.strftime("%H:%M")
-    if current_time < "09:35" or current_time > "15:05":
+    time_str = now_cst.strftime("%H:%M")
+    if time_str < "09:35" or time_str > "15:05":
         return
 
     conn = get_db_connection()
@@ -65,45 +114,54 @@ def collect_intraday_snapshots():
         WHERE p.shares > 0
     """)
     codes = [row["code"] for row in cur.fetchall()]
+    # 逐只估值要走网络并限速，期间不占用池中连接
+    release_db_connection(conn)
 
     if not codes:
-        release_db_connection(conn)
         return
 
     date_str = today.strftime("%Y-%m-%d")
-    time_str = now_cst.strftime("%H:%M")
 
-    collected = 0
-    for code in codes:
+    snapshots = []
+    for code, data in _fetch_valuations(codes).items():
         try:
-            data = get_combined_valuation(code)
             if data and data.get("estimate"):
-                cur.execute("""
-                    INSERT INTO fund_intraday_snapshots (fund_code, date, time, estimate)
-                    VALUES (%s, %s, %s, %s)
-                    ON DUPLICATE KEY UPDATE fund_code = fund_code
-                """, (code, date_str, time_str, float(data["estimate"])))
-                collected += 1
-            time.sleep(0.2)
+                snapshots.append((code, date_str, time_str, float(data["estimate"])))
         except Exception as e:
             logger.error(f"Intraday collect failed for {code}: {e}")
 
-    conn.commit()
-    release_db_connection(conn)
+    collected = len(snapshots)
+    if snapshots:
+        conn = get_db_connection()
+        try:
+            dict_cursor(conn).executemany("""
+                INSERT INTO fund_intraday_snapshots (fund_code, date, time, estimate)
+                VALUES (%s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE fund_code = fund_code
+            """, snapshots)
+            conn.commit()
+        finally:
+            release_db_connection(conn)
 
     if collected > 0:
         logger.info(f"Collected {collected} intraday snapshots at {time_str}")
 
-def cleanup_old_intraday_data():
+def cleanup_old_intraday_data(conn=None):
+    """删除 30 天前的分时快照。传入 conn 时复用调用方租用的连接。"""
     now_cst = datetime.now(CST)
     cutoff = (now_cst - timedelta(days=30)).strftime("%Y-%m-%d")
 
-    conn = get_db_connection()
-    cur = dict_cursor(conn)
-    cur.execute("DELETE FROM fund_intraday_snapshots WHERE date < %s", (cutoff,))
-    deleted = cur.rowcount
-    conn.commit()
-    release_db_connection(conn)
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    try:
+        cur = dict_cursor(conn)
+        cur.execute("DELETE FROM fund_intraday_snapshots WHERE date < %s", (cutoff,))
+        deleted = cur.rowcount
+        conn.commit()
+    finally:
+        if own_conn:
+            release_db_connection(conn)
 
     if deleted > 0:
         logger.info(f"Cleaned up {deleted} old intraday records (before {cutoff})")
@@ -154,8 +212,33 @@ def update_holdings_nav():
         logger.info(f"NAV update: {updated} updated, {pending} pending (total {len(codes)})")
 
 
-def _process_user_subscriptions(user_id, subs, valuations, today_str, current_time_str, now_cst):
-    """处理单个用户的所有订阅通知。"""
+def _process_user_subscriptions(user_id, subs, valuations, today_str, current_time_str, now_cst,
+                                notified_ids=None, digest_ids=None):
+    """处理单个用户的所有订阅通知。
+
+    发送成功的订阅 id 追加到 notified_ids / digest_ids，由调用方统一回写；
+    未传入时在本函数结束前自行回写。"""
+    own_batch = notified_ids is None
+    if own_batch:
+        notified_ids, digest_ids = [], []
+    try:
+        _notify_user_subscriptions(user_id, subs, valuations, today_str, current_time_str, now_cst,
+                                   notified_ids, digest_ids)
+    finally:
+        if own_batch:
+            _flush_subscription_times(notified_ids, digest_ids)
+
+
+def _flush_subscription_times(notified_ids, digest_ids):
+    if notified_ids:
+        update_notification_time(notified_ids)
+    if digest_ids:
+        update_digest_time(digest_ids)
+
+
+def _notify_user_subscriptions(user_id, subs, valuations, today_str, current_time_str, now_cst,
+                               notified_ids, digest_ids):
+    now_str = now_cst.strftime('%Y-%m-%d %H:%M:%S') if now_cst else ''
     for sub in subs:
         code = sub["code"]
         sub_id = sub["id"]
@@ -192,7 +275,7 @@ def _process_user_subscriptions(user_id, subs, valuations, today_str, current_ti
                     <p>估值时间: {data.get('time')}</p>
                     <hr/><p>此邮件由 FundVal Live 自动发送。</p>"""
                     if send_email(email, subject, content, is_html=True, user_id=user_id):
-                        update_notification_time(sub_id)
+                        notified_ids.append(sub_id)
 
         if sub.get("enable_digest"):
             last_digest = str(sub["last_digest_at"]) if sub.get("last_digest_at") else None
@@ -203,10 +286,10 @@ def _process_user_subscriptions(user_id, subs, valuations, today_str, current_ti
                     <p>基金: {fund_name} ({code})</p>
                     <p>今日收盘/最新估值: {data.get('estimate', 'N/A')}</p>
                     <p>今日涨跌幅: <b>{est_rate}%</b></p>
-                    <p>总结时间: {now_cst.strftime('%Y-%m-%d %H:%M:%S') if now_cst else ''}</p>
+                    <p>总结时间: {now_str}</p>
                     <hr/><p>祝您投资愉快！</p>"""
                     if send_email(email, subject, content, is_html=True, user_id=user_id):
-                        update_digest_time(sub_id)
+                        digest_ids.append(sub_id)
 
 def check_subscriptions():
     logger.info("Checking subscriptions...")
@@ -218,16 +301,30 @@ def check_subscriptions():
     today_str = now_cst.strftime("%Y-%m-%d")
     current_time_str = now_cst.strftime("%H:%M")
 
-    valuations = {}
+    # 先按去重后的基金代码并发取估值，再逐用户判断触发条件
+    valuations = _fetch_valuations({sub.get("code") for subs in grouped.values() for sub in subs} - {None})
 
-    for user_id, subs in grouped.items():
-        try:
-            _process_user_subscriptions(
-                user_id=user_id, subs=subs, valuations=valuations,
-                today_str=today_str, current_time_str=current_time_str, now_cst=now_cst
-            )
-        except Exception as e:
-            logger.error(f"Error processing subscriptions for user {user_id}: {e}")
+    # 已发送的订阅在本轮结束后合并成两条 UPDATE 回写
+    notified_ids, digest_ids = [], []
+    try:
+        # list.append 线程安全，各用户直接追加到同一批待回写 id
+        with ThreadPoolExecutor(max_workers=min(SUBSCRIPTION_WORKERS, len(grouped))) as executor:
+            futures = {
+                executor.submit(
+                    _process_user_subscriptions,
+                    user_id=user_id, subs=subs, valuations=valuations,
+                    today_str=today_str, current_time_str=current_time_str, now_cst=now_cst,
+                    notified_ids=notified_ids, digest_ids=digest_ids
+                ): user_id
+                for user_id, subs in grouped.items()
+            }
+            for future, user_id in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"Error processing subscriptions for user {user_id}: {e}")
+    finally:
+        _flush_subscription_times(notified_ids, digest_ids)
 
 def start_scheduler():
     def _run():
@@ -243,18 +340,23 @@ def start_scheduler():
 
         last_cleanup_date = None
         last_nav_update_hour = None
+        interval_minutes = 5
 
         while True:
             try:
                 now_cst = datetime.now(CST)
                 today_str = now_cst.strftime("%Y-%m-%d")
 
-                conn = get_db_connection()
-                cur = dict_cursor(conn)
-                cur.execute("SELECT value FROM settings WHERE `key` = 'INTRADAY_COLLECT_INTERVAL'")
-                row = cur.fetchone()
-                interval_minutes = int(row["value"]) if row and row["value"] else 5
-                release_db_connection(conn)
+                # 纯数据库步骤共用一次租用；后面几步要走网络，各自按需短租，不在等待期间占着连接
+                with get_db() as conn:
+                    cur = tuple_cursor(conn)
+                    cur.execute("SELECT value FROM settings WHERE `key` = 'INTRADAY_COLLECT_INTERVAL'")
+                    row = cur.fetchone()
+                    interval_minutes = int(row[0]) if row and row[0] else 5
+
+                    if last_cleanup_date != today_str and now_cst.hour == 0:
+                        cleanup_old_intraday_data(conn)
+                        last_cleanup_date = today_str
 
                 check_subscriptions()
                 collect_intraday_snapshots()
@@ -263,10 +365,6 @@ def start_scheduler():
                 if n:
                     logger.info(f"Applied {n} pending add/reduce transactions.")
 
-                if last_cleanup_date != today_str and now_cst.hour == 0:
-                    cleanup_old_intraday_data()
-                    last_cleanup_date = today_str
-
                 if 16 <= now_cst.hour <= 23 and last_nav_update_hour != now_cst.hour:
                     update_holdings_nav()
                     last_nav_update_hour = now_cst.hour
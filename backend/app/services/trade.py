@@ -4,23 +4,34 @@ import logging
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 
-from ..db import get_db_connection, release_db_connection, dict_cursor
-from .fund import get_nav_on_date
-from .account import upsert_position, remove_position
+from ..db import get_db_connection, release_db_connection, dict_cursor, tuple_cursor
+from .fund import get_nav_on_date, get_nav_on_dates
+from .account import upsert_position, remove_position, bulk_upsert_positions, bulk_remove_positions
 from .trading_calendar import get_confirm_date, confirm_date_to_str
 
 logger = logging.getLogger(__name__)
 
 
-def _get_position(account_id: int, code: str) -> Optional[Dict[str, Any]]:
-    conn = get_db_connection()
-    cur = dict_cursor(conn)
-    cur.execute("SELECT code, cost, shares FROM positions WHERE account_id = %s AND code = %s", (account_id, code))
-    row = cur.fetchone()
-    release_db_connection(conn)
-    if not row:
-        return None
-    return {"code": row["code"], "cost": float(row["cost"]), "shares": float(row["shares"])}
+def _load_positions(cur, keys, for_update: bool = False) -> Dict[tuple, Dict[str, Any]]:
+    """一次查询取回一批 (account_id, code) 的持仓，键不存在表示无持仓。
+    for_update 时锁住这些行，直到调用方的事务结束。"""
+    if not keys:
+        return {}
+    keys = list(keys)
+    placeholders = ", ".join(["(%s, %s)"] * len(keys))
+    lock = " FOR UPDATE" if for_update else ""
+    cur.execute(
+        f"SELECT account_id, code, cost, shares FROM positions WHERE (account_id, code) IN ({placeholders}){lock}",
+        [v for key in keys for v in key],
+    )
+    return {
+        (r["account_id"], r["code"]): {"code": r["code"], "cost": float(r["cost"]), "shares": float(r["shares"])}
+        for r in cur.fetchall()
+    }
+
+
+def _get_position(cur, account_id: int, code: str, for_update: bool = False) -> Optional[Dict[str, Any]]:
+    return _load_positions(cur, [(account_id, code)], for_update).get((account_id, code))
 
 
 def add_position_trade(account_id: int, code: str, amount_cny: float, trade_ts: Optional[datetime] = None) -> Dict[str, Any]:
@@ -30,180 +41,233 @@ def add_position_trade(account_id: int, code: str, amount_cny: float, trade_ts:
     confirm_date_str = confirm_date_to_str(confirm_d)
     nav = get_nav_on_date(code, confirm_date_str)
 
+    # 净值可能走网络，取到后再租连接；读持仓、写持仓与写流水同一连接、同一事务。
+    # 显式 begin() 不可省：DBUtils 只在事务标记下禁止断线后换连接重试，
+    # 否则中途断线会让后续语句落到新连接上单独提交
     conn = get_db_connection()
-    cur = dict_cursor(conn)
+    try:
+        cur = dict_cursor(conn)
+        if nav and nav > 0:
+            conn.begin()
+            shares_added = round(amount_cny / nav, 4)
+            pos = _get_position(cur, account_id, code, for_update=True)
+            if pos:
+                old_cost, old_shares = pos["cost"], pos["shares"]
+                new_shares = old_shares + shares_added
+                new_cost = round((old_cost * old_shares + nav * shares_added) / new_shares, 4)
+            else:
+                new_shares = shares_added
+                new_cost = nav
+            upsert_position(account_id, code, new_cost, new_shares, cur=cur)
+            cur.execute(
+                """INSERT INTO transactions (account_id, code, op_type, amount_cny, confirm_date, confirm_nav, shares_added, cost_after, applied_at)
+                VALUES (%s, %s, 'add', %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)""",
+                (account_id, code, amount_cny, confirm_date_str, nav, shares_added, new_cost),
+            )
+            conn.commit()
+            return {"ok": True, "confirm_date": confirm_date_str, "confirm_nav": nav,
+                    "shares_added": shares_added, "cost_after": new_cost, "shares_after": new_shares}
 
-    if nav and nav > 0:
-        shares_added = round(amount_cny / nav, 4)
-        pos = _get_position(account_id, code)
-        if pos:
-            old_cost, old_shares = pos["cost"], pos["shares"]
-            new_shares = old_shares + shares_added
-            new_cost = round((old_cost * old_shares + nav * shares_added) / new_shares, 4)
-        else:
-            new_shares = shares_added
-            new_cost = nav
-        upsert_position(account_id, code, new_cost, new_shares)
-        cur.execute(
-            """INSERT INTO transactions (account_id, code, op_type, amount_cny, confirm_date, confirm_nav, shares_added, cost_after, applied_at)
-            VALUES (%s, %s, 'add', %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)""",
-            (account_id, code, amount_cny, confirm_date_str, nav, shares_added, new_cost),
-        )
-        conn.commit()
-        release_db_connection(conn)
-        return {"ok": True, "confirm_date": confirm_date_str, "confirm_nav": nav,
-                "shares_added": shares_added, "cost_after": new_cost, "shares_after": new_shares}
-    else:
         cur.execute(
             """INSERT INTO transactions (account_id, code, op_type, amount_cny, confirm_date)
             VALUES (%s, %s, 'add', %s, %s)""",
             (account_id, code, amount_cny, confirm_date_str),
         )
         conn.commit()
-        release_db_connection(conn)
         return {"ok": True, "pending": True,
                 "message": f"已记录加仓，确认日为 {confirm_date_str}，待净值公布后自动更新持仓",
                 "confirm_date": confirm_date_str}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_db_connection(conn)
+
+
+def _check_reducible(pos: Optional[Dict[str, Any]], shares_redeemed: float) -> Optional[str]:
+    if not pos or pos["shares"] <= 0:
+        return "该基金无持仓或份额为 0"
+    if shares_redeemed > pos["shares"]:
+        return f"减仓份额不能大于当前持仓 {pos['shares']}"
+    return None
 
 
 def reduce_position_trade(account_id: int, code: str, shares_redeemed: float, trade_ts: Optional[datetime] = None) -> Dict[str, Any]:
     if shares_redeemed <= 0:
         return {"ok": False, "message": "减仓份额必须大于 0"}
-    pos = _get_position(account_id, code)
-    if not pos or pos["shares"] <= 0:
-        return {"ok": False, "message": "该基金无持仓或份额为 0"}
-    if shares_redeemed > pos["shares"]:
-        return {"ok": False, "message": f"减仓份额不能大于当前持仓 {pos['shares']}"}
+    conn = get_db_connection()
+    try:
+        error = _check_reducible(_get_position(dict_cursor(conn), account_id, code), shares_redeemed)
+    finally:
+        release_db_connection(conn)
+    if error:
+        return {"ok": False, "message": error}
 
     confirm_d = get_confirm_date(trade_ts)
     confirm_date_str = confirm_date_to_str(confirm_d)
     nav = get_nav_on_date(code, confirm_date_str)
 
     conn = get_db_connection()
-    cur = dict_cursor(conn)
+    try:
+        cur = dict_cursor(conn)
+        if nav and nav > 0:
+            # 取净值期间持仓可能已变，锁行后重新校验
+            conn.begin()
+            pos = _get_position(cur, account_id, code, for_update=True)
+            error = _check_reducible(pos, shares_redeemed)
+            if error:
+                conn.rollback()
+                return {"ok": False, "message": error}
+            amount_cny = round(shares_redeemed * nav, 2)
+            new_shares = round(pos["shares"] - shares_redeemed, 4)
+            new_cost = pos["cost"]
+            if new_shares <= 0:
+                remove_position(account_id, code, cur=cur)
+                cost_after = 0.0
+            else:
+                upsert_position(account_id, code, new_cost, new_shares, cur=cur)
+                cost_after = new_cost
+            cur.execute(
+                """INSERT INTO transactions (account_id, code, op_type, amount_cny, shares_redeemed, confirm_date, confirm_nav, cost_after, applied_at)
+                VALUES (%s, %s, 'reduce', %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)""",
+                (account_id, code, amount_cny, shares_redeemed, confirm_date_str, nav, cost_after),
+            )
+            conn.commit()
+            return {"ok": True, "confirm_date": confirm_date_str, "confirm_nav": nav,
+                    "amount_cny": amount_cny, "shares_after": new_shares}
 
-    if nav and nav > 0:
-        amount_cny = round(shares_redeemed * nav, 2)
-        new_shares = round(pos["shares"] - shares_redeemed, 4)
-        new_cost = pos["cost"]
-        if new_shares <= 0:
-            remove_position(account_id, code)
-            cost_after = 0.0
-        else:
-            upsert_position(account_id, code, new_cost, new_shares)
-            cost_after = new_cost
-        cur.execute(
-            """INSERT INTO transactions (account_id, code, op_type, amount_cny, shares_redeemed, confirm_date, confirm_nav, cost_after, applied_at)
-            VALUES (%s, %s, 'reduce', %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)""",
-            (account_id, code, amount_cny, shares_redeemed, confirm_date_str, nav, cost_after),
-        )
-        conn.commit()
-        release_db_connection(conn)
-        return {"ok": True, "confirm_date": confirm_date_str, "confirm_nav": nav,
-                "amount_cny": amount_cny, "shares_after": new_shares}
-    else:
         cur.execute(
             """INSERT INTO transactions (account_id, code, op_type, shares_redeemed, confirm_date)
             VALUES (%s, %s, 'reduce', %s, %s)""",
             (account_id, code, shares_redeemed, confirm_date_str),
         )
         conn.commit()
-        release_db_connection(conn)
         return {"ok": True, "pending": True,
                 "message": f"已记录减仓，确认日为 {confirm_date_str}，待净值公布后自动更新持仓",
                 "confirm_date": confirm_date_str}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_db_connection(conn)
+
 
+# 流水列表一次最多返回的行数。结果整体序列化为一个 JSON，服务端游标省不下内存，
+# 反而会在序列化期间一直占着连接，因此用上限约束内存，而不是流式读取
+MAX_TRANSACTIONS_LIMIT = 500
 
-def list_transactions(account_id: int = None, code: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+
+def list_transactions(account_id: int = None, code: Optional[str] = None, limit: int = 100,
+                      user_id: Optional[int] = None) -> List[Dict[str, Any]]:
     conn = get_db_connection()
     cur = dict_cursor(conn)
 
+    join = ""
     conditions = []
     params = []
+    if user_id is not None:
+        join = "JOIN accounts a ON t.account_id = a.id"
+        conditions.append("a.user_id = %s")
+        params.append(user_id)
     if account_id:
-        conditions.append("account_id = %s")
+        conditions.append("t.account_id = %s")
         params.append(account_id)
     if code:
-        conditions.append("code = %s")
+        conditions.append("t.code = %s")
         params.append(code)
 
     where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
-    params.append(limit)
+    params.append(min(limit, MAX_TRANSACTIONS_LIMIT))
 
     cur.execute(f"""
-        SELECT id, code, op_type, amount_cny, shares_redeemed, confirm_date, confirm_nav,
-               shares_added, cost_after, created_at, applied_at
-        FROM transactions {where} ORDER BY id DESC LIMIT %s
+        SELECT t.id, t.code, t.op_type, t.amount_cny, t.shares_redeemed, t.confirm_date, t.confirm_nav,
+               t.shares_added, t.cost_after, t.created_at, t.applied_at
+        FROM transactions t {join} {where} ORDER BY t.id DESC LIMIT %s
     """, params)
     rows = cur.fetchall()
     release_db_connection(conn)
-
-    out = []
-    for r in rows:
-        out.append({
-            "id": r["id"], "code": r["code"], "op_type": r["op_type"],
-            "amount_cny": r["amount_cny"], "shares_redeemed": r["shares_redeemed"],
-            "confirm_date": r["confirm_date"], "confirm_nav": r["confirm_nav"],
-            "shares_added": r["shares_added"], "cost_after": r["cost_after"],
-            "created_at": str(r["created_at"]) if r["created_at"] else None,
-            "applied_at": str(r["applied_at"]) if r["applied_at"] else None,
-        })
-    return out
+    # 查询列即响应字段；created_at/applied_at 保持 datetime，由路由层 orjson 原生序列化
+    return rows
 
 
 def process_pending_transactions() -> int:
-    """处理待确认流水：对 confirm_nav 为空的记录拉取确认日净值并更新持仓。"""
+    """处理待确认流水：对 confirm_nav 为空的记录拉取确认日净值并更新持仓。
+
+    先批量取齐确认日净值（缺失时可能走网络，不占写连接），再用一个连接、一个事务
+    完成持仓读取（FOR UPDATE）、持仓写入和流水回写，只提交一次。"""
     conn = get_db_connection()
-    cur = dict_cursor(conn)
+    cur = tuple_cursor(conn)
     cur.execute(
         "SELECT id, account_id, code, op_type, amount_cny, shares_redeemed, confirm_date FROM transactions WHERE applied_at IS NULL AND confirm_nav IS NULL"
     )
     pending = cur.fetchall()
     release_db_connection(conn)
 
-    applied = 0
+    # 行为元组，列序同上面的 SELECT：code 在 [2]，confirm_date 在 [6]
+    navs = get_nav_on_dates({(r[2], r[6]) for r in pending if r[6]})
+    confirmable = []
     for row in pending:
-        tid, account_id, code, op_type = row["id"], row["account_id"], row["code"], row["op_type"]
-        amount_cny, shares_redeemed, confirm_date = row["amount_cny"], row["shares_redeemed"], row["confirm_date"]
-        nav = get_nav_on_date(code, confirm_date) if confirm_date else None
-        if not nav or nav <= 0:
-            continue
-        conn = get_db_connection()
+        nav = navs.get((row[2], row[6]))
+        if nav and nav > 0:
+            confirmable.append((row, nav))
+    if not confirmable:
+        return 0
+
+    conn = get_db_connection()
+    try:
         cur = dict_cursor(conn)
-        if op_type == "add" and amount_cny:
-            shares_added = round(amount_cny / nav, 4)
-            pos = _get_position(account_id, code)
-            if pos:
-                new_shares = pos["shares"] + shares_added
-                new_cost = round((pos["cost"] * pos["shares"] + nav * shares_added) / new_shares, 4)
-            else:
-                new_shares = shares_added
-                new_cost = nav
-            upsert_position(account_id, code, new_cost, new_shares)
-            cur.execute(
+        conn.begin()
+        positions = _load_positions(cur, {(row[1], row[2]) for row, _ in confirmable}, for_update=True)
+
+        add_updates = []
+        reduce_updates = []
+        changed = set()
+        for (tid, account_id, code, op_type, amount_cny, shares_redeemed, _), nav in confirmable:
+            if op_type == "add" and amount_cny:
+                # 与 add/reduce_position_trade 同样逐笔用 Python round()，两条路径结果一致
+                shares_added = round(amount_cny / nav, 4)
+                pos = positions.get((account_id, code))
+                if pos:
+                    new_shares = pos["shares"] + shares_added
+                    new_cost = round((pos["cost"] * pos["shares"] + nav * shares_added) / new_shares, 4)
+                else:
+                    new_shares = shares_added
+                    new_cost = nav
+                positions[(account_id, code)] = {"code": code, "cost": new_cost, "shares": new_shares}
+                changed.add((account_id, code))
+                add_updates.append((nav, shares_added, new_cost, tid))
+            elif op_type == "reduce" and shares_redeemed:
+                pos = positions.get((account_id, code))
+                if not pos:
+                    continue
+                new_shares = round(pos["shares"] - shares_redeemed, 4)
+                cost_after = pos["cost"] if new_shares > 0 else 0.0
+                if new_shares <= 0:
+                    positions[(account_id, code)] = None
+                else:
+                    positions[(account_id, code)] = {"code": code, "cost": pos["cost"], "shares": new_shares}
+                changed.add((account_id, code))
+                reduce_updates.append((nav, round(shares_redeemed * nav, 2), cost_after, tid))
+
+        # 同一持仓的多笔流水已在内存中依次结算，这里只写最终状态：一条多行 UPSERT + 一条 DELETE
+        bulk_upsert_positions(cur, [(aid, code, positions[(aid, code)]["cost"], positions[(aid, code)]["shares"])
+                                    for aid, code in changed if positions[(aid, code)]])
+        bulk_remove_positions(cur, [key for key in changed if positions[key] is None])
+
+        if add_updates:
+            cur.executemany(
                 "UPDATE transactions SET confirm_nav = %s, shares_added = %s, cost_after = %s, applied_at = CURRENT_TIMESTAMP WHERE id = %s",
-                (nav, shares_added, new_cost, tid),
+                add_updates,
             )
-        elif op_type == "reduce" and shares_redeemed:
-            pos = _get_position(account_id, code)
-            if not pos:
-                release_db_connection(conn)
-                continue
-            amount_cny = round(shares_redeemed * nav, 2)
-            new_shares = round(pos["shares"] - shares_redeemed, 4)
-            cost_after = pos["cost"] if new_shares > 0 else 0.0
-            if new_shares <= 0:
-                remove_position(account_id, code)
-            else:
-                upsert_position(account_id, code, pos["cost"], new_shares)
-            cur.execute(
+        if reduce_updates:
+            cur.executemany(
                 "UPDATE transactions SET confirm_nav = %s, amount_cny = %s, cost_after = %s, applied_at = CURRENT_TIMESTAMP WHERE id = %s",
-                (nav, amount_cny, cost_after, tid),
+                reduce_updates,
             )
-        else:
-            release_db_connection(conn)
-            continue
         conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
         release_db_connection(conn)
-        applied += 1
-    return applied
+    return len(add_updates) + len(reduce_updates)
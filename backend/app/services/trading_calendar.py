@@ -4,6 +4,7 @@ A股交易日历：15:00 前按当日净值，15:00 后按下一交易日净值
 仅考虑周末，节假日可后续扩展。
 """
 from datetime import datetime, date, timedelta
+from functools import lru_cache
 from typing import Optional
 
 # 15:00 为分界（同一日 15:00 整算当日）
@@ -35,13 +36,16 @@ def get_confirm_date(trade_ts: Optional[datetime] = None) -> date:
         trade_ts = datetime.now()
     if trade_ts.tzinfo:
         trade_ts = trade_ts.replace(tzinfo=None)  # 转为 naive 比较
-    d = trade_ts.date()
-    if not is_trading_day(d):
-        return next_trading_day(d)
-    if (trade_ts.hour, trade_ts.minute) >= (CUTOFF_HOUR, CUTOFF_MINUTE):
+    return _confirm_date_for(trade_ts.date(), (trade_ts.hour, trade_ts.minute) >= (CUTOFF_HOUR, CUTOFF_MINUTE))
+
+
+@lru_cache(maxsize=1024)
+def _confirm_date_for(d: date, after_cutoff: bool) -> date:
+    # 结果只取决于日期与是否过分界点；按时间戳缓存几乎不会命中，按日缓存则批量导入同日流水时只算一次
+    if not is_trading_day(d) or after_cutoff:
         return next_trading_day(d)
     return d
 
 
 def confirm_date_to_str(d: date) -> str:
-    return d.strftime("%Y-%m-%d")
+    return d.isoformat()
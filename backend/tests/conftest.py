@@ -1,12 +1,47 @@
 """Conftest: mock heavy/unavailable dependencies before app import."""
+import os
 import sys
-from unittest.mock import MagicMock
+from collections import namedtuple
+from unittest.mock import MagicMock, Mock, patch
 
-# Mock akshare (requires Python 3.13+ curl_cffi)
-sys.modules["akshare"] = MagicMock()
+import pymysql
+import pytest
 
-# Mock langchain_openai (optional, heavy)
-sys.modules["langchain_openai"] = MagicMock()
-sys.modules["langchain_core"] = MagicMock()
-sys.modules["langchain_core.prompts"] = MagicMock()
-sys.modules["langchain_core.output_parsers"] = MagicMock()
+# Test modules import the backend as ``app``; put it on the path once for the whole session
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# Must run at conftest import, not in a fixture: test modules import app.* during collection.
+# akshare requires Python 3.13+ curl_cffi; langchain is optional and heavy.
+_MOCKED_MODULES = (
+    "akshare",
+    "langchain_openai",
+    "langchain_core",
+    "langchain_core.prompts",
+    "langchain_core.output_parsers",
+)
+sys.modules.update({name: MagicMock() for name in _MOCKED_MODULES})
+
+
+def pytest_configure(config):
+    # Registered by pytest-xdist when installed; declared here so plain runs don't warn
+    config.addinivalue_line("markers", "xdist_group(name): keep tests with the same name on one xdist worker")
+
+
+@pytest.fixture(autouse=True, scope="session")
+def _cheap_scrypt():
+    """Cheap scrypt cost for hashes created in tests (production is fixed at 2^14)."""
+    with patch("app.auth.SCRYPT_N", 16):
+        yield
+
+
+DbMocks = namedtuple("DbMocks", "conn release cur")
+
+
+@pytest.fixture
+def db_mocks():
+    """Stub the subscription service's connection lease with one spec'd cursor."""
+    cur = Mock(spec=pymysql.cursors.DictCursor)
+    with patch("app.services.subscription.get_db_connection") as conn, \
+            patch("app.services.subscription.release_db_connection") as release, \
+            patch("app.services.subscription.dict_cursor", return_value=cur):
+        yield DbMocks(conn, release, cur)
@@ -0,0 +1,195 @@
+"""Unit tests for account ownership checks folded into the main queries — no DB required."""
+from unittest.mock import patch, MagicMock, AsyncMock
+from fastapi.testclient import TestClient
+from fastapi import FastAPI
+
+from app.routers.account import router
+from app.auth import get_current_user
+from app.db import get_conn
+
+
+app = FastAPI()
+app.include_router(router)
+
+FAKE_USER = {"id": 2, "user_id": 2, "username": "bob", "role": "user"}
+app.dependency_overrides[get_current_user] = lambda: FAKE_USER
+
+client = TestClient(app)
+
+
+def _lease(mock_cur):
+    """Route the request-scoped connection dependency to a mock cursor."""
+    conn = MagicMock()
+    conn.cursor.return_value = mock_cur
+    app.dependency_overrides[get_conn] = lambda: conn
+    return conn
+
+
+class TestUpdateAccount:
+
+    @patch("app.routers.account._verify_account_ownership")
+    def test_owned_account_single_statement(self, mock_verify):
+        mock_cur = MagicMock()
+        mock_cur.rowcount = 1
+        _lease(mock_cur)
+
+        resp = client.put("/accounts/5", json={"name": "新账户"})
+        assert resp.status_code == 200
+        mock_verify.assert_not_called()
+        assert mock_cur.execute.call_count == 1
+        sql, params = mock_cur.execute.call_args[0]
+        assert "user_id = %s" in sql
+        assert params[-2:] == (5, 2)
+
+    def test_foreign_account_forbidden(self):
+        mock_cur = MagicMock()
+        mock_cur.rowcount = 0
+        conn = _lease(mock_cur)
+
+        resp = client.put("/accounts/5", json={"name": "x"})
+        assert resp.status_code == 403
+        conn.commit.assert_not_called()
+
+
+class TestDeleteAccount:
+
+    def test_happy_path_single_delete(self):
+        mock_cur = MagicMock()
+        mock_cur.rowcount = 1
+        conn = _lease(mock_cur)
+
+        resp = client.delete("/accounts/9")
+        assert resp.status_code == 200
+        assert mock_cur.execute.call_count == 1
+        assert mock_cur.execute.call_args[0][0].strip().startswith("DELETE")
+        conn.commit.assert_called_once()
+
+    def test_foreign_account_forbidden(self):
+        mock_cur = MagicMock()
+        mock_cur.rowcount = 0
+        mock_cur.fetchone.return_value = {"owned": 0, "n": 3, "p": 0}
+        _lease(mock_cur)
+
+        resp = client.delete("/accounts/9")
+        assert resp.status_code == 403
+        assert mock_cur.execute.call_count == 2
+
+    def test_last_account_kept(self):
+        mock_cur = MagicMock()
+        mock_cur.rowcount = 0
+        mock_cur.fetchone.return_value = {"owned": 1, "n": 1, "p": 0}
+        _lease(mock_cur)
+
+        resp = client.delete("/accounts/9")
+        assert resp.status_code == 400
+        assert resp.json()["detail"] == "至少保留一个账户"
+
+    def test_account_with_positions_kept(self):
+        mock_cur = MagicMock()
+        mock_cur.rowcount = 0
+        mock_cur.fetchone.return_value = {"owned": 1, "n": 2, "p": 3}
+        _lease(mock_cur)
+
+        resp = client.delete("/accounts/9")
+        assert resp.status_code == 400
+        assert resp.json()["detail"] == "账户下有持仓，无法删除"
+
+
+class TestPositions:
+
+    @patch("app.routers.account._verify_account_ownership")
+    @patch("app.routers.account.upsert_position", return_value=False)
+    def test_update_position_foreign_account(self, mock_upsert, mock_verify):
+        resp = client.post("/account/positions?account_id=9", json={"code": "000001", "cost": 1.0, "shares": 10})
+        assert resp.status_code == 403
+        assert mock_upsert.call_args.kwargs["user_id"] == 2
+        mock_verify.assert_not_called()
+
+    @patch("app.routers.account._verify_account_ownership")
+    @patch("app.routers.account.remove_position", return_value=1)
+    def test_delete_position_skips_ownership_lookup(self, mock_remove, mock_verify):
+        resp = client.delete("/account/positions/000001?account_id=5")
+        assert resp.status_code == 200
+        mock_verify.assert_not_called()
+
+    @patch("app.routers.account._verify_account_ownership")
+    @patch("app.routers.account.remove_position", return_value=0)
+    def test_delete_position_falls_back_when_nothing_deleted(self, mock_remove, mock_verify):
+        resp = client.delete("/account/positions/000001?account_id=5")
+        assert resp.status_code == 200
+        mock_verify.assert_called_once_with(5, 2)
+
+
+class TestUpdatePositionsNav:
+
+    @patch("app.routers.account.asyncio.sleep", new=AsyncMock())
+    @patch("app.routers.account.get_fund_history")
+    @patch("app.routers.account._latest_nav_dates", return_value={})
+    @patch("app.routers.account._list_position_codes", return_value=["000001", "000002", "000003"])
+    def test_results_mapped_per_code(self, mock_codes, mock_latest, mock_history):
+        from datetime import datetime
+        today = datetime.now().strftime("%Y-%m-%d")
+
+        def history(code, limit=5):
+            if code == "000003":
+                raise RuntimeError("timeout")
+            return [{"date": today if code == "000001" else "2000-01-01"}]
+        mock_history.side_effect = history
+
+        resp = client.post("/account/positions/update-nav?account_id=5")
+        data = resp.json()
+        assert resp.status_code == 200
+        assert (data["updated"], data["pending"], data["failed_count"]) == (1, 1, 1)
+        assert data["failed"] == [{"code": "000003", "error": "timeout"}]
+        mock_codes.assert_called_once_with(5, 2)
+
+    @patch("app.routers.account.asyncio.sleep", new=AsyncMock())
+    @patch("app.routers.account.get_fund_history")
+    @patch("app.routers.account._list_position_codes", return_value=["000001", "000002"])
+    def test_fresh_codes_skip_fetch(self, mock_codes, mock_history):
+        from datetime import datetime
+        today = datetime.now().strftime("%Y-%m-%d")
+        mock_history.return_value = [{"date": "2000-01-01"}]
+
+        with patch("app.routers.account._latest_nav_dates", return_value={"000001": today, "000002": "2000-01-01"}):
+            data = client.post("/account/positions/update-nav?account_id=5").json()
+
+        assert (data["updated"], data["pending"], data["total"]) == (1, 1, 2)
+        mock_history.assert_called_once_with("000002", limit=5)
+
+
+class TestTradeTime:
+
+    @patch("app.routers.account._verify_account_ownership")
+    @patch("app.routers.account.add_position_trade", return_value={"ok": True})
+    def test_iso_z_parsed_and_made_naive(self, mock_add, mock_verify):
+        from datetime import datetime
+        resp = client.post("/account/positions/000001/add?account_id=5",
+                           json={"amount": 100, "trade_time": "2026-03-02T14:59:00Z"})
+        assert resp.status_code == 200
+        assert mock_add.call_args[0][3] == datetime(2026, 3, 2, 14, 59)
+
+    @patch("app.routers.account._verify_account_ownership")
+    @patch("app.routers.account.reduce_position_trade", return_value={"ok": True})
+    def test_missing_trade_time(self, mock_reduce, mock_verify):
+        resp = client.post("/account/positions/000001/reduce?account_id=5", json={"shares": 10})
+        assert resp.status_code == 200
+        assert mock_reduce.call_args[0][3] is None
+
+    def test_invalid_trade_time_rejected(self):
+        resp = client.post("/account/positions/000001/add?account_id=5",
+                           json={"amount": 100, "trade_time": "not-a-date"})
+        assert resp.status_code == 422
+
+
+class TestTransactions:
+
+    @patch("app.routers.account._verify_account_ownership")
+    @patch("app.routers.account.list_transactions")
+    def test_datetimes_serialized_by_orjson(self, mock_list, mock_verify):
+        from datetime import datetime
+        mock_list.return_value = [{"id": 1, "code": "000001", "created_at": datetime(2026, 3, 2, 14, 59, 1), "applied_at": None}]
+        resp = client.get("/account/transactions?account_id=5")
+        assert resp.status_code == 200
+        assert resp.json()["transactions"][0]["created_at"] == "2026-03-02T14:59:01"
+        mock_verify.assert_not_called()
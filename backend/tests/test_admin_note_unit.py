@@ -1,9 +1,4 @@
 """Unit tests for user note feature in admin router — no DB required."""
-import os
-import sys
-
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
-
 from unittest.mock import patch, MagicMock
 from fastapi.testclient import TestClient
 from fastapi import FastAPI
@@ -45,6 +40,12 @@ class TestNoteModels:
         req = UpdateUserRequest(note="")
         assert req.note == ""
 
+    def test_unknown_field_rejected(self):
+        import pytest
+        from pydantic import ValidationError
+        with pytest.raises(ValidationError):
+            UpdateUserRequest(nickname="x")
+
 
 class TestListUsersNote:
     """Verify list_users returns note field."""
@@ -155,8 +156,10 @@ class TestUpdateUserNote:
             resp = client.put("/admin/users/5", json={"note": "备注", "is_active": False})
 
         assert resp.status_code == 200
-        # Two UPDATEs: is_active + note
-        assert mock_cur.execute.call_count == 2
+        # One UPDATE covering is_active + note
+        assert mock_cur.execute.call_count == 1
+        sql = mock_cur.execute.call_args[0][0]
+        assert "is_active" in sql and "note" in sql
 
     @patch("app.routers.admin.release_db_connection")
     @patch("app.routers.admin.get_db_connection")
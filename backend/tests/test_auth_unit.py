@@ -1,13 +1,9 @@
 """Unit tests for auth module — no DB required."""
-import os
-import sys
 import time
-
-# Ensure backend is importable
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from unittest.mock import patch
 
 from app.auth import (
-    hash_password, verify_password,
+    hash_password, verify_password, password_needs_rehash,
     create_access_token, decode_token,
     _b64url_encode, _b64url_decode,
 )
@@ -36,6 +32,19 @@ class TestPasswordHashing:
         assert verify_password("", h)
         assert not verify_password("x", h)
 
+    def test_scrypt_format(self):
+        h = hash_password("pw")
+        assert h.startswith("scrypt$")
+        assert not password_needs_rehash(h)
+
+    def test_legacy_pbkdf2_hash_still_verifies(self):
+        import base64, hashlib
+        salt = b"0123456789abcdef"
+        legacy = base64.b64encode(salt + hashlib.pbkdf2_hmac("sha256", b"old-pw", salt, 100000)).decode()
+        assert verify_password("old-pw", legacy)
+        assert not verify_password("other", legacy)
+        assert password_needs_rehash(legacy)
+
 
 class TestJWT:
     def test_create_and_decode(self):
@@ -57,16 +66,22 @@ class TestJWT:
 
     def test_expired_token_rejected(self):
         """Manually craft an expired token."""
-        import json, hmac, hashlib, base64
-        from app.auth import JWT_SECRET
+        import json, hmac
+        from app.auth import _JWT_SECRET_BYTES
 
         header = _b64url_encode(json.dumps({"alg": "HS256", "typ": "JWT"}).encode())
         payload_data = {"sub": 1, "username": "x", "role": "user", "exp": int(time.time()) - 10}
         payload = _b64url_encode(json.dumps(payload_data).encode())
-        sig = hmac.new(JWT_SECRET.encode(), f"{header}.{payload}".encode(), hashlib.sha256).digest()
+        sig = hmac.digest(_JWT_SECRET_BYTES, f"{header}.{payload}".encode(), "sha256")
         token = f"{header}.{payload}.{_b64url_encode(sig)}"
         assert decode_token(token) is None
 
+    def test_primed_signer_matches_one_shot_hmac(self):
+        import hmac
+        from app.auth import _sign, _JWT_SECRET_BYTES
+        for msg in (b"", b"a.b", b"x" * 1000):
+            assert _sign(msg) == hmac.digest(_JWT_SECRET_BYTES, msg, "sha256")
+
     def test_malformed_token_rejected(self):
         assert decode_token("not.a.valid.token") is None
         assert decode_token("") is None
@@ -85,3 +100,66 @@ class TestB64Url:
     def test_no_padding(self):
         encoded = _b64url_encode(b"test")
         assert "=" not in encoded
+
+    def test_matches_stdlib_urlsafe_for_every_padding_length(self):
+        import base64
+        for n in range(8):
+            data = bytes(range(250, 250 - n, -1))
+            expected = base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+            assert _b64url_encode(data) == expected
+            assert _b64url_decode(expected) == base64.urlsafe_b64decode(expected + "=" * (-len(expected) & 3))
+
+
+class TestTokenCache:
+    def test_repeat_decode_hits_cache(self):
+        from app import auth
+        token = create_access_token(7, "carol", "user")
+        first = decode_token(token)
+        with patch.object(auth.hmac, "compare_digest") as cmp:
+            second = decode_token(token)
+            cmp.assert_not_called()
+        assert first == second
+
+    def test_cached_token_still_checks_exp(self):
+        from app import auth
+        token = create_access_token(8, "dave", "user")
+        payload = decode_token(token)
+        key = auth._token_cache_key(token)
+        auth._token_cache_put(key, dict(payload, exp=int(time.time()) - 1))
+        assert decode_token(token) is None
+
+    def test_failed_verification_not_cached(self):
+        from app import auth
+        before = len(auth._token_cache)
+        assert decode_token("a.b.c") is None
+        assert len(auth._token_cache) == before
+
+
+class TestLoginLimiter:
+
+    def test_blocks_after_max_failures(self):
+        from app import auth
+        key = ("10.0.0.1", "limited")
+        auth.clear_login_failures(key)
+        for _ in range(auth.LOGIN_MAX_FAILURES - 1):
+            auth.record_login_failure(key)
+        assert not auth.login_blocked(key)
+        auth.record_login_failure(key)
+        assert auth.login_blocked(key)
+        assert not auth.login_blocked(("10.0.0.2", "limited"))
+
+    def test_window_expiry_unblocks(self):
+        from app import auth
+        key = ("10.0.0.1", "expired")
+        for _ in range(auth.LOGIN_MAX_FAILURES):
+            auth.record_login_failure(key)
+        with patch("app.auth.time.monotonic", return_value=time.monotonic() + auth.LOGIN_FAILURE_WINDOW + 1):
+            assert not auth.login_blocked(key)
+
+    def test_success_clears(self):
+        from app import auth
+        key = ("10.0.0.1", "cleared")
+        for _ in range(auth.LOGIN_MAX_FAILURES):
+            auth.record_login_failure(key)
+        auth.clear_login_failures(key)
+        assert not auth.login_blocked(key)
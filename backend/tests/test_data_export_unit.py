@@ -0,0 +1,69 @@
+"""Unit tests for the data export endpoint — no DB required."""
+import json
+import datetime
+
+from unittest.mock import patch, MagicMock
+from fastapi.testclient import TestClient
+from fastapi import FastAPI
+
+from app.routers.data import router
+from app.services.data_io import _export_transactions
+from app.auth import get_current_user
+
+
+app = FastAPI()
+app.include_router(router)
+app.dependency_overrides[get_current_user] = lambda: {"id": 2, "user_id": 2, "username": "bob", "role": "user"}
+client = TestClient(app)
+
+
+class TestExport:
+
+    @patch("app.routers.data.export_data")
+    def test_streamed_json_is_valid(self, mock_export):
+        mock_export.return_value = {
+            "version": "1.0",
+            "exported_at": "2026-03-02T00:00:00Z",
+            "metadata": {"total_accounts": 1, "total_positions": 0},
+            "modules": {
+                "accounts": [{"id": 1, "name": "默认账户", "created_at": datetime.datetime(2026, 3, 1, 9, 30)}],
+                "positions": [],
+            },
+        }
+        resp = client.get("/data/export?modules=accounts,positions")
+        assert resp.status_code == 200
+        assert resp.headers["content-disposition"].startswith("attachment; filename=fundval_export_")
+        data = json.loads(resp.content)
+        assert data["metadata"]["total_accounts"] == 1
+        assert data["modules"]["accounts"][0]["name"] == "默认账户"
+        assert data["modules"]["accounts"][0]["created_at"] == "2026-03-01T09:30:00"
+        assert data["modules"]["positions"] == []
+
+    @patch("app.routers.data.export_data")
+    def test_no_modules_selected(self, mock_export):
+        mock_export.return_value = {"version": "1.0", "exported_at": "x", "metadata": {}, "modules": {}}
+        resp = client.get("/data/export?modules=settings")
+        assert json.loads(resp.content)["modules"] == {}
+
+    def test_invalid_module_rejected(self):
+        assert client.get("/data/export?modules=nope").status_code == 400
+
+
+class TestExportTransactions:
+
+    @patch("app.services.data_io.release_db_connection")
+    @patch("app.services.data_io.stream_cursor")
+    @patch("app.services.data_io.get_db_connection")
+    def test_rows_streamed_and_cursor_closed(self, mock_get_conn, mock_stream, mock_release):
+        cur = MagicMock()
+        cur.__iter__.return_value = iter([
+            {"id": 1, "created_at": "2026-03-02 15:00:00", "applied_at": None},
+        ])
+        mock_stream.return_value = cur
+
+        rows = _export_transactions(user_id=2)
+        assert rows == [{"id": 1, "created_at": "2026-03-02 15:00:00", "applied_at": None}]
+        assert "DATE_FORMAT(t.created_at, '%%Y-%%m-%%d %%H:%%i:%%s')" in cur.execute.call_args[0][0]
+        cur.fetchall.assert_not_called()
+        cur.close.assert_called_once()
+        mock_release.assert_called_once()
@@ -0,0 +1,147 @@
+"""Unit tests for batched import in services.data_io — no DB required."""
+from unittest.mock import patch, MagicMock
+
+from app.services.data_io import _import_positions, _import_ai_prompts, _import_settings, import_data
+
+
+class TestBatchedImport:
+
+    def test_positions_bulk_ownership_and_merge(self):
+        cur = MagicMock()
+        cur.fetchall.side_effect = [
+            [{"id": 1}, {"id": 2}],
+            [{"account_id": 1, "code": "000001"}],
+        ]
+        data = [
+            {"account_id": 1, "code": "000001", "cost": 1.0, "shares": 1.0},  # 已存在
+            {"account_id": 1, "code": "000002", "cost": 1.0, "shares": 1.0},
+            {"account_id": 2, "code": "000002", "cost": 2.0, "shares": 3.0},
+            {"account_id": 9, "code": "000003"},                               # 非本人账户
+            {"account_id": 2, "code": "000002"},                               # 导入数据内重复
+        ]
+        result = _import_positions(cur, data, "merge", user_id=7)
+
+        assert (result["imported"], result["skipped"], result["failed"]) == (2, 3, 0)
+        assert cur.execute.call_count == 3  # 两次查询 + 批次 SAVEPOINT
+        cur.executemany.assert_called_once()
+        rows = cur.executemany.call_args[0][1]
+        assert rows == [(1, "000002", 1.0, 1.0), (2, "000002", 2.0, 3.0)]
+
+    def test_positions_written_in_primary_key_order(self):
+        cur = MagicMock()
+        cur.fetchall.return_value = [{"id": 1}, {"id": 2}]
+        data = [
+            {"account_id": 2, "code": "000001"},
+            {"account_id": 1, "code": "000003"},
+            {"account_id": 1, "code": "000002"},
+        ]
+        _import_positions(cur, data, "replace", user_id=7)
+        rows = cur.executemany.call_args[0][1]
+        assert [(r[0], r[1]) for r in rows] == [(1, "000002"), (1, "000003"), (2, "000001")]
+
+    def test_failed_batch_retried_row_by_row(self):
+        cur = MagicMock()
+        cur.executemany.side_effect = Exception("Duplicate entry")
+
+        def execute(sql, params=None):
+            if params and params[0] == "bad":
+                raise Exception("Data too long")
+        cur.execute.side_effect = execute
+
+        result = _import_settings(cur, {"good": "1", "bad": "x", "masked": "***"}, "merge")
+        assert (result["imported"], result["skipped"], result["failed"]) == (1, 1, 1)
+        assert result["errors"] == ["Failed to import setting bad: Data too long"]
+
+    def test_partial_batch_rolled_back_before_retry(self):
+        cur = MagicMock()
+        written = []
+
+        def executemany(sql, rows):
+            # 模拟 PyMySQL 拆分后的多条 INSERT：第一条已写入，第二条失败
+            written.append(rows[0])
+            raise Exception("Lock wait timeout")
+
+        def execute(sql, params=None):
+            if sql.startswith("ROLLBACK TO SAVEPOINT"):
+                written.clear()
+            elif params:
+                written.append(params)
+        cur.executemany.side_effect = executemany
+        cur.execute.side_effect = execute
+
+        result = _import_settings(cur, {"a": "1", "b": "2"}, "merge")
+        assert (result["imported"], result["failed"]) == (2, 0)
+        assert written == [("a", "1"), ("b", "2")]
+        statements = [c[0][0] for c in cur.execute.call_args_list]
+        assert statements[:2] == ["SAVEPOINT import_batch", "ROLLBACK TO SAVEPOINT import_batch"]
+
+    def test_only_last_imported_prompt_stays_default(self):
+        cur = MagicMock()
+        data = [
+            {"name": "a", "is_default": True},
+            {"name": "b", "is_default": True},
+            {"name": "c"},
+        ]
+        result = _import_ai_prompts(cur, data, "replace", user_id=7)
+
+        assert result["imported"] == 3
+        rows = cur.executemany.call_args[0][1]
+        assert [(r[1], r[4]) for r in rows] == [("a", False), ("c", False)]
+        statements = [c[0][0] for c in cur.execute.call_args_list]
+        insert = next(i for i, sql in enumerate(statements) if "INSERT INTO ai_prompts" in sql)
+        assert cur.execute.call_args_list[insert][0][1][1:] == ("b", "", "", False)
+        assert "default_owner" in statements[insert + 1]
+        assert statements[insert + 2].startswith("UPDATE ai_prompts SET is_default = TRUE")
+
+    def test_failed_default_prompt_keeps_existing_default(self):
+        cur = MagicMock()
+
+        def execute(sql, params=None):
+            if "INSERT INTO ai_prompts" in sql:
+                raise Exception("Data too long")
+        cur.execute.side_effect = execute
+
+        result = _import_ai_prompts(cur, [{"name": "a", "is_default": True}], "append", user_id=7)
+        assert (result["imported"], result["failed"]) == (0, 1)
+        assert not any("UPDATE ai_prompts" in c[0][0] for c in cur.execute.call_args_list)
+
+    def test_ownership_looked_up_once_per_import(self):
+        cur = MagicMock()
+        cur.fetchall.return_value = [{"id": 1}]
+        conn = MagicMock()
+        conn.cursor.return_value = cur
+        data = {"version": "1.0", "modules": {
+            "positions": [{"account_id": 1, "code": "000001"}],
+            "transactions": [{"account_id": 1, "code": "000001", "confirm_date": "2026-03-02"}],
+        }}
+        with patch("app.services.data_io.get_db_connection", return_value=conn), \
+             patch("app.services.data_io.release_db_connection"):
+            result = import_data(data, ["positions", "transactions"], "append", user_id=7)
+
+        assert result["imported"] == 2
+        conn.begin.assert_called_once()
+        conn.commit.assert_called_once()
+        ownership = [c for c in cur.execute.call_args_list if "FROM accounts WHERE user_id" in c[0][0]]
+        assert len(ownership) == 1
+
+
+class TestCompactFormat:
+
+    def test_round_trip(self):
+        from app.services.data_io import _to_columns, _from_columns
+        rows = [{"account_id": 1, "code": "000001"}, {"account_id": 2, "code": "000002"}]
+        compact = _to_columns(rows)
+        assert compact == {"columns": ["account_id", "code"], "rows": [[1, "000001"], [2, "000002"]]}
+        assert _from_columns(compact) == rows
+        assert _from_columns(rows) is rows
+
+    def test_export_compact_keeps_settings_and_totals(self):
+        from app.services import data_io
+        with patch.dict(data_io._EXPORTERS, {
+            "settings": lambda uid: {"AI_MODEL_NAME": "gpt"},
+            "accounts": lambda uid: [{"id": 1, "name": "默认账户"}],
+        }):
+            result = data_io.export_data(["settings", "accounts"], user_id=2, compact=True)
+        assert result["modules"]["settings"] == {"AI_MODEL_NAME": "gpt"}
+        assert result["modules"]["accounts"] == {"columns": ["id", "name"], "rows": [[1, "默认账户"]]}
+        assert result["metadata"]["total_accounts"] == 1
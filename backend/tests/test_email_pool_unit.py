@@ -0,0 +1,97 @@
+"""Unit tests for SMTP connection reuse in services.email — no network required."""
+import smtplib
+
+from unittest.mock import patch, MagicMock
+
+from app.services import email as email_service
+from app.services.email import send_email, close_smtp_pool, Config
+
+
+class TestSmtpPool:
+
+    def setup_method(self):
+        close_smtp_pool()
+        self._saved = (Config.SMTP_HOST, Config.SMTP_PORT, Config.SMTP_USER, Config.SMTP_PASSWORD, Config.EMAIL_FROM)
+        Config.SMTP_HOST, Config.SMTP_PORT = "pool-smtp.example.com", 587
+        Config.SMTP_USER, Config.SMTP_PASSWORD = "pool@example.com", "pw"
+        Config.EMAIL_FROM = "noreply@example.com"
+
+    def teardown_method(self):
+        close_smtp_pool()
+        (Config.SMTP_HOST, Config.SMTP_PORT, Config.SMTP_USER, Config.SMTP_PASSWORD, Config.EMAIL_FROM) = self._saved
+
+    @patch("app.services.email.smtplib.SMTP")
+    def test_connection_reused_across_sends(self, mock_smtp):
+        server = MagicMock()
+        mock_smtp.return_value = server
+
+        assert send_email("a@example.com", "s", "b") is True
+        assert send_email("b@example.com", "s", "b") is True
+
+        mock_smtp.assert_called_once_with("pool-smtp.example.com", 587)
+        server.login.assert_called_once_with("pool@example.com", "pw")
+        assert server.send_message.call_count == 2
+        server.quit.assert_not_called()
+
+    @patch("app.services.email.smtplib.SMTP")
+    def test_disconnected_connection_replaced(self, mock_smtp):
+        stale, fresh = MagicMock(), MagicMock()
+        mock_smtp.side_effect = [stale, fresh]
+
+        assert send_email("a@example.com", "s", "b") is True
+        stale.send_message.side_effect = smtplib.SMTPServerDisconnected("gone")
+        assert send_email("b@example.com", "s", "b") is True
+
+        assert mock_smtp.call_count == 2
+        fresh.send_message.assert_called_once()
+
+    @patch("app.services.email.smtplib.SMTP")
+    def test_recycled_after_max_sends(self, mock_smtp):
+        server = MagicMock()
+        mock_smtp.return_value = server
+
+        with patch.object(email_service, "SMTP_MAX_SENDS_PER_CONN", 1):
+            send_email("a@example.com", "s", "b")
+        server.quit.assert_called_once()
+        assert email_service._smtp_pool.get(("pool-smtp.example.com", 587, "pool@example.com", "pw"), []) == []
+
+    @patch("app.services.email.smtplib.SMTP")
+    def test_failed_send_closes_connection(self, mock_smtp):
+        server = MagicMock()
+        server.send_message.side_effect = smtplib.SMTPRecipientsRefused({})
+        mock_smtp.return_value = server
+
+        assert send_email("bad@example.com", "s", "b") is False
+        server.quit.assert_called_once()
+
+
+class TestSchedulerBatchReuse:
+
+    def teardown_method(self):
+        from app.services.email import clear_user_settings_cache
+        close_smtp_pool()
+        clear_user_settings_cache()
+
+    @patch("app.services.email.smtplib.SMTP")
+    @patch("app.routers.settings.get_user_effective_settings")
+    @patch("app.services.scheduler.update_notification_time")
+    def test_one_login_per_user_batch(self, mock_update, mock_settings, mock_smtp):
+        from app.services.scheduler import _process_user_subscriptions
+        mock_settings.return_value = {
+            "SMTP_HOST": "batch-smtp.example.com", "SMTP_PORT": 587,
+            "SMTP_USER": "u@example.com", "SMTP_PASSWORD": "pw", "EMAIL_FROM": "u@example.com",
+        }
+        server = MagicMock()
+        mock_smtp.return_value = server
+        subs = [{"id": i, "code": f"00000{i}", "email": f"{i}@example.com", "enable_volatility": True,
+                 "threshold_up": 3.0, "threshold_down": -3.0, "last_notified_at": None, "enable_digest": False}
+                for i in (1, 2, 3)]
+        valuations = {s["code"]: {"name": "F", "estRate": 5.0, "time": "14:30"} for s in subs}
+
+        _process_user_subscriptions(42, subs, valuations, "2026-02-10", "14:30", None)
+
+        mock_smtp.assert_called_once_with("batch-smtp.example.com", 587)
+        server.login.assert_called_once()
+        assert server.send_message.call_count == 3
+        mock_settings.assert_called_once_with(42)
+        mock_update.assert_called_once_with([1, 2, 3])
@@ -0,0 +1,57 @@
+"""Unit tests for the cached fund category list — no DB required."""
+from unittest.mock import patch, MagicMock
+
+from app.services import fund
+
+
+def _mock_rows(mock_conn, rows):
+    mock_cur = MagicMock()
+    mock_cur.fetchall.return_value = rows
+    mock_conn.return_value.cursor.return_value = mock_cur
+    return mock_cur
+
+
+class TestFundCategories:
+
+    def setup_method(self):
+        fund.clear_fund_categories_cache()
+
+    @patch("app.services.fund.release_db_connection")
+    @patch("app.services.fund.get_db_connection")
+    def test_returns_sql_ordering(self, mock_conn, mock_release):
+        _mock_rows(mock_conn, [
+            {"major": "债券型", "count": 5},
+            {"major": "股票型", "count": 3},
+            {"major": "其他", "count": 1},
+        ])
+        assert fund.get_fund_categories() == ["债券型", "股票型", "其他"]
+
+    @patch("app.services.fund.release_db_connection")
+    @patch("app.services.fund.get_db_connection")
+    def test_cached_within_ttl(self, mock_conn, mock_release):
+        mock_cur = _mock_rows(mock_conn, [{"major": "QDII", "count": 1}])
+        fund.get_fund_categories()
+        fund.get_fund_categories()
+        assert mock_cur.execute.call_count == 1
+
+    @patch("app.services.fund.release_db_connection")
+    @patch("app.services.fund.get_db_connection")
+    def test_clear_forces_reload(self, mock_conn, mock_release):
+        mock_cur = _mock_rows(mock_conn, [{"major": "QDII", "count": 1}])
+        fund.get_fund_categories()
+        fund.clear_fund_categories_cache()
+        fund.get_fund_categories()
+        assert mock_cur.execute.call_count == 2
+
+
+class TestCategoriesSql:
+
+    def test_placeholders_match_params(self):
+        assert fund._CATEGORIES_SQL.count("%s") == len(fund._CATEGORIES_PARAMS)
+
+    def test_rules_keep_priority_order(self):
+        # 偏股 must be tested before 混合 so 混合型-偏股 stays 股票型
+        params = fund._CATEGORIES_PARAMS
+        assert params.index("%偏股%") < params.index("%混合%")
+        assert params.index("混合型") < params.index("%债%")
+        assert params[-1] == "REITs"
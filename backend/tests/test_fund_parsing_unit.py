@@ -0,0 +1,154 @@
+"""Unit tests for data-source response parsing in services.fund — no network required."""
+import json
+
+from unittest.mock import patch, MagicMock
+
+from app.services import fund
+from app.services.fund import get_eastmoney_pingzhong_data, _parse_eastmoney, _parse_sina, clear_remote_caches
+
+
+PINGZHONG_JS = (
+    '/*fS_name*/var fS_name = "华夏成长混合";var fS_code = "000001";'
+    'var syl_1n="12.34";var syl_6y="3.21";var syl_3y="1.11";var syl_1y="0.5";'
+    '/*单位净值走势*/var Data_netWorthTrend = '
+    + json.dumps([{"x": 1772409600000, "y": 1.2345}, {"x": 1772496000000, "y": 1.25}])
+    + ';/*累计净值走势*/var Data_ACWorthTrend = [[1772409600000,2.0]];/*累计收益率走势*/'
+    '/*现任基金经理*/var Data_currentFundManager =' + json.dumps([{"name": "张三"}, {"name": "李四"}])
+    + ' ;/*规模变动*/var Data_performanceEvaluation = '
+    + json.dumps({"categories": ["选证能力", "收益率"], "data": [70.0, 80.0]}) + ';/*现任基金经理*/'
+)
+
+
+class TestPingzhongParsing:
+
+    def setup_method(self):
+        clear_remote_caches()
+
+    @patch("app.services.fund._SESSION.get")
+    def test_all_fields_extracted(self, mock_get):
+        mock_get.return_value = MagicMock(status_code=200, text=PINGZHONG_JS)
+        data = get_eastmoney_pingzhong_data("000001")
+
+        assert data["name"] == "华夏成长混合"
+        assert data["code"] == "000001"
+        assert data["manager"] == "张三, 李四"
+        assert data["syl_1y"] == "0.5"
+        assert data["performance"] == {"选证能力": 70.0, "收益率": 80.0}
+        assert [h["nav"] for h in data["history"]] == [1.2345, 1.25]
+
+    @patch("app.services.fund._SESSION.get")
+    def test_missing_blocks_skipped(self, mock_get):
+        mock_get.return_value = MagicMock(status_code=200, text='var fS_name = "x";var Data_netWorthTrend = [];/*y*/')
+        data = get_eastmoney_pingzhong_data("000001")
+        assert data == {"name": "x", "history": []}
+
+
+class TestValuationParsing:
+
+    def test_eastmoney_jsonp(self):
+        text = 'jsonpgz({"name":"基金","dwjz":"1.2000","gsz":"1.2100","gszzl":"0.83","gztime":"2026-03-02 14:30"});'
+        assert _parse_eastmoney(text) == {
+            "name": "基金", "nav": 1.2, "estimate": 1.21, "estRate": 0.83, "time": "2026-03-02 14:30",
+        }
+
+    def test_sina_quote(self):
+        text = 'var hq_str_fu_000001="基金,14:30:00,1.21,1.20,1.1,0.01,0.83,2026-03-02";'
+        assert _parse_sina(text) == {"estimate": 1.21, "nav": 1.2, "estRate": 0.83, "time": "2026-03-02 14:30:00"}
+        assert _parse_sina('var hq_str_fu_000001="";') == {}
+
+    def test_eastmoney_empty_and_garbage(self):
+        assert _parse_eastmoney("jsonpgz();") == {}
+        assert _parse_eastmoney("<html>404</html>") == {}
+
+
+class TestRemoteCache:
+
+    def setup_method(self):
+        clear_remote_caches()
+
+    def teardown_method(self):
+        clear_remote_caches()
+
+    @patch("app.services.fund.get_sina_valuation", return_value={})
+    @patch("app.services.fund.get_eastmoney_valuation")
+    def test_valuation_reused_within_ttl(self, mock_em, mock_sina):
+        mock_em.return_value = {"name": "基金", "estimate": 1.21, "estRate": 0.83}
+        first = fund.get_combined_valuation("000001")
+        first["name"] = "changed"
+        assert fund.get_combined_valuation("000001")["name"] == "基金"
+        mock_em.assert_called_once()
+
+    @patch("app.services.fund.get_sina_valuation", return_value={})
+    @patch("app.services.fund.get_eastmoney_valuation", return_value={})
+    def test_empty_result_not_cached(self, mock_em, mock_sina):
+        fund.get_combined_valuation("000001")
+        fund.get_combined_valuation("000001")
+        assert mock_em.call_count == 2
+
+    @patch("app.services.fund.get_sina_valuation", return_value={})
+    @patch("app.services.fund.get_eastmoney_valuation")
+    def test_expired_entry_refetched(self, mock_em, mock_sina):
+        mock_em.return_value = {"estimate": 1.0}
+        with patch.object(fund, "VALUATION_CACHE_TTL", 0):
+            fund.get_combined_valuation("000001")
+            fund.get_combined_valuation("000001")
+        assert mock_em.call_count == 2
+
+    @patch("app.services.fund._SESSION.get")
+    def test_pingzhong_cached(self, mock_get):
+        mock_get.return_value = MagicMock(status_code=200, text='var fS_name = "x";')
+        get_eastmoney_pingzhong_data("000001")
+        assert get_eastmoney_pingzhong_data("000001") == {"name": "x"}
+        mock_get.assert_called_once()
+
+
+class TestTechnicalIndicators:
+
+    def test_known_series(self):
+        navs = [1.0, 1.1, 0.99, 1.05, 1.2, 1.08, 1.1, 1.15, 1.12, 1.3]
+        result = fund._calculate_technical_indicators([{"nav": v} for v in navs])
+        assert result["max_drawdown"] == "-10.0%"
+        assert set(result) == {"sharpe", "volatility", "max_drawdown", "annual_return"}
+
+    def test_short_history(self):
+        assert fund._calculate_technical_indicators([{"nav": 1.0}] * 5)["sharpe"] == "--"
+
+
+class TestStockSpots:
+
+    @patch("app.services.fund._SESSION.get")
+    def test_markets_parsed(self, mock_get):
+        mock_get.return_value = MagicMock(text=(
+            'var hq_str_sh600000="浦发银行,10.00,9.90,10.10,' + ",".join(["1"] * 28) + '";\n'
+            'var hq_str_hk00700="TENCENT,腾讯控股,300.0,310.0,305,299,320.0,' + ",".join(["2"] * 10) + '";\n'
+            'var hq_str_gb_aapl="苹果,180.0,1.25,2026";\n'
+            'var hq_str_sz000001="";\n'
+        ))
+        spots = fund._fetch_stock_spots_sina(["600000", "00700", "AAPL", "000001"])
+        assert spots == {"600000": 2.02, "00700": 3.23, "AAPL": 1.25}
+
+
+class TestIntradayHoldings:
+
+    @patch("app.services.fund._get_fund_info_from_db", return_value={"name": "基金全称", "type": "股票型"})
+    @patch("app.services.fund.get_eastmoney_pingzhong_data", return_value={"history": [{"nav": 1.0}] * 5})
+    @patch("app.services.fund.get_combined_valuation", return_value={"name": "基金"})
+    @patch("app.services.fund._fetch_stock_spots_sina")
+    @patch("app.services.fund.ak")
+    def test_dedup_and_spots_for_shown_only(self, mock_ak, mock_spots, *_):
+        import pandas as pd
+        mock_ak.fund_portfolio_hold_em.return_value = pd.DataFrame({
+            "股票代码": ["600000", "000001", "600000", "300750"],
+            "股票名称": ["浦发银行", "平安银行", "浦发银行", "宁德时代"],
+            "占净值比例": ["5.0%", "3.0%", "4.0%", "0.001%"],
+        })
+        mock_spots.return_value = {"600000": 1.5}
+
+        data = fund.get_fund_intraday("000001")
+
+        assert data["holdings"] == [
+            {"name": "浦发银行", "percent": 5.0, "change": 1.5},
+            {"name": "平安银行", "percent": 3.0, "change": 0.0},
+        ]
+        mock_spots.assert_called_once_with(["600000", "000001"])
+        assert data["type"] == "股票型"
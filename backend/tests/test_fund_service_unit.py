@@ -0,0 +1,56 @@
+"""Unit tests for NAV lookups and the fund-type cache — no DB required."""
+from unittest.mock import patch, MagicMock
+
+from app.services import fund
+
+
+class TestNavOnDate:
+
+    @patch("app.services.fund.get_fund_history")
+    @patch("app.services.fund.release_db_connection")
+    @patch("app.services.fund.get_db_connection")
+    def test_stored_nav_point_lookup(self, mock_conn, mock_release, mock_history):
+        mock_cur = MagicMock()
+        mock_cur.fetchone.return_value = (1.2345,)
+        mock_conn.return_value.cursor.return_value = mock_cur
+
+        assert fund.get_nav_on_date("000001", "2026-03-02 15:00:00") == 1.2345
+        assert mock_cur.execute.call_args[0][1] == ("000001", "2026-03-02")
+        mock_history.assert_not_called()
+        mock_release.assert_called_once()
+
+    @patch("app.services.fund.get_fund_history", return_value=[{"date": "2026-03-02", "nav": 1.3}])
+    @patch("app.services.fund.release_db_connection")
+    @patch("app.services.fund.get_db_connection")
+    def test_missing_row_falls_back_to_history(self, mock_conn, mock_release, mock_history):
+        mock_cur = MagicMock()
+        mock_cur.fetchone.return_value = None
+        mock_conn.return_value.cursor.return_value = mock_cur
+
+        assert fund.get_nav_on_date("000001", "2026-03-02") == 1.3
+        mock_history.assert_called_once_with("000001", limit=90)
+
+
+class TestNavOnDates:
+
+    @patch("app.services.fund.get_fund_history")
+    @patch("app.services.fund.release_db_connection")
+    @patch("app.services.fund.get_db_connection")
+    def test_stored_rows_then_history_once_per_code(self, mock_conn, mock_release, mock_history):
+        mock_cur = MagicMock()
+        mock_cur.fetchall.return_value = [("000001", "2026-03-02", 1.5)]
+        mock_conn.return_value.cursor.return_value = mock_cur
+        mock_history.return_value = [{"date": "2026-03-02", "nav": 2.0}, {"date": "2026-03-03", "nav": 2.1}]
+
+        navs = fund.get_nav_on_dates([
+            ("000001", "2026-03-02"), ("000002", "2026-03-02"), ("000002", "2026-03-03 15:00:00"), ("000002", "2026-03-04"),
+        ])
+
+        assert navs == {("000001", "2026-03-02"): 1.5, ("000002", "2026-03-02"): 2.0, ("000002", "2026-03-03 15:00:00"): 2.1}
+        assert mock_cur.execute.call_count == 1
+        mock_history.assert_called_once_with("000002", limit=90)
+
+    @patch("app.services.fund.get_db_connection")
+    def test_empty_pairs(self, mock_conn):
+        assert fund.get_nav_on_dates([]) == {}
+        mock_conn.assert_not_called()
@@ -0,0 +1,100 @@
+"""Unit tests for batched fund list / NAV history upserts — no DB required."""
+from unittest.mock import patch, MagicMock
+
+import pandas as pd
+
+from app.services import fund, scheduler
+
+
+class TestFundListUpsert:
+
+    @patch("app.services.scheduler.clear_fund_categories_cache")
+    @patch("app.services.scheduler.release_db_connection")
+    @patch("app.services.scheduler.get_db_connection")
+    @patch("app.services.scheduler.ak")
+    def test_chunked_executemany(self, mock_ak, mock_conn, mock_release, mock_clear):
+        mock_ak.fund_name_em.return_value = pd.DataFrame({
+            "基金代码": ["000001", "000002", "000003"],
+            "基金简称": ["A", "B", "C"],
+            "基金类型": ["股票型", "债券型", "QDII"],
+        })
+        mock_cur = MagicMock()
+        mock_conn.return_value.cursor.return_value = mock_cur
+
+        with patch.object(scheduler, "FUND_LIST_BATCH_SIZE", 2):
+            scheduler.fetch_and_update_funds()
+
+        mock_cur.execute.assert_not_called()
+        batches = [c[0][1] for c in mock_cur.executemany.call_args_list]
+        assert batches == [[("000001", "A", "股票型"), ("000002", "B", "债券型")], [("000003", "C", "QDII")]]
+        assert "CURRENT_TIMESTAMP)" not in mock_cur.executemany.call_args[0][0]
+        mock_conn.return_value.commit.assert_called_once()
+
+
+class TestFundHistoryUpsert:
+
+    @patch("app.services.fund.release_db_connection")
+    @patch("app.services.fund.get_db_connection")
+    @patch("app.services.fund.ak")
+    def test_history_rows_written_in_one_call(self, mock_ak, mock_conn, mock_release):
+        mock_ak.fund_open_fund_info_em.return_value = pd.DataFrame({
+            "净值日期": pd.to_datetime(["2026-01-02", "2026-01-05"]),
+            "单位净值": [1.01, 1.02],
+        })
+        mock_cur = MagicMock()
+        mock_cur.fetchone.return_value = None
+        mock_cur.fetchall.return_value = []
+        mock_conn.return_value.cursor.return_value = mock_cur
+
+        history = fund.get_fund_history("000001", limit=9999)
+
+        assert history == [{"date": "2026-01-02", "nav": 1.01}, {"date": "2026-01-05", "nav": 1.02}]
+        mock_cur.executemany.assert_called_once()
+        assert mock_cur.executemany.call_args[0][1] == [("000001", "2026-01-02", 1.01), ("000001", "2026-01-05", 1.02)]
+
+    @patch("app.services.fund.release_db_connection")
+    @patch("app.services.fund.get_db_connection")
+    @patch("app.services.fund.ak")
+    def test_date_objects_and_string_navs(self, mock_ak, mock_conn, mock_release):
+        from datetime import date
+        mock_ak.fund_open_fund_info_em.return_value = pd.DataFrame({
+            "净值日期": [date(2026, 1, 5), date(2026, 1, 2)],
+            "单位净值": ["1.02", "1.01"],
+        })
+        mock_cur = MagicMock()
+        mock_cur.fetchall.return_value = []
+        mock_conn.return_value.cursor.return_value = mock_cur
+
+        history = fund.get_fund_history("000001", limit=30)
+
+        assert history == [{"date": "2026-01-02", "nav": 1.01}, {"date": "2026-01-05", "nav": 1.02}]
+
+
+class TestFundHistoryProbe:
+
+    @patch("app.services.fund.release_db_connection")
+    @patch("app.services.fund.get_db_connection")
+    @patch("app.services.fund.ak")
+    def test_stale_probe_skips_full_read(self, mock_ak, mock_conn, mock_release):
+        mock_ak.fund_open_fund_info_em.return_value = pd.DataFrame()
+        mock_cur = MagicMock()
+        mock_cur.fetchone.return_value = {"date": "2000-01-03", "updated_at": "2000-01-03 20:00:00", "n": 100}
+        mock_conn.return_value.cursor.return_value = mock_cur
+
+        assert fund.get_fund_history("000001", limit=9999) == []
+        assert mock_cur.execute.call_count == 1
+        mock_cur.fetchall.assert_not_called()
+
+    @patch("app.services.fund.release_db_connection")
+    @patch("app.services.fund.get_db_connection")
+    @patch("app.services.fund._history_cache_valid", return_value=True)
+    def test_fresh_probe_reads_ascending(self, mock_valid, mock_conn, mock_release):
+        mock_cur = MagicMock()
+        mock_cur.fetchone.return_value = {"date": "2026-03-02", "updated_at": "2026-03-02 20:00:00", "n": 100}
+        mock_cur.fetchall.return_value = [{"date": "2026-02-27", "nav": 1.0}, {"date": "2026-03-02", "nav": 1.1}]
+        mock_conn.return_value.cursor.return_value = mock_cur
+
+        history = fund.get_fund_history("000001", limit=9999)
+
+        assert history == [{"date": "2026-02-27", "nav": 1.0}, {"date": "2026-03-02", "nav": 1.1}]
+        assert mock_cur.execute.call_args[0][0].endswith("ORDER BY date")
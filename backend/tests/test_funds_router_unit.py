@@ -0,0 +1,58 @@
+"""Unit tests for the funds router — no DB required."""
+from contextlib import contextmanager
+from unittest.mock import patch, MagicMock
+from fastapi.testclient import TestClient
+from fastapi import FastAPI
+
+from app.routers.funds import router
+
+
+app = FastAPI()
+app.include_router(router)
+client = TestClient(app)
+
+
+def _lease(rows):
+    """Patch get_db() in the funds router to hand out a mock cursor."""
+    mock_cur = MagicMock()
+    mock_cur.fetchall.return_value = rows
+    conn = MagicMock()
+    conn.cursor.return_value = mock_cur
+
+    @contextmanager
+    def fake_get_db():
+        yield conn
+
+    patcher = patch("app.routers.funds.get_db", fake_get_db)
+    patcher.start()
+    return mock_cur
+
+
+class TestFundIntraday:
+
+    def teardown_method(self):
+        patch.stopall()
+
+    def test_single_round_trip(self):
+        mock_cur = _lease([
+            {"found": 1, "prev_nav": 1.2345, "time": "09:35", "estimate": 1.24},
+            {"found": 1, "prev_nav": 1.2345, "time": "09:40", "estimate": 1.25},
+        ])
+        resp = client.get("/fund/000001/intraday?date=2026-03-02")
+        assert resp.status_code == 200
+        data = resp.json()
+        assert mock_cur.execute.call_count == 1
+        assert data["prevNav"] == 1.2345
+        assert data["snapshots"] == [{"time": "09:35", "estimate": 1.24}, {"time": "09:40", "estimate": 1.25}]
+        assert data["lastCollectedAt"] == "09:40"
+
+    def test_no_snapshots(self):
+        _lease([{"found": 1, "prev_nav": None, "time": None, "estimate": None}])
+        data = client.get("/fund/000001/intraday?date=2026-03-02").json()
+        assert data["prevNav"] is None
+        assert data["snapshots"] == []
+        assert data["lastCollectedAt"] is None
+
+    def test_unknown_fund(self):
+        _lease([{"found": 0, "prev_nav": None, "time": None, "estimate": None}])
+        assert client.get("/fund/999999/intraday").status_code == 404
@@ -0,0 +1,198 @@
+"""Unit tests for batched pending-transaction confirmation in services.trade — no DB required."""
+from unittest.mock import patch, MagicMock
+
+from app.services import trade
+
+
+# (id, account_id, code, op_type, amount_cny, shares_redeemed, confirm_date)
+PENDING = [
+    (1, 5, "000001", "add", 100.0, None, "2026-03-02"),
+    (2, 5, "000002", "reduce", None, 10.0, "2026-03-02"),
+    (3, 5, "000003", "add", 50.0, None, "2026-03-03"),
+]
+
+
+def _sql_calls(mock_cur, keyword):
+    return [c[0] for c in mock_cur.executemany.call_args_list + mock_cur.execute.call_args_list if keyword in c[0][0]]
+
+
+class TestProcessPending:
+
+    @patch("app.services.trade.get_nav_on_dates")
+    @patch("app.services.trade.release_db_connection")
+    @patch("app.services.trade.get_db_connection")
+    def test_updates_batched_and_committed_once(self, mock_conn, mock_release, mock_nav):
+        mock_cur = MagicMock()
+        mock_cur.fetchall.side_effect = [PENDING, [
+            {"account_id": 5, "code": "000001", "cost": 1.0, "shares": 100.0},
+            {"account_id": 5, "code": "000002", "cost": 1.0, "shares": 100.0},
+        ]]
+        mock_conn.return_value.cursor.return_value = mock_cur
+        mock_nav.return_value = {("000001", "2026-03-02"): 2.0, ("000002", "2026-03-02"): 2.0}
+
+        assert trade.process_pending_transactions() == 2
+
+        (add_sql, add_rows), = _sql_calls(mock_cur, "shares_added = %s")
+        (reduce_sql, reduce_rows), = _sql_calls(mock_cur, "amount_cny = %s")
+        assert add_rows == [(2.0, 50.0, 1.3333, 1)]
+        assert reduce_rows == [(2.0, 20.0, 1.0, 2)]
+        (_, upserts), = _sql_calls(mock_cur, "INSERT INTO positions")
+        assert sorted(upserts) == [(5, "000001", 1.3333, 150.0), (5, "000002", 1.0, 90.0)]
+        assert _sql_calls(mock_cur, "DELETE FROM positions") == []
+        mock_conn.return_value.begin.assert_called_once()
+        mock_conn.return_value.commit.assert_called_once()
+
+    @patch("app.services.trade.get_nav_on_dates", return_value={})
+    @patch("app.services.trade.release_db_connection")
+    @patch("app.services.trade.get_db_connection")
+    def test_nothing_confirmed_skips_write(self, mock_conn, mock_release, mock_nav):
+        mock_cur = MagicMock()
+        mock_cur.fetchall.side_effect = [PENDING, []]
+        mock_conn.return_value.cursor.return_value = mock_cur
+
+        assert trade.process_pending_transactions() == 0
+        mock_cur.executemany.assert_not_called()
+        assert mock_conn.call_count == 1
+
+    @patch("app.services.trade.get_nav_on_dates", return_value={("000001", "2026-03-02"): 2.0, ("000002", "2026-03-02"): 2.0})
+    @patch("app.services.trade.release_db_connection")
+    @patch("app.services.trade.get_db_connection")
+    def test_positions_prefetched_once_and_chained(self, mock_conn, mock_release, mock_nav):
+        pending = [
+            (1, 5, "000001", "reduce", None, 100.0, "2026-03-02"),
+            (2, 5, "000001", "add", 20.0, None, "2026-03-02"),
+            (3, 6, "000002", "reduce", None, 5.0, "2026-03-02"),
+        ]
+        mock_cur = MagicMock()
+        mock_cur.fetchall.side_effect = [pending, [
+            {"account_id": 5, "code": "000001", "cost": 1.0, "shares": 100.0},
+            {"account_id": 6, "code": "000002", "cost": 1.0, "shares": 5.0},
+        ]]
+        mock_conn.return_value.cursor.return_value = mock_cur
+
+        assert trade.process_pending_transactions() == 3
+
+        (prefetch_sql, prefetch_params), = _sql_calls(mock_cur, "SELECT account_id, code")
+        assert prefetch_sql.endswith("FOR UPDATE") and len(prefetch_params) == 4
+        mock_nav.assert_called_once_with({("000001", "2026-03-02"), ("000002", "2026-03-02")})
+        # 清仓后的加仓按新建持仓计算，只写最终状态
+        (_, upserts), = _sql_calls(mock_cur, "INSERT INTO positions")
+        assert upserts == [(5, "000001", 2.0, 10.0)]
+        (delete_sql, delete_params), = _sql_calls(mock_cur, "DELETE FROM positions")
+        assert "(account_id, code) IN ((%s, %s))" in delete_sql and delete_params == [6, "000002"]
+
+    @patch("app.services.trade.get_nav_on_dates", return_value={("000001", "2026-03-02"): 1.6858})
+    @patch("app.services.trade.release_db_connection")
+    @patch("app.services.trade.get_db_connection")
+    def test_rounding_matches_immediate_reduce(self, mock_conn, mock_release, mock_nav):
+        # 4225 * 1.6858 = 7122.505：Python round() 得 7122.51，np.round 会得 7122.5
+        mock_cur = MagicMock()
+        mock_cur.fetchall.side_effect = [[(1, 5, "000001", "reduce", None, 4225.0, "2026-03-02")], [
+            {"account_id": 5, "code": "000001", "cost": 1.0, "shares": 5000.0},
+        ]]
+        mock_conn.return_value.cursor.return_value = mock_cur
+
+        trade.process_pending_transactions()
+
+        (_, reduce_rows), = _sql_calls(mock_cur, "amount_cny = %s")
+        assert reduce_rows == [(1.6858, round(4225.0 * 1.6858, 2), 1.0, 1)]
+        assert reduce_rows[0][1] == 7122.51
+
+    @patch("app.services.trade.bulk_upsert_positions", side_effect=RuntimeError("deadlock"))
+    @patch("app.services.trade.get_nav_on_dates", return_value={("000001", "2026-03-02"): 2.0})
+    @patch("app.services.trade.release_db_connection")
+    @patch("app.services.trade.get_db_connection")
+    def test_failure_rolls_back_whole_batch(self, mock_conn, mock_release, mock_nav, mock_upsert):
+        import pytest
+        mock_cur = MagicMock()
+        mock_cur.fetchall.side_effect = [PENDING[:1], []]
+        mock_conn.return_value.cursor.return_value = mock_cur
+
+        with pytest.raises(RuntimeError):
+            trade.process_pending_transactions()
+        mock_conn.return_value.rollback.assert_called_once()
+        mock_conn.return_value.commit.assert_not_called()
+        assert mock_release.call_count == 2
+
+
+class TestPositionTrades:
+
+    @patch("app.services.trade.get_nav_on_date", return_value=2.0)
+    @patch("app.services.trade.release_db_connection")
+    @patch("app.services.trade.get_db_connection")
+    def test_add_uses_one_lease_and_one_commit(self, mock_conn, mock_release, mock_nav):
+        mock_cur = MagicMock()
+        mock_cur.fetchall.return_value = [{"account_id": 5, "code": "000001", "cost": 1.0, "shares": 100.0}]
+        mock_cur.rowcount = 1
+        conn = mock_conn.return_value
+        conn.cursor.return_value = mock_cur
+
+        result = trade.add_position_trade(5, "000001", 200.0)
+
+        assert result["shares_after"] == 200.0 and result["cost_after"] == 1.5
+        assert mock_conn.call_count == 1 and mock_release.call_count == 1
+        assert "FOR UPDATE" in _sql_calls(mock_cur, "FROM positions")[0][0]
+        assert len(_sql_calls(mock_cur, "INSERT INTO positions")) == 1
+        assert len(_sql_calls(mock_cur, "INSERT INTO transactions")) == 1
+        assert mock_cur.execute.call_count == 3
+        conn.begin.assert_called_once()
+        conn.commit.assert_called_once()
+
+    @patch("app.services.trade.get_nav_on_date", return_value=2.0)
+    @patch("app.services.trade.release_db_connection")
+    @patch("app.services.trade.get_db_connection")
+    def test_reduce_revalidates_under_lock(self, mock_conn, mock_release, mock_nav):
+        mock_cur = MagicMock()
+        mock_cur.fetchall.side_effect = [
+            [{"account_id": 5, "code": "000001", "cost": 1.0, "shares": 100.0}],
+            [{"account_id": 5, "code": "000001", "cost": 1.0, "shares": 5.0}],
+        ]
+        conn = mock_conn.return_value
+        conn.cursor.return_value = mock_cur
+
+        result = trade.reduce_position_trade(5, "000001", 10.0)
+
+        assert result["ok"] is False
+        assert not _sql_calls(mock_cur, "INSERT INTO transactions")
+        conn.rollback.assert_called()
+        conn.commit.assert_not_called()
+        assert mock_release.call_count == 2
+
+    @patch("app.services.trade.get_nav_on_date", return_value=2.0)
+    @patch("app.services.trade.release_db_connection")
+    @patch("app.services.trade.get_db_connection")
+    def test_reduce_to_zero_deletes_in_same_transaction(self, mock_conn, mock_release, mock_nav):
+        mock_cur = MagicMock()
+        mock_cur.fetchall.return_value = [{"account_id": 5, "code": "000001", "cost": 1.0, "shares": 10.0}]
+        conn = mock_conn.return_value
+        conn.cursor.return_value = mock_cur
+
+        result = trade.reduce_position_trade(5, "000001", 10.0)
+
+        assert result["ok"] is True and result["amount_cny"] == 20.0
+        assert len(_sql_calls(mock_cur, "DELETE FROM positions")) == 1
+        conn.commit.assert_called_once()
+
+
+class TestListTransactions:
+
+    @patch("app.services.trade.release_db_connection")
+    @patch("app.services.trade.get_db_connection")
+    def test_rows_returned_as_fetched(self, mock_conn, mock_release):
+        from datetime import datetime
+        rows = [{"id": 2, "code": "000001", "created_at": datetime(2026, 3, 2, 14, 59, 1), "applied_at": None}]
+        mock_cur = MagicMock()
+        mock_cur.fetchall.return_value = rows
+        mock_conn.return_value.cursor.return_value = mock_cur
+
+        assert trade.list_transactions(account_id=5) is rows
+
+    @patch("app.services.trade.release_db_connection")
+    @patch("app.services.trade.get_db_connection")
+    def test_limit_capped(self, mock_conn, mock_release):
+        mock_cur = MagicMock()
+        mock_cur.fetchall.return_value = []
+        mock_conn.return_value.cursor.return_value = mock_cur
+
+        trade.list_transactions(account_id=5, limit=10 ** 6)
+        assert mock_cur.execute.call_args[0][1][-1] == trade.MAX_TRANSACTIONS_LIMIT
@@ -0,0 +1,134 @@
+"""Unit tests for portfolio valuation in services.account — no DB required."""
+import asyncio
+from contextlib import contextmanager
+from datetime import datetime
+from unittest.mock import patch, MagicMock, AsyncMock
+
+from app.services.account import get_all_positions
+
+
+def _lease(mock_cur):
+    """Patch get_db() in services.account to hand out a mock cursor; returns a lease counter."""
+    conn = MagicMock()
+    conn.cursor.return_value = mock_cur
+    leases = []
+
+    @contextmanager
+    def fake_get_db():
+        leases.append(conn)
+        yield conn
+
+    patcher = patch("app.services.account.get_db", fake_get_db)
+    patcher.start()
+    return leases
+
+
+class TestGetAllPositions:
+
+    def teardown_method(self):
+        patch.stopall()
+
+    @patch("app.services.account.get_combined_valuation_async", new_callable=AsyncMock)
+    def test_bulk_prefetch_single_connection(self, mock_valuation):
+        today = datetime.now().strftime("%Y-%m-%d")
+        mock_cur = MagicMock()
+        mock_cur.fetchall.side_effect = [
+            [{"code": "000001", "cost": 1.0, "shares": 100.0},
+             {"code": "000002", "cost": 2.0, "shares": 50.0}],
+            [{"code": "000002", "name": "沪深300ETF联接", "type": "指数型"}],
+            [("000001", today), ("000002", "2000-01-01")],
+        ]
+        leases = _lease(mock_cur)
+        mock_valuation.side_effect = lambda client, code: (
+            {"name": "基金一", "nav": 1.1, "estimate": 1.2, "est_rate": 9.1} if code == "000001"
+            else {"nav": 2.0, "estimate": 2.5, "est_rate": 25.0}
+        )
+
+        result = asyncio.run(get_all_positions(5, user_id=2))
+
+        assert len(leases) == 1
+        assert mock_cur.execute.call_count == 3
+        by_code = {p["code"]: p for p in result["positions"]}
+        assert by_code["000001"]["nav_updated_today"] is True
+        assert by_code["000002"]["nav_updated_today"] is False
+        assert by_code["000002"]["name"] == "沪深300ETF联接"
+        assert by_code["000002"]["type"] == "指数型"
+        # 无预取类型时按名称推断，不再回查数据库
+        assert by_code["000001"]["type"] == "未知"
+        # 联接基金的大幅估值仍视为有效
+        assert by_code["000002"]["is_est_valid"] is True
+        assert by_code["000001"]["day_income"] == 10.0
+        assert by_code["000002"]["est_market_value"] == 125.0
+        assert result["summary"] == {
+            "total_market_value": 245.0, "total_cost": 200.0, "total_day_income": 35.0,
+            "total_income": 45.0, "total_return_rate": 22.5,
+        }
+
+    @patch("app.services.account.get_combined_valuation_async", new_callable=AsyncMock)
+    def test_cents_rounded_like_python_round(self, mock_valuation):
+        # 2.675 与 1234.565 在半分位上：round() 得 2.67 / 1234.57，np.round 得 2.68 / 1234.56
+        mock_cur = MagicMock()
+        mock_cur.fetchall.side_effect = [
+            [{"code": "000001", "cost": 2.675, "shares": 1.0},
+             {"code": "000002", "cost": 1234.565, "shares": 1.0}],
+            [],
+            [],
+        ]
+        _lease(mock_cur)
+        mock_valuation.return_value = {"nav": 0.0, "estimate": 0.0}
+
+        result = asyncio.run(get_all_positions(5, user_id=2))
+
+        by_code = {p["code"]: p for p in result["positions"]}
+        assert by_code["000001"]["cost_basis"] == round(2.675, 2) == 2.67
+        assert by_code["000002"]["cost_basis"] == round(1234.565, 2) == 1234.57
+
+    def test_empty_account_skips_prefetch(self):
+        mock_cur = MagicMock()
+        mock_cur.fetchall.return_value = []
+        leases = _lease(mock_cur)
+
+        result = asyncio.run(get_all_positions(5, user_id=2))
+        assert result["positions"] == []
+        assert mock_cur.execute.call_count == 1
+        assert len(leases) == 1
+
+    @patch("app.services.account.get_combined_valuation_async", new_callable=AsyncMock, return_value={"nav": 1.0})
+    def test_aggregate_view_grouped_in_sql(self, mock_valuation):
+        mock_cur = MagicMock()
+        mock_cur.fetchall.side_effect = [
+            [{"code": "000001", "cost": 1.5, "shares": 200.0}],
+            [],
+            [],
+        ]
+        leases = _lease(mock_cur)
+
+        result = asyncio.run(get_all_positions(0, user_id=2))
+        sql = mock_cur.execute.call_args_list[0][0][0]
+        assert "GROUP BY p.code" in sql
+        assert result["positions"][0]["cost_basis"] == 300.0
+        assert len(leases) == 1
+
+    @patch("app.services.account.get_combined_valuation_async", new_callable=AsyncMock)
+    def test_failed_valuation_isolated(self, mock_valuation):
+        mock_cur = MagicMock()
+        mock_cur.fetchall.side_effect = [
+            [{"code": "000001", "cost": 1.0, "shares": 10.0},
+             {"code": "000002", "cost": 1.0, "shares": 10.0}],
+            [],
+            [],
+        ]
+        _lease(mock_cur)
+
+        async def valuation(client, code):
+            if code == "000002":
+                raise RuntimeError("timeout")
+            return {"nav": 1.0}
+        mock_valuation.side_effect = valuation
+
+        result = asyncio.run(get_all_positions(5, user_id=2))
+        by_code = {p["code"]: p for p in result["positions"]}
+        assert by_code["000002"]["name"] == "Error"
+        assert by_code["000001"]["nav"] == 1.0
+        # 同一请求内的估值共用一个 HTTP 客户端
+        assert mock_valuation.call_args_list[0][0][0] is mock_valuation.call_args_list[1][0][0]
@@ -6,12 +6,10 @@ Covers:
 3. Tenant-aware subscription grouping in subscription.py
 4. Tenant-aware scheduler in scheduler.py
 """
-import os
-import sys
+import smtplib
 
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
-
-from unittest.mock import patch, MagicMock
+import pytest
+from unittest.mock import patch, Mock
 
 
 # ═══════════════════════════════════════════════════════════════
@@ -74,6 +72,16 @@ class TestPerUserKeyDerivation:
         decrypted_with_user = decrypt_value(encrypted_global, user_id=1)
         assert decrypted_with_user == "", "Global-encrypted data must not be decryptable with user key"
 
+    def test_derivation_is_memoized(self):
+        """Repeat derivations for the same user must not re-run PBKDF2."""
+        from app import crypto
+        crypto.clear_key_cache()
+        crypto._derive_user_key(7)
+        with patch.object(crypto, "PBKDF2HMAC") as mock_kdf:
+            crypto._derive_user_key(7)
+            crypto.decrypt_value(crypto.encrypt_value("x", user_id=7), user_id=7)
+            mock_kdf.assert_not_called()
+
     def test_empty_string_handling(self):
         from app.crypto import encrypt_value, decrypt_value
         assert encrypt_value("", user_id=1) == ""
@@ -89,7 +97,29 @@ class TestPerUserKeyDerivation:
 class TestPerUserEmail:
     """Verify that send_email uses per-user SMTP settings when user_id is provided."""
 
-    @patch("app.services.email.smtplib.SMTP")
+    def setup_method(self):
+        from app.services.email import clear_user_settings_cache
+        clear_user_settings_cache()
+
+    @pytest.fixture
+    def mock_smtp(self):
+        # spec 限定属性，比 MagicMock 少生成全部魔术方法
+        smtp = Mock(spec=smtplib.SMTP, return_value=Mock(spec=smtplib.SMTP))
+        with patch("app.services.email.smtplib.SMTP", smtp):
+            yield smtp
+        from app.services.email import close_smtp_pool
+        close_smtp_pool()
+
+    @pytest.fixture
+    def smtp_config(self, monkeypatch):
+        """Override Config.SMTP_* for one test; monkeypatch restores them afterwards."""
+        from app.services.email import Config
+
+        def _apply(**settings):
+            for key, value in settings.items():
+                monkeypatch.setattr(Config, key, value)
+        return _apply
+
     @patch("app.routers.settings.get_user_effective_settings")
     def test_send_email_with_user_id_uses_user_settings(self, mock_get_settings, mock_smtp):
         """When user_id is provided, should load that user's SMTP config."""
@@ -100,8 +130,6 @@ class TestPerUserEmail:
             "SMTP_PASSWORD": "user-pass",
             "EMAIL_FROM": "user@example.com",
         }
-        mock_server = MagicMock()
-        mock_smtp.return_value = mock_server
 
         from app.services.email import send_email
         result = send_email("to@example.com", "Test", "Body", user_id=42)
@@ -110,83 +138,56 @@ class TestPerUserEmail:
         mock_smtp.assert_called_once_with("user-smtp.example.com", 465)
         assert result is True
 
-    @patch("app.services.email.smtplib.SMTP")
-    def test_send_email_without_user_id_uses_global_config(self, mock_smtp):
+    @patch("app.routers.settings.get_user_effective_settings")
+    def test_user_settings_cached_until_cleared(self, mock_get_settings, mock_smtp):
+        mock_get_settings.return_value = {
+            "SMTP_HOST": "user-smtp.example.com", "SMTP_PORT": 465,
+            "SMTP_USER": "user@example.com", "SMTP_PASSWORD": "user-pass", "EMAIL_FROM": "user@example.com",
+        }
+        from app.services.email import send_email, clear_user_settings_cache
+        assert send_email("a@example.com", "T", "B", user_id=43) is True
+        assert send_email("b@example.com", "T", "B", user_id=43) is True
+        mock_get_settings.assert_called_once_with(43)
+
+        clear_user_settings_cache(43)
+        send_email("c@example.com", "T", "B", user_id=43)
+        assert mock_get_settings.call_count == 2
+
+    def test_send_email_without_user_id_uses_global_config(self, mock_smtp, smtp_config):
         """When no user_id, should fall back to global Config."""
-        mock_server = MagicMock()
-        mock_smtp.return_value = mock_server
-
-        from app.services.email import send_email, Config
-        original_host = Config.SMTP_HOST
-        original_user = Config.SMTP_USER
-        original_password = Config.SMTP_PASSWORD
-        original_port = Config.SMTP_PORT
-
-        try:
-            Config.SMTP_HOST = "global-smtp.example.com"
-            Config.SMTP_PORT = 587
-            Config.SMTP_USER = "global@example.com"
-            Config.SMTP_PASSWORD = "global-pass"
-            Config.EMAIL_FROM = "noreply@example.com"
-
-            result = send_email("to@example.com", "Test", "Body")
-
-            mock_smtp.assert_called_once_with("global-smtp.example.com", 587)
-            assert result is True
-        finally:
-            Config.SMTP_HOST = original_host
-            Config.SMTP_USER = original_user
-            Config.SMTP_PASSWORD = original_password
-            Config.SMTP_PORT = original_port
+        from app.services.email import send_email
+        smtp_config(SMTP_HOST="global-smtp.example.com", SMTP_PORT=587, SMTP_USER="global@example.com",
+                    SMTP_PASSWORD="global-pass", EMAIL_FROM="noreply@example.com")
+
+        result = send_email("to@example.com", "Test", "Body")
+
+        mock_smtp.assert_called_once_with("global-smtp.example.com", 587)
+        assert result is True
 
     @patch("app.routers.settings.get_user_effective_settings")
-    def test_send_email_skips_when_no_smtp_configured(self, mock_get_settings):
+    def test_send_email_skips_when_no_smtp_configured(self, mock_get_settings, smtp_config):
         """When user has no SMTP config and global is empty, should skip."""
         mock_get_settings.return_value = {
             "SMTP_HOST": "",
             "SMTP_USER": "",
         }
-        from app.services.email import send_email, Config
-        original_host = Config.SMTP_HOST
-        original_user = Config.SMTP_USER
-        try:
-            Config.SMTP_HOST = ""
-            Config.SMTP_USER = ""
-            result = send_email("to@example.com", "Test", "Body", user_id=1)
-            assert result is False
-        finally:
-            Config.SMTP_HOST = original_host
-            Config.SMTP_USER = original_user
-
-    @patch("app.services.email.smtplib.SMTP")
+        from app.services.email import send_email
+        smtp_config(SMTP_HOST="", SMTP_USER="")
+        result = send_email("to@example.com", "Test", "Body", user_id=1)
+        assert result is False
+
     @patch("app.routers.settings.get_user_effective_settings")
-    def test_send_email_falls_back_on_user_settings_error(self, mock_get_settings, mock_smtp):
+    def test_send_email_falls_back_on_user_settings_error(self, mock_get_settings, mock_smtp, smtp_config):
         """If loading user settings fails, should fall back to global."""
         mock_get_settings.side_effect = Exception("DB error")
-        mock_server = MagicMock()
-        mock_smtp.return_value = mock_server
-
-        from app.services.email import send_email, Config
-        original_host = Config.SMTP_HOST
-        original_user = Config.SMTP_USER
-        original_password = Config.SMTP_PASSWORD
-        original_port = Config.SMTP_PORT
-        try:
-            Config.SMTP_HOST = "fallback-smtp.example.com"
-            Config.SMTP_PORT = 587
-            Config.SMTP_USER = "fallback@example.com"
-            Config.SMTP_PASSWORD = "fallback-pass"
-            Config.EMAIL_FROM = "noreply@example.com"
-
-            result = send_email("to@example.com", "Test", "Body", user_id=99)
-
-            mock_smtp.assert_called_once_with("fallback-smtp.example.com", 587)
-            assert result is True
-        finally:
-            Config.SMTP_HOST = original_host
-            Config.SMTP_USER = original_user
-            Config.SMTP_PASSWORD = original_password
-            Config.SMTP_PORT = original_port
+        from app.services.email import send_email
+        smtp_config(SMTP_HOST="fallback-smtp.example.com", SMTP_PORT=587, SMTP_USER="fallback@example.com",
+                    SMTP_PASSWORD="fallback-pass", EMAIL_FROM="noreply@example.com")
+
+        result = send_email("to@example.com", "Test", "Body", user_id=99)
+
+        mock_smtp.assert_called_once_with("fallback-smtp.example.com", 587)
+        assert result is True
 
 
 # ═══════════════════════════════════════════════════════════════
@@ -196,13 +197,9 @@ class TestPerUserEmail:
 class TestSubscriptionGrouping:
     """Verify subscription queries support user_id filtering and grouping."""
 
-    @patch("app.services.subscription.get_db_connection")
-    @patch("app.services.subscription.release_db_connection")
-    @patch("app.services.subscription.dict_cursor")
-    def test_get_active_subscriptions_with_user_id(self, mock_cursor, mock_release, mock_conn):
+    def test_get_active_subscriptions_with_user_id(self, db_mocks):
         """When user_id is provided, should filter by that user."""
-        mock_cur = MagicMock()
-        mock_cursor.return_value = mock_cur
+        mock_cur = db_mocks.cur
         mock_cur.fetchall.return_value = [
             {"id": 1, "user_id": 10, "code": "000001", "email": "a@test.com"}
         ]
@@ -216,13 +213,9 @@ class TestSubscriptionGrouping:
         assert call_args[0][1] == (10,)
         assert len(result) == 1
 
-    @patch("app.services.subscription.get_db_connection")
-    @patch("app.services.subscription.release_db_connection")
-    @patch("app.services.subscription.dict_cursor")
-    def test_get_active_subscriptions_without_user_id(self, mock_cursor, mock_release, mock_conn):
+    def test_get_active_subscriptions_without_user_id(self, db_mocks):
         """When no user_id, should return all subscriptions."""
-        mock_cur = MagicMock()
-        mock_cursor.return_value = mock_cur
+        mock_cur = db_mocks.cur
         mock_cur.fetchall.return_value = [
             {"id": 1, "user_id": 10, "code": "000001"},
             {"id": 2, "user_id": 20, "code": "000002"},
@@ -235,13 +228,9 @@ class TestSubscriptionGrouping:
         assert "WHERE" not in call_args[0][0]
         assert len(result) == 2
 
-    @patch("app.services.subscription.get_db_connection")
-    @patch("app.services.subscription.release_db_connection")
-    @patch("app.services.subscription.dict_cursor")
-    def test_get_subscriptions_grouped_by_user(self, mock_cursor, mock_release, mock_conn):
+    def test_get_subscriptions_grouped_by_user(self, db_mocks):
         """Should group subscriptions by user_id."""
-        mock_cur = MagicMock()
-        mock_cursor.return_value = mock_cur
+        mock_cur = db_mocks.cur
         mock_cur.fetchall.return_value = [
             {"id": 1, "user_id": 10, "code": "000001"},
             {"id": 2, "user_id": 10, "code": "000002"},
@@ -256,13 +245,9 @@ class TestSubscriptionGrouping:
         assert len(grouped[10]) == 2
         assert len(grouped[20]) == 1
 
-    @patch("app.services.subscription.get_db_connection")
-    @patch("app.services.subscription.release_db_connection")
-    @patch("app.services.subscription.dict_cursor")
-    def test_get_subscriptions_grouped_empty(self, mock_cursor, mock_release, mock_conn):
+    def test_get_subscriptions_grouped_empty(self, db_mocks):
         """Empty subscriptions should return empty dict."""
-        mock_cur = MagicMock()
-        mock_cursor.return_value = mock_cur
+        mock_cur = db_mocks.cur
         mock_cur.fetchall.return_value = []
 
         from app.services.subscription import get_subscriptions_grouped_by_user
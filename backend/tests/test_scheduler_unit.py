@@ -0,0 +1,151 @@
+"""Unit tests for scheduler jobs and subscription bookkeeping — no DB required."""
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from app.services import scheduler
+
+
+@pytest.fixture(autouse=True)
+def _empty_rate_window():
+    """Each test starts with an empty valuation window so earlier fetches can't make it wait."""
+    scheduler._rate_window.clear()
+    yield
+    scheduler._rate_window.clear()
+
+
+class TestIntradaySnapshots:
+
+    @patch("app.services.scheduler.is_trading_day", return_value=True)
+    @patch("app.services.scheduler.get_combined_valuation")
+    @patch("app.services.scheduler.release_db_connection")
+    @patch("app.services.scheduler.get_db_connection")
+    def test_connection_not_held_during_fetch(self, mock_conn, mock_release, mock_val, mock_day):
+        from datetime import datetime
+        mock_cur = MagicMock()
+        mock_cur.fetchall.return_value = [{"code": "000001"}, {"code": "000002"}]
+        mock_conn.return_value.cursor.return_value = mock_cur
+
+        def valuation(code):
+            # 估值期间连接应已归还
+            assert mock_release.call_count == 1
+            return {"estimate": 1.5} if code == "000001" else {}
+        mock_val.side_effect = valuation
+
+        fake_now = datetime(2026, 3, 2, 10, 0, tzinfo=scheduler.CST)
+        with patch("app.services.scheduler.datetime") as mock_dt:
+            mock_dt.now.return_value = fake_now
+            scheduler.collect_intraday_snapshots()
+
+        mock_cur.executemany.assert_called_once()
+        assert mock_cur.executemany.call_args[0][1] == [("000001", "2026-03-02", "10:00", 1.5)]
+        assert mock_release.call_count == 2
+
+
+class TestCheckSubscriptions:
+
+    @patch("app.services.scheduler._process_user_subscriptions")
+    @patch("app.services.scheduler.get_combined_valuation")
+    @patch("app.services.scheduler.get_subscriptions_grouped_by_user")
+    def test_each_code_fetched_once_up_front(self, mock_grouped, mock_val, mock_process):
+        mock_grouped.return_value = {
+            1: [{"code": "000001"}, {"code": "000002"}],
+            2: [{"code": "000001"}, {"code": "000003"}],
+        }
+
+        def valuation(code):
+            if code == "000003":
+                raise RuntimeError("timeout")
+            return {"estRate": 1.0}
+        mock_val.side_effect = valuation
+
+        scheduler.check_subscriptions()
+
+        assert sorted(c[0][0] for c in mock_val.call_args_list) == ["000001", "000002", "000003"]
+        valuations = mock_process.call_args.kwargs["valuations"]
+        assert valuations == {"000001": {"estRate": 1.0}, "000002": {"estRate": 1.0}, "000003": None}
+        assert mock_process.call_count == 2
+
+    @patch("app.services.scheduler.update_digest_time")
+    @patch("app.services.scheduler.update_notification_time")
+    @patch("app.services.scheduler.send_email", return_value=True)
+    @patch("app.services.scheduler.get_combined_valuation", return_value={"estRate": 5.0, "name": "F"})
+    @patch("app.services.scheduler.get_subscriptions_grouped_by_user")
+    def test_send_times_written_once_per_tick(self, mock_grouped, mock_val, mock_send, mock_notified, mock_digest):
+        sub = {"enable_volatility": True, "threshold_up": 3.0, "email": "a@example.com", "code": "000001"}
+        mock_grouped.return_value = {1: [dict(sub, id=11)], 2: [dict(sub, id=12), dict(sub, id=13, code="000002")]}
+
+        scheduler.check_subscriptions()
+
+        # 用户并行处理，id 的追加顺序不固定
+        mock_notified.assert_called_once()
+        assert sorted(mock_notified.call_args[0][0]) == [11, 12, 13]
+        mock_digest.assert_not_called()
+
+    @patch("app.services.scheduler._process_user_subscriptions")
+    @patch("app.services.scheduler.get_combined_valuation", return_value=None)
+    @patch("app.services.scheduler.get_subscriptions_grouped_by_user")
+    def test_users_processed_concurrently(self, mock_grouped, mock_val, mock_process):
+        import threading
+        mock_grouped.return_value = {1: [{"code": "000001"}], 2: [{"code": "000001"}]}
+        # 两个用户须同时在处理中才能越过屏障，串行执行会超时
+        barrier = threading.Barrier(2, timeout=5)
+        mock_process.side_effect = lambda **kwargs: barrier.wait()
+
+        scheduler.check_subscriptions()
+
+        assert mock_process.call_count == 2
+        assert not barrier.broken
+
+
+class TestSubscriptionTimes:
+
+    def test_single_update_for_batch(self, db_mocks):
+        from app.services.subscription import update_notification_time
+
+        update_notification_time([3, 5, 8])
+
+        sql, params = db_mocks.cur.execute.call_args[0]
+        assert db_mocks.cur.execute.call_count == 1
+        assert "IN (%s, %s, %s)" in sql and params == [3, 5, 8]
+        db_mocks.release.assert_called_once()
+
+    def test_empty_batch_skips_db(self, db_mocks):
+        from app.services.subscription import update_digest_time
+        update_digest_time([])
+        db_mocks.conn.assert_not_called()
+
+
+class TestValuationThrottle:
+
+    def test_waits_only_when_window_full(self):
+        clock = {"now": 100.0}
+        sleeps = []
+
+        def fake_sleep(seconds):
+            sleeps.append(round(seconds, 3))
+            clock["now"] += seconds
+
+        with patch.object(scheduler, "VALUATION_RATE_LIMIT", 2), \
+                patch("app.services.scheduler.time.monotonic", side_effect=lambda: clock["now"]), \
+                patch("app.services.scheduler.time.sleep", side_effect=fake_sleep):
+            scheduler._throttle()
+            clock["now"] += 0.25
+            scheduler._throttle()
+            scheduler._throttle()
+
+        assert sleeps == [0.75]
+
+
+class TestCleanupIntraday:
+
+    @patch("app.services.scheduler.get_db_connection")
+    def test_reuses_caller_connection(self, mock_get):
+        conn = MagicMock()
+        conn.cursor.return_value.rowcount = 0
+
+        scheduler.cleanup_old_intraday_data(conn)
+
+        mock_get.assert_not_called()
+        conn.commit.assert_called_once()
+        conn.close.assert_not_called()
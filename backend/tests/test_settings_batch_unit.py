@@ -0,0 +1,108 @@
+"""Unit tests for batched settings/preferences writes — no DB required."""
+import os
+
+from unittest.mock import patch, MagicMock
+from fastapi.testclient import TestClient
+from fastapi import FastAPI
+
+from app.routers.settings import router
+from app.auth import get_current_user, require_admin
+
+
+app = FastAPI()
+app.include_router(router)
+
+FAKE_USER = {"id": 2, "user_id": 2, "username": "bob", "role": "admin"}
+app.dependency_overrides[get_current_user] = lambda: FAKE_USER
+app.dependency_overrides[require_admin] = lambda: FAKE_USER
+
+client = TestClient(app)
+
+
+def _mock_conn():
+    mock_cur = MagicMock()
+    conn = MagicMock()
+    conn.cursor.return_value = mock_cur
+    return conn, mock_cur
+
+
+class TestBatchedUpserts:
+
+    @patch("app.routers.settings.release_db_connection")
+    @patch("app.routers.settings.get_db_connection")
+    def test_preferences_single_executemany(self, mock_get_conn, mock_release):
+        conn, mock_cur = _mock_conn()
+        mock_get_conn.return_value = conn
+
+        resp = client.post("/preferences", json={"watchlist": "[]", "currentAccount": 3})
+        assert resp.status_code == 200
+        mock_cur.execute.assert_not_called()
+        assert mock_cur.executemany.call_count == 1
+        sql, rows = mock_cur.executemany.call_args[0]
+        assert "CURRENT_TIMESTAMP)" not in sql.split("ON DUPLICATE")[0]
+        assert rows == [(2, "watchlist", "[]"), (2, "current_account", "3")]
+        conn.commit.assert_called_once()
+
+    @patch("app.routers.settings.Config")
+    @patch("app.routers.settings.encrypt_value", side_effect=lambda v: f"enc:{v}")
+    @patch("app.routers.settings.release_db_connection")
+    @patch("app.routers.settings.get_db_connection")
+    def test_settings_skip_masked_and_encrypt(self, mock_get_conn, mock_release, mock_encrypt, mock_config):
+        conn, mock_cur = _mock_conn()
+        mock_get_conn.return_value = conn
+
+        resp = client.post("/settings", json={"settings": {
+            "OPENAI_API_KEY": "sk-1", "SMTP_PASSWORD": "***", "AI_MODEL_NAME": "gpt",
+        }})
+        assert resp.status_code == 200
+        assert mock_cur.executemany.call_count == 1
+        rows = mock_cur.executemany.call_args[0][1]
+        assert rows == [("OPENAI_API_KEY", "enc:sk-1", True), ("AI_MODEL_NAME", "gpt", False)]
+        mock_config.update_in_place.assert_called_once_with({"OPENAI_API_KEY": "sk-1", "AI_MODEL_NAME": "gpt"})
+        mock_config.reload.assert_not_called()
+
+
+class TestGetPreferences:
+
+    @patch("app.routers.settings.release_db_connection")
+    @patch("app.routers.settings.get_db_connection")
+    def test_only_preference_keys_selected(self, mock_get_conn, mock_release):
+        conn, mock_cur = _mock_conn()
+        mock_cur.fetchall.return_value = [{"key": "current_account", "value": "3"}]
+        mock_get_conn.return_value = conn
+
+        data = client.get("/preferences").json()
+        assert data == {"watchlist": "[]", "currentAccount": 3, "sortOption": None}
+        assert "IN ('watchlist', 'current_account', 'sort_option')" in mock_cur.execute.call_args[0][0]
+
+
+class TestConfigUpdateInPlace:
+
+    def teardown_method(self):
+        import app.config as config
+        config._invalidate_settings_cache()
+        config.Config._apply({})
+
+    @patch("app.config._load_settings_from_db")
+    def test_merges_into_fresh_cache_without_db(self, mock_load):
+        import time
+        import app.config as config
+        config._settings_cache = {"AI_MODEL_NAME": "old", "SMTP_PORT": "25"}
+        config._settings_cache_ts = time.monotonic()
+
+        with patch.dict(os.environ, {}, clear=False):
+            os.environ.pop("AI_MODEL_NAME", None)
+            os.environ.pop("SMTP_PORT", None)
+            config.Config.update_in_place({"AI_MODEL_NAME": "gpt-4o", "SMTP_PORT": 465, "UNRELATED": "x"})
+
+        mock_load.assert_not_called()
+        assert config.Config.AI_MODEL_NAME == "gpt-4o"
+        assert config.Config.SMTP_PORT == 465
+        assert "UNRELATED" not in config._settings_cache
+
+    @patch("app.config._load_settings_from_db", return_value={})
+    def test_falls_back_to_reload_without_cache(self, mock_load):
+        import app.config as config
+        config._invalidate_settings_cache()
+        config.Config.update_in_place({"AI_MODEL_NAME": "gpt-4o"})
+        mock_load.assert_called_once()
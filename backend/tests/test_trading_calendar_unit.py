@@ -0,0 +1,23 @@
+"""Unit tests for services.trading_calendar confirm-date rules — no DB required."""
+from datetime import datetime, date, timezone
+
+from app.services.trading_calendar import get_confirm_date, confirm_date_to_str
+
+
+class TestConfirmDate:
+
+    def test_before_cutoff_same_day(self):
+        assert get_confirm_date(datetime(2026, 3, 2, 14, 59)) == date(2026, 3, 2)
+
+    def test_cutoff_and_after_next_trading_day(self):
+        assert get_confirm_date(datetime(2026, 3, 2, 15, 0)) == date(2026, 3, 3)
+        assert get_confirm_date(datetime(2026, 3, 6, 16, 30)) == date(2026, 3, 9)
+
+    def test_weekend_rolls_to_monday(self):
+        assert get_confirm_date(datetime(2026, 3, 7, 9, 0)) == date(2026, 3, 9)
+
+    def test_aware_timestamp_compared_as_naive(self):
+        assert get_confirm_date(datetime(2026, 3, 2, 14, 0, tzinfo=timezone.utc)) == date(2026, 3, 2)
+
+    def test_date_string(self):
+        assert confirm_date_to_str(date(2026, 3, 9)) == "2026-03-09"
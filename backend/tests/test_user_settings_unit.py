@@ -2,10 +2,7 @@
 
 Tests the get_user_effective_settings logic and the USER_CONFIGURABLE_KEYS / ENCRYPTED_FIELDS constants.
 """
-import os
-import sys
-
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import pytest
 
 from app.routers.settings import (
     ENCRYPTED_FIELDS,
@@ -19,62 +16,68 @@ from app.routers.settings import (
 class TestUserSettingsConstants:
     """Verify the constants are correctly defined."""
 
-    def test_encrypted_fields_contains_sensitive_keys(self):
-        assert "OPENAI_API_KEY" in ENCRYPTED_FIELDS
-        assert "SMTP_PASSWORD" in ENCRYPTED_FIELDS
-
-    def test_encrypted_fields_does_not_contain_non_sensitive(self):
-        assert "OPENAI_API_BASE" not in ENCRYPTED_FIELDS
-        assert "AI_MODEL_NAME" not in ENCRYPTED_FIELDS
-        assert "SMTP_HOST" not in ENCRYPTED_FIELDS
-
-    def test_user_configurable_keys_includes_ai_settings(self):
-        assert "OPENAI_API_KEY" in USER_CONFIGURABLE_KEYS
-        assert "OPENAI_API_BASE" in USER_CONFIGURABLE_KEYS
-        assert "AI_MODEL_NAME" in USER_CONFIGURABLE_KEYS
+    def test_encrypted_fields_partitioning(self):
+        assert {"OPENAI_API_KEY", "SMTP_PASSWORD"} <= ENCRYPTED_FIELDS
+        assert {"OPENAI_API_BASE", "AI_MODEL_NAME", "SMTP_HOST"}.isdisjoint(ENCRYPTED_FIELDS)
 
-    def test_user_configurable_keys_includes_smtp_settings(self):
-        assert "SMTP_HOST" in USER_CONFIGURABLE_KEYS
-        assert "SMTP_PORT" in USER_CONFIGURABLE_KEYS
-        assert "SMTP_USER" in USER_CONFIGURABLE_KEYS
-        assert "SMTP_PASSWORD" in USER_CONFIGURABLE_KEYS
-        assert "EMAIL_FROM" in USER_CONFIGURABLE_KEYS
-
-    def test_user_configurable_keys_does_not_include_system_keys(self):
+    def test_user_configurable_keys_contract(self):
+        required = {"OPENAI_API_KEY", "OPENAI_API_BASE", "AI_MODEL_NAME",
+                    "SMTP_HOST", "SMTP_PORT", "SMTP_USER", "SMTP_PASSWORD", "EMAIL_FROM"}
+        assert required <= USER_CONFIGURABLE_KEYS
         # Users should not be able to set system-level keys
         assert "INTRADAY_COLLECT_INTERVAL" not in USER_CONFIGURABLE_KEYS
+        missing = ENCRYPTED_FIELDS - USER_CONFIGURABLE_KEYS
+        assert not missing, f"encrypted but not user-configurable: {missing}"
+
+
+EMAIL_CASES = (
+    ("test@example.com", True),
+    ("user@example.com", True),
+    ("user.name+tag@domain.co", True),
+    ("a.b+c@d.co", True),
+    ("", False),
+    ("notanemail", False),
+    ("noat", False),
+    ("@no-local.com", False),
+)
 
-    def test_all_encrypted_fields_are_configurable(self):
-        # Every encrypted field should be in the user-configurable set
-        for field in ENCRYPTED_FIELDS:
-            assert field in USER_CONFIGURABLE_KEYS, f"{field} is encrypted but not user-configurable"
-
-
-class TestValidatorsStillWork:
-    """Ensure existing validators are not broken by the changes."""
+URL_CASES = (
+    ("https://api.deepseek.com", True),
+    ("https://api.openai.com/v1", True),
+    ("http://localhost:8080", True),
+    ("http://localhost:8080/v1", True),
+    ("ftp://bad", False),
+    ("not a url", False),
+    ("not-a-url", False),
+    ("", False),
+)
 
-    def test_email_valid(self):
-        assert validate_email("test@example.com")
-        assert validate_email("user.name+tag@domain.co")
+PORT_CASES = (
+    ("1", True),
+    ("80", True),
+    ("443", True),
+    ("587", True),
+    ("65535", True),
+    ("0", False),
+    ("70000", False),
+    ("99999", False),
+    ("abc", False),
+    ("²", False),
+    ("8_0", False),
+)
 
-    def test_email_invalid(self):
-        assert not validate_email("")
-        assert not validate_email("notanemail")
 
-    def test_url_valid(self):
-        assert validate_url("https://api.deepseek.com")
-        assert validate_url("http://localhost:8080/v1")
+class TestValidators:
+    """Validators shared by global and user-level settings; cases merged from both suites."""
 
-    def test_url_invalid(self):
-        assert not validate_url("not-a-url")
-        assert not validate_url("")
+    @pytest.mark.parametrize("email, ok", EMAIL_CASES)
+    def test_validate_email(self, email, ok):
+        assert validate_email(email) is ok
 
-    def test_port_valid(self):
-        assert validate_port("587")
-        assert validate_port("1")
-        assert validate_port("65535")
+    @pytest.mark.parametrize("url, ok", URL_CASES)
+    def test_validate_url(self, url, ok):
+        assert validate_url(url) is ok
 
-    def test_port_invalid(self):
-        assert not validate_port("0")
-        assert not validate_port("70000")
-        assert not validate_port("abc")
+    @pytest.mark.parametrize("port, ok", PORT_CASES)
+    def test_validate_port(self, port, ok):
+        assert validate_port(port) is ok